@@ -1,13 +1,26 @@
 # app.py
 import os
+import shutil
 import logging
-from flask import Flask, request, jsonify, render_template, flash, redirect, url_for
-from parser import parse_scoutsuite_file
-from refactor import store_master_doc, refactor_and_store_resources
-from mongo_connect import db
-from scout_runner import run_scout_suite
+from flask import Flask, Response, request, jsonify, render_template, flash, redirect, url_for, stream_with_context
+from parser import open_report, resolve_report_path
+from ingest import ingest_report_stream
+from history import find_resources_as_of, find_scan, parse_timestamp
+from summaries import find_summary, latest_summaries, recent_summaries
+from response_cache import report_cache, response_cache, wants_ndjson
+from queries import (QueryError, QueryTimeout, build_resource_filter, find_resource_page, iter_json_array,
+                     iter_ndjson, iter_resource_docs, live_filter, parse_fields, parse_limit)
+from findings import build_findings_filter, find_findings_page, findings_summary
+from exposure import build_exposure_filter, find_exposure_page
+from trends import TRENDS_MAX_RANGE_DAYS, find_trends
+from retention import delete_policy, list_policies, parse_policy, retention_engine, set_policy
+from mongo_connect import db, db_connection
+from jobs import scan_queue
+from migrations import run_migrations
 from report_manager import report_manager
-from datetime import datetime
+from report_upload import UploadError, receive_report
+from scan_progress import scan_progress
+from datetime import datetime, timedelta, timezone
 
 # Configure logging
 SCOUT_LOG_DIR = os.path.join(os.path.dirname(__file__), "logs", "scout")
@@ -28,6 +41,60 @@ AWS_REGIONS = [
     'sa-east-1', 'ca-central-1'
 ]
 
+
+def _as_of_arg():
+    """
+    Parses the optional ?as_of= query parameter (ISO 8601 or report timestamp).
+    Raises ValueError on a malformed value.
+    """
+    as_of = request.args.get("as_of")
+    return parse_timestamp(as_of) if as_of else None
+
+
+def _list_resources(collection):
+    """
+    Shared implementation of the resource list endpoints.
+    With after= or limit= it returns one page: {"items": [...], "next_after": ...}.
+    Otherwise the whole listing is streamed, as a JSON array or, with
+    format=ndjson (or Accept: application/x-ndjson), as one document per line.
+    """
+    account_id = request.args.get("account_id")
+    if not account_id:
+        return jsonify({"error": "Missing account_id query parameter"}), 400
+
+    try:
+        as_of = _as_of_arg()
+    except ValueError:
+        return jsonify({"error": "Invalid as_of timestamp"}), 400
+
+    try:
+        filter = build_resource_filter(collection, account_id, request.args)
+        fields = parse_fields(request.args.get("fields"))
+        if "after" in request.args or "limit" in request.args:
+            page = find_resource_page(collection, filter, after=request.args.get("after"),
+                                      limit=parse_limit(request.args.get("limit")), fields=fields, as_of=as_of)
+            return jsonify({"items": page.items, "next_after": page.next_after})
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+
+    docs = iter_resource_docs(collection, filter, fields=fields, as_of=as_of)
+    if wants_ndjson():
+        return Response(stream_with_context(iter_ndjson(docs)), mimetype="application/x-ndjson")
+    return Response(stream_with_context(iter_json_array(docs)), mimetype="application/json")
+
+
+def _resource_view_page(collection, account_id, fields):
+    """One page of resources for the HTML views, from the same backend as the list endpoints."""
+    if not account_id:
+        return [], None
+    try:
+        page = find_resource_page(collection, {"account_id": account_id}, after=request.args.get("after"),
+                                  limit=parse_limit(request.args.get("limit")), fields=fields)
+    except QueryError as e:
+        flash(str(e), "danger")
+        return [], None
+    return page.items, page.next_after
+
 # -------------------------------------------------------------------
 # UI Routes
 # -------------------------------------------------------------------
@@ -35,36 +102,26 @@ AWS_REGIONS = [
 def index():
     """Home page with dashboard overview"""
     account_id = request.args.get("account_id")
-    accounts = list(db.master.distinct("account_id"))
-    
-    if account_id:
-        ec2_count = db.ec2_instances.count_documents({"account_id": account_id})
-        s3_count = db.s3_buckets.count_documents({"account_id": account_id})
-        iam_count = db.iam_users.count_documents({"account_id": account_id})
-    else:
-        ec2_count = s3_count = iam_count = 0
-        if accounts:
-            account_id = accounts[0]
-
-    # Get recent scans
+    # Latest summary of every account: one indexed query instead of counts per collection
+    summaries = {summary["account_id"]: summary for summary in latest_summaries()}
+    accounts = list(summaries)
+
+    if not account_id and accounts:
+        account_id = accounts[0]
+    summary = summaries.get(account_id) or {}
+    resource_counts = summary.get("resource_counts", {})
+    ec2_count = resource_counts.get("ec2_instances", 0)
+    s3_count = resource_counts.get("s3_buckets", 0)
+    iam_count = resource_counts.get("iam_users", 0)
+
+    # Get recent scans (summaries only exist for completed ingests)
     recent_scans = []
-    for doc in db.master.find().sort("timestamp", -1).limit(5):
-        status_file = os.path.join(SCOUT_LOG_DIR, f"{doc.get('username', 'unknown')}.status.txt")
-        status = "completed"
-        if os.path.exists(status_file):
-            with open(status_file, "r") as f:
-                status = f.read().strip()
-        
+    for doc in recent_summaries(5):
         recent_scans.append({
-            "account_name": doc.get("account_name", "Unknown"),
-            "timestamp": doc.get("timestamp", "Unknown"),
-            "status": status,
-            "status_color": {
-                "completed": "success",
-                "running": "info",
-                "error": "danger",
-                "stopped": "warning"
-            }.get(status, "secondary")
+            "account_name": doc.get("account_name") or "Unknown",
+            "timestamp": doc.get("report_timestamp") or doc["scan_time"].strftime("%Y%m%d_%H%M%S"),
+            "status": "completed",
+            "status_color": "success"
         })
 
     return render_template(
@@ -87,55 +144,64 @@ def run_scan_page():
         aws_regions=AWS_REGIONS
     )
 
+# Fields shown by ec2.html
+EC2_VIEW_FIELDS = ["instance_id", "tags", "instance_type", "state", "region", "public_ip_address",
+                    "private_ip_address", "launch_time"]
+
 @app.route("/ec2")
 def view_ec2():
     """Page to view EC2 instances"""
     account_id = request.args.get("account_id")
     accounts = list(db.master.distinct("account_id"))
     
-    instances = []
-    if account_id:
-        instances = list(db.ec2_instances.find({"account_id": account_id}, {"_id": False}))
-    
+    instances, next_after = _resource_view_page("ec2_instances", account_id, EC2_VIEW_FIELDS)
+
     return render_template(
         "ec2.html",
         accounts=[{"id": id, "name": id} for id in accounts],
         instances=instances,
-        selected_account=account_id
+        selected_account=account_id,
+        next_after=next_after
     )
 
+# Fields shown by s3.html
+S3_VIEW_FIELDS = ["name", "region", "CreationDate", "versioning_status_enabled", "default_encryption_enabled",
+                   "public_access_block_configuration", "logging"]
+
 @app.route("/s3")
 def view_s3():
     """Page to view S3 buckets"""
     account_id = request.args.get("account_id")
     accounts = list(db.master.distinct("account_id"))
     
-    buckets = []
-    if account_id:
-        buckets = list(db.s3_buckets.find({"account_id": account_id}, {"_id": False}))
-    
+    buckets, next_after = _resource_view_page("s3_buckets", account_id, S3_VIEW_FIELDS)
+
     return render_template(
         "s3.html",
         accounts=[{"id": id, "name": id} for id in accounts],
         buckets=buckets,
-        selected_account=account_id
+        selected_account=account_id,
+        next_after=next_after
     )
 
+# Fields shown by iam.html
+IAM_VIEW_FIELDS = ["name", "arn", "create_date", "access_keys", "mfa_devices", "password_last_used",
+                    "groups", "policies"]
+
 @app.route("/iam")
 def view_iam():
     """Page to view IAM users"""
     account_id = request.args.get("account_id")
     accounts = list(db.master.distinct("account_id"))
     
-    users = []
-    if account_id:
-        users = list(db.iam_users.find({"account_id": account_id}, {"_id": False}))
-    
+    users, next_after = _resource_view_page("iam_users", account_id, IAM_VIEW_FIELDS)
+
     return render_template(
         "iam.html",
         accounts=[{"id": id, "name": id} for id in accounts],
         users=users,
-        selected_account=account_id
+        selected_account=account_id,
+        next_after=next_after
     )
 
 # -------------------------------------------------------------------
@@ -146,9 +212,12 @@ def scan():
     """
     Expects JSON body:
       {
-        "file_path": "/path/to/new2.js"
+        "file_path": "/path/to/new2.js",
+        "batch_size": 1000,  # optional, upserts per bulk write
+        "account_name": "myAccount",  # optional, recorded in the scan history
+        "timestamp": "20240215_123456"  # optional, recorded in the scan history
       }
-    1. Parse the file.
+    1. Parse the file, one service section at a time.
     2. Store raw doc in 'master'.
     3. Refactor into separate collections.
     """
@@ -161,42 +230,45 @@ def scan():
         return jsonify({"error": f"File not found: {file_path}"}), 400
 
     try:
-        parsed_data = parse_scoutsuite_file(file_path)
-    except Exception as e:
+        # Store raw doc in 'master' and refactor into resource-specific collections,
+        # one service section at a time
+        with open_report(resolve_report_path(file_path)) as fp:
+            result = ingest_report_stream(fp, batch_size=data.get("batch_size"), account_name=data.get("account_name"),
+                                          report_timestamp=data.get("timestamp"), label=file_path)
+    except KeyError as e:
+        logger.error(f"Rejected scan data: {str(e)}")
+        return jsonify({"error": f"Invalid report: {str(e)}"}), 400
+    except ValueError as e:
         logger.error(f"Failed to parse file: {str(e)}")
         return jsonify({"error": f"Failed to parse file: {str(e)}"}), 500
-
-    account_id = parsed_data.get("account_id", None)
-    if not account_id:
-        return jsonify({"error": "No 'account_id' found in parsed data"}), 400
-
-    try:
-        # 1) Store raw doc in 'master'
-        store_master_doc(parsed_data, account_id)
-
-        # 2) Refactor data into resource-specific collections
-        refactor_and_store_resources(parsed_data)
-
-        logger.info(f"Successfully processed scan data for account {account_id}")
-        return jsonify({"message": "Scan data processed successfully", "account_id": account_id})
     except Exception as e:
         logger.error(f"Failed to store/refactor data: {str(e)}")
         return jsonify({"error": f"Failed to process data: {str(e)}"}), 500
 
+    logger.info(f"Successfully processed scan data for account {result['account_id']}")
+    return jsonify({
+        "message": "Scan data processed successfully",
+        "account_id": result["account_id"],
+        "scan_id": result["scan_id"],
+        "collections": result["collections"]
+    })
+
 # -------------------------------------------------------------------
 # 2. Endpoint to run Scout Suite scan
 # -------------------------------------------------------------------
 @app.route("/scout/run", methods=["POST"])
 def run_scout():
     """
-    Trigger a Scout Suite scan and process results
+    Queue a Scout Suite scan; it runs and is processed in the background.
+    Returns the job ID right away (202), to be polled on /scout/status/<job_id>.
     Expected JSON body:
     {
         "account_name": "myAccount",
         "profile_name": "default",
         "region": "us-east-1",  # optional
-        "output_dir": "/path/to/output",  # optional
-        "username": "user123"  # optional
+        "username": "user123",  # optional
+        "priority": "normal",  # optional: high, normal, low or an integer (lower runs first)
+        "batch_size": 1000  # optional, upserts per bulk write
     }
     """
     data = request.get_json()
@@ -204,50 +276,47 @@ def run_scout():
         return jsonify({"error": "Missing required fields"}), 400
 
     try:
-        logger.info(f"Starting Scout Suite scan for account {data['account_name']}")
-        
-        # Run Scout Suite scan
-        output_path = run_scout_suite(
+        job_id = scan_queue.submit(
             account_name=data["account_name"],
             profile_name=data.get("profile_name", "default"),
             region=data.get("region"),
-            output_dir=data.get("output_dir"),
-            username=data.get("username")
+            username=data.get("username"),
+            priority=data.get("priority"),
+            batch_size=data.get("batch_size")
         )
-
-        # Parse the results
-        parsed_data = parse_scoutsuite_file(output_path)
-        
-        # Store in MongoDB
-        account_id = parsed_data.get("account_id")
-        if not account_id:
-            logger.error("No account_id found in scan results")
-            return jsonify({"error": "No account_id found in scan results"}), 500
-
-        store_master_doc(parsed_data, account_id)
-        refactor_and_store_resources(parsed_data)
-
-        logger.info(f"Successfully completed Scout Suite scan for account {account_id}")
-        return jsonify({
-            "message": "Scout Suite scan completed and processed",
-            "account_id": account_id
-        })
-
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        logger.error(f"Failed to run Scout Suite scan: {str(e)}")
+        logger.error(f"Failed to queue Scout Suite scan: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+    return jsonify({
+        "message": "Scout Suite scan queued",
+        "job_id": job_id,
+        "status_url": url_for("get_scan_status", job_id=job_id)
+    }), 202
+
 # -------------------------------------------------------------------
 # 3. Endpoint to get scan status
 # -------------------------------------------------------------------
-@app.route("/scout/status/<username>", methods=["GET"])
-def get_scan_status(username):
+@app.route("/scout/status/<job_id>", methods=["GET"])
+def get_scan_status(job_id):
     """
-    Get the status of a Scout Suite scan for a given username
+    Get the state, timings and exit code of a scan job.
+    Falls back to the legacy '<username>.status.txt' file for scans
+    started before the job queue existed.
     """
-    status_file = os.path.join(SCOUT_LOG_DIR, f"{username}.status.txt")
+    job = scan_queue.get(job_id)
+    if job:
+        job["job_id"] = job.pop("_id")
+        for key, value in job.items():
+            if isinstance(value, datetime):
+                job[key] = value.isoformat()
+        return jsonify(job)
+
+    status_file = os.path.join(SCOUT_LOG_DIR, f"{job_id}.status.txt")
     if not os.path.exists(status_file):
-        return jsonify({"error": f"No scan status found for user {username}"}), 404
+        return jsonify({"error": f"No scan job found with ID {job_id}"}), 404
 
     try:
         with open(status_file, "r") as f:
@@ -257,41 +326,71 @@ def get_scan_status(username):
         logger.error(f"Failed to read scan status: {str(e)}")
         return jsonify({"error": f"Failed to read scan status: {str(e)}"}), 500
 
+# -------------------------------------------------------------------
+# Live scan progress (server-sent events)
+# -------------------------------------------------------------------
+@app.route("/scout/progress/<job_id>", methods=["GET"])
+def stream_scan_progress(job_id):
+    """
+    Streams the progress events of a scan (stages, services fetched,
+    errors, and a final scan_finished with per-stage/per-service timings)
+    as text/event-stream. Resumes after the Last-Event-ID header or ?after=.
+    """
+    try:
+        after = int(request.headers.get("Last-Event-ID") or request.args.get("after") or 0)
+    except ValueError:
+        return jsonify({"error": "Last-Event-ID/after must be an event number"}), 400
+
+    try:
+        # Orchestrator scans have no scan_jobs entry, only events
+        if not scan_queue.get(job_id) and not scan_progress.events(job_id):
+            return jsonify({"error": f"No scan job found with ID {job_id}"}), 404
+    except Exception as e:
+        logger.error(f"Failed to look up scan {job_id}: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+    return Response(stream_with_context(scan_progress.stream(job_id, after)), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # -------------------------------------------------------------------
 # 4. Example endpoint: get all EC2 instances for an account
 # -------------------------------------------------------------------
 @app.route("/ec2/instances", methods=["GET"])
+@response_cache.cached
 def get_ec2_instances():
     """
-    Query param: ?account_id=430150006394
+    Query params: ?account_id=430150006394[&as_of=2024-03-25T12:00:00Z]
     Returns all EC2 instances from the 'ec2_instances' collection
-    for the given account.
+    for the given account, or as they were at `as_of`.
+    Also takes after=, limit=, fields=, format=ndjson and filters on
+    region, vpc_id, instance_id (see _list_resources).
     """
-    account_id = request.args.get("account_id")
-    if not account_id:
-        return jsonify({"error": "Missing account_id query parameter"}), 400
-
-    cursor = db["ec2_instances"].find({"account_id": account_id}, {"_id": False})
-    instances = list(cursor)
-    return jsonify(instances)
+    return _list_resources("ec2_instances")
 
 # -------------------------------------------------------------------
 # 5. Example endpoint: get one EC2 instance by instance_id
 # -------------------------------------------------------------------
 @app.route("/ec2/instances/<instance_id>", methods=["GET"])
+@response_cache.cached
 def get_ec2_instance(instance_id):
     """
-    Query param: ?account_id=430150006394
+    Query params: ?account_id=430150006394[&as_of=2024-03-25T12:00:00Z]
     Return details of one instance by instance_id.
     """
     account_id = request.args.get("account_id")
     if not account_id:
         return jsonify({"error": "Missing account_id query parameter"}), 400
 
-    doc = db["ec2_instances"].find_one(
-        {"account_id": account_id, "instance_id": instance_id},
-        {"_id": False}
-    )
+    try:
+        as_of = _as_of_arg()
+    except ValueError:
+        return jsonify({"error": "Invalid as_of timestamp"}), 400
+
+    filter = {"account_id": account_id, "instance_id": instance_id}
+    if as_of is not None:
+        doc = next(find_resources_as_of("ec2_instances", filter, as_of, limit=1), None)
+    else:
+        doc = db["ec2_instances"].find_one(live_filter(filter), {"_id": False})
     if not doc:
         return jsonify({"error": f"Instance {instance_id} not found"}), 404
 
@@ -301,35 +400,147 @@ def get_ec2_instance(instance_id):
 # 6. Example endpoint: get all S3 buckets
 # -------------------------------------------------------------------
 @app.route("/s3/buckets", methods=["GET"])
+@response_cache.cached
 def get_s3_buckets():
     """
-    Query param: ?account_id=430150006394
+    Query params: ?account_id=430150006394[&as_of=2024-03-25T12:00:00Z]
     Return all buckets from the 's3_buckets' collection for that account.
+    Also takes after=, limit=, fields=, format=ndjson and filters on
+    region, name (see _list_resources).
     """
-    account_id = request.args.get("account_id")
-    if not account_id:
-        return jsonify({"error": "Missing account_id query parameter"}), 400
-
-    cursor = db["s3_buckets"].find({"account_id": account_id}, {"_id": False})
-    buckets = list(cursor)
-    return jsonify(buckets)
+    return _list_resources("s3_buckets")
 
 # -------------------------------------------------------------------
 # 7. Example: get all IAM users
 # -------------------------------------------------------------------
 @app.route("/iam/users", methods=["GET"])
+@response_cache.cached
 def get_iam_users():
     """
-    Query param: ?account_id=430150006394
+    Query params: ?account_id=430150006394[&as_of=2024-03-25T12:00:00Z]
     Return all IAM users from 'iam_users' collection.
+    Also takes after=, limit=, fields=, format=ndjson and filters on
+    name (see _list_resources).
     """
-    account_id = request.args.get("account_id")
-    if not account_id:
-        return jsonify({"error": "Missing account_id query parameter"}), 400
+    return _list_resources("iam_users")
 
-    cursor = db["iam_users"].find({"account_id": account_id}, {"_id": False})
-    users = list(cursor)
-    return jsonify(users)
+# -------------------------------------------------------------------
+# Findings: one document per flagged item (findings.py)
+# -------------------------------------------------------------------
+@app.route("/findings", methods=["GET"])
+@response_cache.cached
+def get_findings():
+    """
+    Query params: ?account_id=430150006394[&level=danger][&service=ec2][&rule=...][&resource_id=sg-...]
+    One page of the account's flagged items: {"items": [...], "next_after": ...},
+    by level, service, rule and item; pass next_after as after= for the next page.
+    With resource_id=, account_id is optional and the lookup spans accounts.
+    """
+    try:
+        filter = build_findings_filter(request.args.get("account_id"), request.args, ignore=("after", "limit"))
+        items, next_after = find_findings_page(filter, after=request.args.get("after"),
+                                               limit=parse_limit(request.args.get("limit")))
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except QueryTimeout as e:
+        return jsonify({"error": str(e)}), 504
+    return jsonify({"items": items, "next_after": next_after})
+
+@app.route("/findings/summary", methods=["GET"])
+@response_cache.cached
+def get_findings_summary():
+    """
+    Query params: ?account_id=430150006394[&level=danger][&service=ec2][&rule=...][&resource_id=...]
+    Flagged item counts: total, by level, by service and level, and per rule.
+    """
+    try:
+        filter = build_findings_filter(request.args.get("account_id"), request.args)
+        return jsonify(findings_summary(filter))
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except QueryTimeout as e:
+        return jsonify({"error": str(e)}), 504
+
+# -------------------------------------------------------------------
+# Findings trends: daily/weekly rollups (trends.py)
+# -------------------------------------------------------------------
+@app.route("/trends", methods=["GET"])
+@response_cache.cached
+def get_trends():
+    """
+    Query params: ?[account_id=430150006394][&period=day|week][&from=...][&to=...]
+                  [&rule=...][&service=ec2][&level=danger][&by_rule=1]
+    Flagged items per day or week, of the account or, without account_id,
+    org-wide: {"points": [{"start", "flagged_items", "by_level", ...}]}.
+    The range defaults to the last TRENDS_MAX_RANGE_DAYS days up to now.
+    """
+    try:
+        until = parse_timestamp(request.args["to"]) if request.args.get("to") else datetime.now(timezone.utc)
+        since = parse_timestamp(request.args["from"]) if request.args.get("from") \
+            else until - timedelta(days=TRENDS_MAX_RANGE_DAYS)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid from/to: {str(e)}"}), 400
+    try:
+        return jsonify(find_trends(request.args.get("account_id"), request.args.get("period", "day"), since, until,
+                                   rule=request.args.get("rule"), service=request.args.get("service"),
+                                   level=request.args.get("level"), by_rule=request.args.get("by_rule") == "1"))
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except QueryTimeout as e:
+        return jsonify({"error": str(e)}), 504
+
+# -------------------------------------------------------------------
+# Network exposure: what security groups and public endpoints let in (exposure.py)
+# -------------------------------------------------------------------
+@app.route("/exposure", methods=["GET"])
+@response_cache.cached
+def get_exposure():
+    """
+    Query params: ?[account_id=430150006394][&port=22][&protocol=tcp][&cidr=0.0.0.0/0][&match=contains|within]
+                  [&public=1][&resource_id=i-...][&security_group=sg-...][&region=...][&resource_type=...]
+    One page of {resource, protocol, port range, source} entries:
+    {"items": [...], "next_after": ...}. port= matches ranges containing the
+    port; cidr= sources containing that address/network, or with match=within
+    sources inside it; public=1 sources that aren't private ranges. Without
+    account_id the lookup spans accounts and needs port, cidr, resource_id
+    or security_group.
+    """
+    try:
+        filter = build_exposure_filter(request.args, ignore=("after", "limit"))
+        items, next_after = find_exposure_page(filter, after=request.args.get("after"),
+                                               limit=parse_limit(request.args.get("limit")))
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except QueryTimeout as e:
+        return jsonify({"error": str(e)}), 504
+    return jsonify({"items": items, "next_after": next_after})
+
+# -------------------------------------------------------------------
+# Health check
+# -------------------------------------------------------------------
+@app.route("/health", methods=["GET"])
+def health():
+    """
+    MongoDB state as last seen by the background health monitor;
+    503 until a ping has succeeded, and whenever the last one failed.
+    """
+    db_connection.get_db()
+    state = db_connection.health()
+    return jsonify(state), 200 if state["healthy"] else 503
+
+# -------------------------------------------------------------------
+# Response cache counters
+# -------------------------------------------------------------------
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    """
+    Hit/miss/eviction counters of this process's response cache,
+    to size RESPONSE_CACHE_MAX_ENTRIES / RESPONSE_CACHE_MAX_BYTES,
+    and of its report cache ("reports").
+    """
+    stats = response_cache.stats()
+    stats["reports"] = report_cache.stats()
+    return jsonify(stats)
 
 # -------------------------------------------------------------------
 # 8. Endpoint to upload and process an existing report
@@ -354,47 +565,98 @@ def upload_report():
         return jsonify({"error": f"Report file not found: {report_path}"}), 400
 
     try:
-        # Parse the report
-        parsed_data = parse_scoutsuite_file(report_path)
-        
-        # Store in MongoDB
-        account_id = parsed_data.get("account_id")
-        if not account_id:
-            logger.error("No account_id found in report")
-            return jsonify({"error": "No account_id found in report"}), 500
-
-        store_master_doc(parsed_data, account_id)
-        refactor_and_store_resources(parsed_data)
-
-        # Copy report to managed directory if timestamp is provided
+        # Copy report to managed directory if timestamp is provided, and catalog it
         if "timestamp" in data:
             target_dir = report_manager.get_report_path(data["account_name"], data["timestamp"])
             target_path = os.path.join(target_dir, "scoutsuite-results", "new2.js")
             os.makedirs(os.path.dirname(target_path), exist_ok=True)
-            with open(report_path, "rb") as src, open(target_path, "wb") as dst:
-                dst.write(src.read())
+            shutil.copyfile(report_path, target_path)
             logger.info(f"Copied report to managed directory: {target_path}")
+            report_manager.register_report(data["account_name"], data["timestamp"], target_path)
+
+        # Parse the report one service section at a time and store it in MongoDB
+        try:
+            with open_report(resolve_report_path(report_path)) as fp:
+                result = ingest_report_stream(fp, batch_size=data.get("batch_size"),
+                                              account_name=data["account_name"],
+                                              report_timestamp=data.get("timestamp"), label=report_path)
+        except Exception as e:
+            if "timestamp" in data:
+                report_manager.mark_failed(data["account_name"], data["timestamp"], str(e))
+            raise
+        if "timestamp" in data:
+            report_manager.mark_ingested(data["account_name"], data["timestamp"], result)
 
-        logger.info(f"Successfully processed report for account {account_id}")
+        logger.info(f"Successfully processed report for account {result['account_id']}")
         return jsonify({
             "message": "Report processed successfully",
-            "account_id": account_id
+            "account_id": result["account_id"],
+            "scan_id": result["scan_id"],
+            "collections": result["collections"]
         })
 
     except Exception as e:
         logger.error(f"Failed to process report: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+# -------------------------------------------------------------------
+# Streaming upload: the report itself is the request body
+# -------------------------------------------------------------------
+@app.route("/reports/<account_name>/upload", methods=["POST"])
+def stream_upload_report(account_name):
+    """
+    Receive a report as the request body (raw/chunked, or the file part of
+    a multipart/form-data form) and ingest it while it arrives.
+    Query parameters: timestamp (report directory, default now), batch_size.
+      curl -T new2.js -H "Transfer-Encoding: chunked" "http://host/reports/myAccount/upload"
+      curl -F "report=@new2.js" "http://host/reports/myAccount/upload?timestamp=20240215_123456"
+    """
+    timestamp = request.args.get("timestamp") or datetime.now().strftime("%Y%m%d_%H%M%S")
+    if os.sep in timestamp or os.sep in account_name or ".." in timestamp or ".." in account_name:
+        return jsonify({"error": "Invalid account name or timestamp"}), 400
+    try:
+        batch_size = int(request.args["batch_size"]) if request.args.get("batch_size") else None
+    except ValueError:
+        return jsonify({"error": "batch_size must be an integer"}), 400
+
+    try:
+        result = receive_report(request.stream, request.headers.get("Content-Type"), account_name, timestamp,
+                                batch_size=batch_size)
+    except (UploadError, KeyError, ValueError) as e:
+        logger.error(f"Rejected uploaded report: {str(e)}")
+        return jsonify({"error": f"Invalid report: {str(e)}"}), 400
+    except Exception as e:
+        logger.error(f"Failed to process uploaded report: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+    return jsonify({
+        "message": "Report processed successfully",
+        "account_id": result["account_id"],
+        "scan_id": result["scan_id"],
+        "timestamp": timestamp,
+        "bytes": result["bytes"],
+        "collections": result["collections"]
+    })
+
 # -------------------------------------------------------------------
 # 9. Endpoint to list reports for an account
 # -------------------------------------------------------------------
 @app.route("/reports/<account_name>", methods=["GET"])
 def list_reports(account_name):
     """
-    List all reports available for an account
+    List the reports of an account from the report catalog, newest first.
+    Optional since/until (ISO 8601 or report timestamps) bound the report
+    time, limit caps the number returned.
     """
     try:
-        reports = report_manager.list_account_reports(account_name)
+        since = parse_timestamp(request.args["since"]) if request.args.get("since") else None
+        until = parse_timestamp(request.args["until"]) if request.args.get("until") else None
+        limit = int(request.args.get("limit", 0))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid since/until/limit: {str(e)}"}), 400
+
+    try:
+        reports = report_manager.list_account_reports(account_name, since=since, until=until, limit=limit)
         return jsonify({
             "account_name": account_name,
             "reports": reports
@@ -403,22 +665,74 @@ def list_reports(account_name):
         logger.error(f"Failed to list reports: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+# -------------------------------------------------------------------
+# Report disk usage and archiver throughput
+# -------------------------------------------------------------------
+@app.route("/storage/reports", methods=["GET"])
+def report_storage():
+    """
+    Bytes on disk vs uncompressed per account, and what this process's
+    archiver has compressed/pruned so far.
+    """
+    try:
+        return jsonify(report_manager.storage_stats())
+    except Exception as e:
+        logger.error(f"Failed to get report storage stats: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+# -------------------------------------------------------------------
+# Retention: per-account policies and reclaimed bytes (retention.py)
+# -------------------------------------------------------------------
+@app.route("/storage/retention", methods=["GET"])
+def retention_storage():
+    """
+    What the last retention passes deleted and reclaimed (documents and
+    bytes per collection, reports, scout logs), and their totals.
+    """
+    return jsonify(retention_engine.stats())
+
+@app.route("/retention/policies", methods=["GET"])
+def get_retention_policies():
+    """The policy from the environment and those set per account (and 'default')."""
+    return jsonify(list_policies())
+
+@app.route("/retention/policies/<account>", methods=["PUT", "DELETE"])
+def put_retention_policy(account):
+    """
+    PUT {"keep_all_days": 7, "daily_days": 30, "weekly_days": 365} sets the
+    policy of an account (account_id or name, or 'default'); DELETE removes
+    it, so the default applies again.
+    """
+    if request.method == "DELETE":
+        if not delete_policy(account):
+            return jsonify({"error": f"No retention policy for {account}"}), 404
+        return jsonify({"account": account, "deleted": True})
+    try:
+        policy = parse_policy(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    set_policy(account, policy)
+    return jsonify({"account": account, **policy._asdict()})
+
 # -------------------------------------------------------------------
 # 10. Endpoint to get latest report for an account
 # -------------------------------------------------------------------
 @app.route("/reports/<account_name>/latest", methods=["GET"])
 def get_latest_report(account_name):
     """
-    Get the latest report for an account
+    Get the latest report for an account, or only one of its services
+    with ?service=ec2. Served from the report cache, with an ETag.
     """
+    service = request.args.get("service")
     try:
         report_path = report_manager.get_latest_report(account_name)
         if not report_path:
             return jsonify({"error": f"No reports found for account {account_name}"}), 404
 
-        # Parse and return the report data
-        parsed_data = parse_scoutsuite_file(report_path)
-        return jsonify(parsed_data)
+        response = report_cache.respond(report_path, service)
+        if response is None:
+            return jsonify({"error": f"Service '{service}' not found in the latest report"}), 404
+        return response
     except Exception as e:
         logger.error(f"Failed to get latest report: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -432,41 +746,40 @@ def view_report(account_name, timestamp):
     View a specific report for an account at a given timestamp
     """
     try:
-        # Get the master document from MongoDB
-        master_doc = db.master.find_one({"account_name": account_name, "timestamp": timestamp}, {"_id": False})
+        # Get the master document from MongoDB, via the scan ingested from this report if any
+        scan = find_scan(account_name, timestamp)
+        if scan:
+            master_doc = db.master.find_one({"account_id": scan["account_id"]}, {"_id": False})
+        else:
+            master_doc = db.master.find_one({"account_name": account_name, "timestamp": timestamp}, {"_id": False})
         if not master_doc:
             flash("Report not found", "danger")
             return redirect(url_for("index"))
 
-        # Get resource counts from respective collections
         account_id = master_doc.get("account_id")
         if not account_id:
             flash("Invalid report data: missing account ID", "danger")
             return redirect(url_for("index"))
 
-        # Get EC2 instances
-        ec2_instances = list(db.ec2_instances.find({"account_id": account_id}, {"_id": False}))
-        running_instances = [i for i in ec2_instances if i.get("state") == "running"]
-
-        # Get S3 buckets
-        s3_buckets = list(db.s3_buckets.find({"account_id": account_id}, {"_id": False}))
-        public_buckets = [b for b in s3_buckets if b.get("public_access")]
-
-        # Get IAM users
-        iam_users = list(db.iam_users.find({"account_id": account_id}, {"_id": False}))
-        mfa_users = [u for u in iam_users if u.get("mfa_devices")]
+        # Counts come from the summary materialized when this scan was ingested
+        summary = find_summary(account_id, scan["_id"] if scan else None) or {}
+        resource_counts = summary.get("resource_counts", {})
+        derived = summary.get("derived", {})
 
-        # Get findings from master document
-        findings = master_doc.get("findings", {})
+        # Rules with flagged items, per service, from the 'findings' collection. It only
+        # holds the account's latest scan, so older reports show their summary counts alone.
+        latest = find_summary(account_id)
+        findings_current = not scan or (latest is not None and latest.get("scan_id") == scan["_id"])
+        findings = {}
+        if findings_current:
+            for rule in findings_summary({"account_id": account_id})["by_rule"]:
+                findings.setdefault(rule["service"], []).append(rule)
 
         report_data = {
             "account_id": account_id,
-            "services": {
-                "ec2": {"instances": ec2_instances},
-                "s3": {"buckets": s3_buckets},
-                "iam": {"users": iam_users}
-            },
-            "findings": findings
+            "findings": findings,
+            "findings_current": findings_current,
+            "findings_summary": summary.get("findings", {})
         }
         
         return render_template(
@@ -474,12 +787,12 @@ def view_report(account_name, timestamp):
             account_name=account_name,
             timestamp=timestamp,
             report_data=report_data,
-            ec2_count=len(ec2_instances),
-            running_ec2_count=len(running_instances),
-            s3_count=len(s3_buckets),
-            public_s3_count=len(public_buckets),
-            iam_count=len(iam_users),
-            mfa_user_count=len(mfa_users)
+            ec2_count=resource_counts.get("ec2_instances", 0),
+            running_ec2_count=derived.get("running_ec2_instances", 0),
+            s3_count=resource_counts.get("s3_buckets", 0),
+            public_s3_count=derived.get("public_s3_buckets", 0),
+            iam_count=resource_counts.get("iam_users", 0),
+            mfa_user_count=derived.get("mfa_iam_users", 0)
         )
     except Exception as e:
         logger.error(f"Failed to view report: {str(e)}")
@@ -492,4 +805,9 @@ def view_report(account_name, timestamp):
 if __name__ == "__main__":
     # Ensure log directory exists
     os.makedirs(SCOUT_LOG_DIR, exist_ok=True)
+    # gunicorn runs these once from gunicorn.conf.py; here there is a single process
+    run_migrations()
+    report_manager.start_archiver()
+    retention_engine.start()
+    scan_queue.start()
     app.run(debug=True, host="0.0.0.0", port=5002)
@@ -0,0 +1,94 @@
+# async_db.py
+import os
+import asyncio
+import logging
+from typing import Any, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import ExecutionTimeout
+from mongo_connect import (MONGO_URI, DB_NAME, MAX_POOL_SIZE, MIN_POOL_SIZE, CONNECT_TIMEOUT_MS,
+                           SERVER_SELECTION_TIMEOUT_MS)
+from queries import MONGO_QUERY_TIMEOUT_MS, FindSpec, Query, QueryTimeout
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Queries in flight at once per process; the rest wait (within their timeout) for a slot
+ASYNC_MONGO_MAX_CONCURRENCY = int(os.getenv("ASYNC_MONGO_MAX_CONCURRENCY", str(MAX_POOL_SIZE)))
+
+
+class AsyncMongo:
+    """
+    One motor client per process for the FastAPI service, opened by start()
+    on application startup and closed by close() on shutdown.
+
+    Every query holds one of ASYNC_MONGO_MAX_CONCURRENCY slots and is bounded
+    by MONGO_QUERY_TIMEOUT_MS, both server side (maxTimeMS) and client side
+    (time spent waiting for a slot included), raising QueryTimeout.
+    """
+
+    def __init__(self, max_concurrency: int = ASYNC_MONGO_MAX_CONCURRENCY):
+        self.max_concurrency = max(1, max_concurrency)
+        self._client: Optional[AsyncIOMotorClient] = None
+        self._db = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    async def start(self) -> None:
+        if self._client is not None:
+            return
+        self._client = AsyncIOMotorClient(
+            MONGO_URI,
+            maxPoolSize=MAX_POOL_SIZE,
+            minPoolSize=MIN_POOL_SIZE,
+            connectTimeoutMS=CONNECT_TIMEOUT_MS,
+            serverSelectionTimeoutMS=SERVER_SELECTION_TIMEOUT_MS
+        )
+        self._db = self._client[DB_NAME]
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        logger.info(f"Async MongoDB client created for {MONGO_URI}")
+
+    async def close(self) -> None:
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+            self._db = None
+            logger.info("Async MongoDB client closed")
+
+    @property
+    def db(self):
+        if self._db is None:
+            raise RuntimeError("AsyncMongo.start() has not been called")
+        return self._db
+
+    async def _find(self, spec: FindSpec) -> Any:
+        async with self._slots:
+            cursor = self.db[spec.collection].find(spec.filter, spec.projection).max_time_ms(MONGO_QUERY_TIMEOUT_MS)
+            if spec.sort:
+                cursor = cursor.sort(spec.sort)
+            if spec.one:
+                docs = await cursor.limit(1).to_list(length=1)
+                return docs[0] if docs else None
+            if spec.limit:
+                cursor = cursor.limit(spec.limit)
+            return await cursor.to_list(length=None)
+
+    async def find(self, spec: FindSpec) -> Any:
+        """Runs one FindSpec."""
+        try:
+            return await asyncio.wait_for(self._find(spec), MONGO_QUERY_TIMEOUT_MS / 1000)
+        except (asyncio.TimeoutError, ExecutionTimeout) as e:
+            raise QueryTimeout(f"Query on '{spec.collection}' timed out after {MONGO_QUERY_TIMEOUT_MS} ms") from e
+
+    async def run_query(self, query: Query) -> Any:
+        """Drives a query function from queries.py to completion without blocking the event loop."""
+        try:
+            spec = next(query)
+            while True:
+                spec = query.send(await self.find(spec))
+        except StopIteration as done:
+            return done.value
+
+
+# Create global async MongoDB instance
+async_mongo = AsyncMongo()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Measures requests/sec and latency percentiles of running API servers, to
+compare the FastAPI resource service (resource_api.py) and the Flask app
+before and after a change.
+
+Usage:
+    python benchmarks/api_throughput.py [--concurrency 32] [--requests 2000] URL [URL ...]
+
+e.g. with `uvicorn resource_api:app --port 8000` and `gunicorn -w 4 -b :5000 app:app` running:
+    python benchmarks/api_throughput.py \\
+        "http://localhost:8000/resource?account_id=430150006394&resource_name=wikipedia-bff" \\
+        "http://localhost:8000/category?account_id=430150006394&category_name=iam" \\
+        "http://localhost:5000/s3/buckets?account_id=430150006394&limit=100"
+
+Only the standard library is used, so the same script runs against any checkout.
+"""
+import argparse
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _request(url, timeout):
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = None
+    return status, time.perf_counter() - started
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def run(url, concurrency, total, timeout, warmup):
+    """Sends `total` GETs to `url` from `concurrency` threads and returns the stats."""
+    for _ in range(warmup):
+        _request(url, timeout)
+
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def worker(_):
+        status, elapsed = _request(url, timeout)
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "rps": total / elapsed if elapsed else 0.0,
+        "p50": _percentile(latencies, 0.50) * 1000,
+        "p99": _percentile(latencies, 0.99) * 1000,
+        "max": (latencies[-1] if latencies else 0.0) * 1000,
+        "statuses": statuses,
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("urls", nargs="+")
+    arg_parser.add_argument("--concurrency", type=int, default=32)
+    arg_parser.add_argument("--requests", type=int, default=2000)
+    arg_parser.add_argument("--timeout", type=float, default=30.0)
+    arg_parser.add_argument("--warmup", type=int, default=20)
+    args = arg_parser.parse_args()
+
+    print(f"{'url':<70} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}  statuses")
+    for url in args.urls:
+        stats = run(url, args.concurrency, args.requests, args.timeout, args.warmup)
+        label = url if len(url) <= 70 else url[:67] + "..."
+        print(f"{label:<70} {stats['rps']:>9.1f} {stats['p50']:>8.1f} {stats['p99']:>8.1f} "
+              f"{stats['max']:>8.1f}  {stats['statuses']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Measures the network exposure queries (exposure.py) across many accounts:
+"open to the internet on port 22", "open to an address", "sources inside a
+network" and a per-resource lookup, against MongoDB (MONGO_URI / DB_NAME).
+
+Usage:
+    python benchmarks/exposure_queries.py [--accounts 300] [--groups 40] [--instances 10]
+
+Synthetic security groups are indexed under scratch account IDs through
+store_exposure, as an ingest would, and deleted at the end. Indexes come
+from the migrations, which are applied first.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from exposure import EXPOSURE_COLLECTION, build_exposure_filter, find_exposure_page, store_exposure  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+from mongo_connect import db  # noqa: E402
+
+PORTS = ("22", "80", "443", "3306", "5432", "8000-9000", "1024-65535", "0-65535")
+
+
+def _report(account, groups, instances, rng):
+    """An ec2 section of `groups` security groups, each used by up to `instances` instances."""
+    security_groups = {}
+    for g in range(groups):
+        ports = {}
+        for spec in rng.sample(PORTS, 3):
+            ports[spec] = {"cidrs": [{"CIDR": rng.choice(["0.0.0.0/0", f"10.{rng.randint(0, 255)}.0.0/16",
+                                                          f"203.0.113.{rng.randint(0, 255)}/32"])}],
+                           "security_groups": [{"GroupId": f"sg-{account}-{rng.randrange(groups)}"}]}
+        used_by = [{"id": f"i-{account}-{g}-{n}"} for n in range(rng.randint(1, instances))]
+        security_groups[f"sg-{account}-{g}"] = {
+            "name": f"group-{g}",
+            "rules": {"ingress": {"protocols": {"TCP": {"ports": ports}}}},
+            "used_by": {"ec2": {"resource_type": {"instances": {"running": used_by}}}}
+        }
+    return {"services": {"ec2": {"regions": {"us-east-1": {"vpcs": {"vpc-1": {"security_groups": security_groups}}}}}}}
+
+
+def _timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--accounts", type=int, default=300)
+    arg_parser.add_argument("--groups", type=int, default=40)
+    arg_parser.add_argument("--instances", type=int, default=10)
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    args = arg_parser.parse_args()
+
+    run_migrations()
+    rng = random.Random(42)
+    try:
+        started = time.perf_counter()
+        for a in range(args.accounts):
+            store_exposure(_report(a, args.groups, args.instances, rng), f"benchmark-{a}")
+        print(f"indexed {db[EXPOSURE_COLLECTION].count_documents({'account_id': {'$regex': '^benchmark-'}})} "
+              f"entries in {time.perf_counter() - started:.1f}s")
+
+        queries = {
+            "port 22 public": {"port": "22", "public": "1"},
+            "port 22 world": {"port": "22", "cidr": "0.0.0.0/0"},
+            "port 8443 address": {"port": "8443", "cidr": "10.7.1.2"},
+            "within 10/8": {"cidr": "10.0.0.0/8", "match": "within"},
+            "resource": {"resource_id": "i-0-3-0"},
+            "account port 3306": {"account_id": "benchmark-0", "port": "3306"},
+        }
+        print(f"{'query':<20} {'items':>6} {'best ms':>8}")
+        for name, params in queries.items():
+            filter = build_exposure_filter(params)
+            query = lambda: find_exposure_page(filter, limit=100)  # noqa: E731
+            print(f"{name:<20} {len(query()[0]):>6} {_timed(query, args.repeat):>8.1f}")
+    finally:
+        db[EXPOSURE_COLLECTION].delete_many({"account_id": {"$regex": "^benchmark-"}})
+
+
+if __name__ == "__main__":
+    main()
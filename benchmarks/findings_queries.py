@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Measures the findings queries (findings.py) on a large account: the counts
+by level/service/rule, one listing page and a per-resource lookup, against
+MongoDB (MONGO_URI / DB_NAME).
+
+Usage:
+    python benchmarks/findings_queries.py [--items 100000 250000] [--repeat 5]
+
+Synthetic findings are written under a scratch account ID and deleted at
+the end. Indexes come from the migrations, which are applied first.
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from findings import FINDINGS_COLLECTION, find_findings_page, findings_summary  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+from mongo_connect import db  # noqa: E402
+
+ACCOUNT_ID = "benchmark-findings"
+RULES = [(f"{service}-rule-{n}", service, level) for service in ("ec2", "iam", "s3", "vpc", "rds")
+         for n, level in enumerate(["danger", "warning", "warning", "danger", "warning"] * 4)]
+
+
+def _seed(items):
+    docs = []
+    for n in range(items):
+        rule, service, level = RULES[n % len(RULES)]
+        resource_id = f"{service}-{n // len(RULES) % 5000}"
+        docs.append({"account_id": ACCOUNT_ID, "service": service, "rule": rule, "level": level,
+                     "item": f"{service}.regions.us-east-1.resources.{resource_id}.attr-{n}",
+                     "resource_path": f"{service}.regions.us-east-1.resources.{resource_id}",
+                     "resource_id": resource_id, "collection": None, "region": "us-east-1"})
+        if len(docs) == 10000:
+            db[FINDINGS_COLLECTION].insert_many(docs, ordered=False)
+            docs = []
+    if docs:
+        db[FINDINGS_COLLECTION].insert_many(docs, ordered=False)
+
+
+def _timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--items", type=int, nargs="+", default=[100000, 250000])
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    args = arg_parser.parse_args()
+
+    run_migrations()
+    queries = {
+        "summary": lambda: findings_summary({"account_id": ACCOUNT_ID}),
+        "summary danger": lambda: findings_summary({"account_id": ACCOUNT_ID, "level": "danger"}),
+        "page danger": lambda: find_findings_page({"account_id": ACCOUNT_ID, "level": "danger"}, limit=100),
+        "resource": lambda: find_findings_page({"account_id": ACCOUNT_ID, "resource_id": "ec2-42"}, limit=100),
+    }
+    print(f"{'items':>8} {'query':<16} {'best ms':>8}")
+    try:
+        for items in args.items:
+            db[FINDINGS_COLLECTION].delete_many({"account_id": ACCOUNT_ID})
+            _seed(items)
+            for name, query in queries.items():
+                print(f"{items:>8} {name:<16} {_timed(query, args.repeat):>8.1f}")
+    finally:
+        db[FINDINGS_COLLECTION].delete_many({"account_id": ACCOUNT_ID})
+
+
+if __name__ == "__main__":
+    main()
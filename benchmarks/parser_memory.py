@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Compares peak memory and wall-clock time of the full-document parser
+(parse_scoutsuite_file + iter_resources) against the streaming parser.
+
+Usage:
+    python benchmarks/parser_memory.py [path/to/new2.js ...]
+
+Each mode runs in its own child process so the peak RSS figures don't leak
+into each other.
+"""
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from parser import iter_resources, iter_scoutsuite_resources, parse_scoutsuite_file  # noqa: E402
+
+MODES = ("full", "stream")
+
+
+def run_mode(mode, file_path):
+    """Parses `file_path` with the given mode and prints one result line."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    if mode == "full":
+        count = sum(1 for _ in iter_resources(parse_scoutsuite_file(file_path)))
+    else:
+        count = sum(1 for _ in iter_scoutsuite_resources(file_path))
+    elapsed = time.perf_counter() - started
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # ru_maxrss is in KiB on Linux
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(f"{mode}\t{count}\t{elapsed:.3f}\t{traced_peak}\t{max_rss}")
+
+
+def main(paths):
+    print(f"{'file':<40} {'mode':<7} {'resources':>9} {'seconds':>8} "
+          f"{'py peak MB':>10} {'max RSS MB':>10}")
+    for file_path in paths:
+        size_mb = os.path.getsize(file_path) / 1024 / 1024
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, __file__, "--mode", mode, file_path],
+                check=True, capture_output=True, text=True
+            ).stdout.strip().splitlines()[-1]
+            _, count, elapsed, traced_peak, max_rss = output.split("\t")
+            label = f"{os.path.basename(file_path)} ({size_mb:.1f} MB)"
+            print(f"{label:<40} {mode:<7} {count:>9} {float(elapsed):>8.3f} "
+                  f"{int(traced_peak) / 1024 / 1024:>10.1f} {int(max_rss) / 1024 / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 4 and sys.argv[1] == "--mode":
+        run_mode(sys.argv[2], sys.argv[3])
+    else:
+        main(sys.argv[1:] or [os.path.join(ROOT_DIR, "new2.js")])
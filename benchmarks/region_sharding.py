@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Measures what region sharding (scout_shards.py) gains on one account: the
+wall-clock of a plain `scout aws` run against sharded runs, with the
+fetch/merge/analysis split each sharded run records in shards.json.
+
+Usage:
+    python benchmarks/region_sharding.py live --profile myAccount [--shards 2 4 8] [--regions ...]
+    python benchmarks/region_sharding.py merge reports/scout/<account>/<timestamp>/scoutsuite-results/new2.js [--shards 4]
+
+`live` scans the account for real (AWS credentials for the profile needed),
+into a temporary directory. `merge` needs no credentials: it splits an
+existing report into region shards the way the fetch processes would return
+them, times merge_shards, and checks the merged services against the report.
+"""
+import argparse
+import copy
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from parser import parse_scoutsuite_file  # noqa: E402
+from scout_shards import SCOUT_GLOBAL_SERVICES, SHARDS_SUMMARY_FILE, merge_shards, plan_shards  # noqa: E402
+
+
+def _timed(cmd):
+    started = time.perf_counter()
+    return_code = subprocess.call(cmd, cwd=ROOT_DIR, stdout=subprocess.DEVNULL)
+    return return_code, time.perf_counter() - started
+
+
+def live(args):
+    print(f"{'run':<12} {'wall s':>8} {'speedup':>8} {'fetch s':>8} {'merge s':>8} {'analysis s':>10}  rc")
+    work_dir = tempfile.mkdtemp(prefix="region-sharding-")
+    try:
+        cmd = ["scout", "aws", "--profile", args.profile, "--force", "--no-browser",
+               "--report-dir", os.path.join(work_dir, "plain"), "--ruleset", args.ruleset]
+        if args.regions:
+            cmd += ["--regions", *args.regions]
+        return_code, baseline = _timed(cmd)
+        print(f"{'unsharded':<12} {baseline:>8.1f} {1.0:>8.2f} {'':>8} {'':>8} {'':>10}  {return_code}")
+
+        for shards in args.shards:
+            report_dir = os.path.join(work_dir, f"shards-{shards}")
+            cmd = [sys.executable, os.path.join(ROOT_DIR, "scout_shards.py"), "scan", "--profile", args.profile,
+                   "--report-dir", report_dir, "--ruleset", args.ruleset, "--shards", str(shards)]
+            if args.regions:
+                cmd += ["--regions", *args.regions]
+            return_code, elapsed = _timed(cmd)
+            timings = {}
+            summary_path = os.path.join(report_dir, SHARDS_SUMMARY_FILE)
+            if os.path.exists(summary_path):
+                with open(summary_path) as f:
+                    timings = json.load(f)["timings"]
+            print(f"{f'{shards} shards':<12} {elapsed:>8.1f} {baseline / elapsed:>8.2f} "
+                  f"{timings.get('fetch_seconds', 0):>8.1f} {timings.get('merge_seconds', 0):>8.1f} "
+                  f"{timings.get('analysis_seconds', 0):>10.1f}  {return_code}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _split(report, groups):
+    """The raw configs the global shard and each region shard would have fetched."""
+    raw = copy.deepcopy(report)
+    for key in ("last_run", "sg_map", "subnet_map"):
+        raw[key] = None if key == "last_run" else {}
+    global_shard = copy.deepcopy(raw)
+    global_shard["service_list"] = [s for s in raw["service_list"] if s in SCOUT_GLOBAL_SERVICES]
+    shards = [global_shard]
+    for group in groups:
+        shard = copy.deepcopy(raw)
+        shard["service_list"] = [s for s in raw["service_list"] if s not in SCOUT_GLOBAL_SERVICES]
+        for service in shard["service_list"]:
+            config = shard["services"][service]
+            if "regions" in config:
+                config["regions"] = {r: v for r, v in config["regions"].items() if r in group}
+                for key in config:
+                    if key.endswith("_count"):
+                        config[key] = -1
+        shards.append(shard)
+    return shards
+
+
+def merge(args):
+    report = parse_scoutsuite_file(args.report)
+    regions = sorted({r for s in report["services"].values() if isinstance(s, dict) for r in s.get("regions", {})})
+    print(f"{'shards':>6} {'merge ms':>10}  services equal")
+    for shards in args.shards:
+        groups = plan_shards(regions, shards)
+        shard_configs = _split(report, groups)
+        started = time.perf_counter()
+        merged = merge_shards(shard_configs)
+        elapsed = (time.perf_counter() - started) * 1000
+        same = merged["services"] == report["services"] and sorted(merged["service_list"]) == sorted(report["service_list"])
+        print(f"{len(groups):>6} {elapsed:>10.1f}  {same}")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    live_parser = commands.add_parser("live")
+    live_parser.add_argument("--profile", required=True)
+    live_parser.add_argument("--ruleset", default="default.json")
+    live_parser.add_argument("--regions", nargs="+", default=None)
+    live_parser.add_argument("--shards", type=int, nargs="+", default=[2, 4, 8])
+    merge_parser = commands.add_parser("merge")
+    merge_parser.add_argument("report")
+    merge_parser.add_argument("--shards", type=int, nargs="+", default=[2, 4, 8])
+    args = arg_parser.parse_args()
+    live(args) if args.command == "live" else merge(args)
+
+
+if __name__ == "__main__":
+    main()
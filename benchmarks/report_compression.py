@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Compares archived report formats: size on disk, compression time, and the
+throughput of parsing each one (full-document and streaming parser) through
+the transparent decompression in parser.py.
+
+Usage:
+    python benchmarks/report_compression.py [--level 6] [--runs 3] path/to/new2.js [...]
+
+zstd is measured only if the 'zstandard' package is installed.
+"""
+import argparse
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from parser import iter_scoutsuite_resources, parse_scoutsuite_file, zstandard  # noqa: E402
+
+
+def _compress(source, target, codec, level):
+    started = time.perf_counter()
+    if codec == "gzip":
+        with open(source, "rb") as src, gzip.open(target, "wb", compresslevel=level) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+    elif codec == "zstd":
+        with open(source, "rb") as src, zstandard.open(target, "wb",
+                                                        cctx=zstandard.ZstdCompressor(level=level)) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+    else:
+        shutil.copyfile(source, target)
+    return time.perf_counter() - started
+
+
+def _best_of(runs, func):
+    best = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("paths", nargs="+")
+    arg_parser.add_argument("--level", type=int, default=6)
+    arg_parser.add_argument("--runs", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    codecs = [("plain", ""), ("gzip", ".gz")] + ([("zstd", ".zst")] if zstandard is not None else [])
+    print(f"{'file':<28} {'codec':<6} {'disk MB':>8} {'ratio':>6} {'compress s':>10} "
+          f"{'full MB/s':>10} {'stream MB/s':>11}")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for file_path in args.paths:
+            raw_mb = os.path.getsize(file_path) / 1024 / 1024
+            for codec, suffix in codecs:
+                target = os.path.join(temp_dir, "new2.js" + suffix)
+                compress_seconds = _compress(file_path, target, codec, args.level)
+                disk_mb = os.path.getsize(target) / 1024 / 1024
+                full = _best_of(args.runs, lambda: parse_scoutsuite_file(target))
+                stream = _best_of(args.runs, lambda: sum(1 for _ in iter_scoutsuite_resources(target)))
+                print(f"{os.path.basename(file_path):<28} {codec:<6} {disk_mb:>8.2f} {raw_mb / disk_mb:>6.1f} "
+                      f"{compress_seconds:>10.3f} {raw_mb / full:>10.1f} {raw_mb / stream:>11.1f}")
+                os.remove(target)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Measures what an in-process scan (scout_inprocess.py) saves between
+scout's rule engine and ingestion: the results file round trip of the
+subprocess path (scout's JSON encode and write, then the wrapper's read
+and parse_scoutsuite_file) against building the document straight from
+the provider objects (to_document), for an existing report.
+
+Usage:
+    python benchmarks/scan_pipeline.py reports/scout/<account>/<timestamp>/scoutsuite-results/new2.js [--repeat 3]
+
+The provider is rebuilt from the report with services as objects, the way
+scout holds them. Ingestion itself is the same on both paths, so it is left
+out; the scan jobs record it in their "timings".
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from parser import parse_scoutsuite_file  # noqa: E402
+from scout_inprocess import to_document  # noqa: E402
+
+
+def _provider(report):
+    provider = SimpleNamespace(**report)
+    provider.services = SimpleNamespace(**report["services"])
+    return provider
+
+
+def _round_trip(provider, work_dir):
+    # As scout's JavaScriptEncoder writes it
+    path = os.path.join(work_dir, "new2.js")
+    started = time.perf_counter()
+    with open(path, "w") as f:
+        print("scoutsuite_results =", file=f)
+        print(json.dumps(provider, separators=(",", ": "), sort_keys=True, default=vars), file=f)
+    encoded = time.perf_counter()
+    document = parse_scoutsuite_file(path)
+    return document, encoded - started, time.perf_counter() - encoded, os.path.getsize(path)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("report")
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    provider = _provider(parse_scoutsuite_file(args.report))
+    print(f"{'run':>4} {'encode+write s':>15} {'read+parse s':>13} {'file MB':>8} {'direct s':>9} {'speedup':>8}  same")
+    with tempfile.TemporaryDirectory(prefix="scan-pipeline-") as work_dir:
+        for run in range(1, args.repeat + 1):
+            from_file, write_seconds, parse_seconds, size = _round_trip(provider, work_dir)
+            started = time.perf_counter()
+            direct = to_document(provider)
+            direct_seconds = time.perf_counter() - started
+            print(f"{run:>4} {write_seconds:>15.2f} {parse_seconds:>13.2f} {size / 1e6:>8.1f} {direct_seconds:>9.2f} "
+                  f"{(write_seconds + parse_seconds) / direct_seconds:>8.1f}  {direct == from_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Measures what a freshly booted worker costs: the time to import the Flask
+app, and the latency of its first request (which pays for the MongoDB
+connection). Each run is a new process, like a new gunicorn worker.
+
+Usage:
+    python benchmarks/startup_time.py [--runs 20] [--path "/s3/buckets?account_id=...&limit=100"]
+
+Run `python migrations.py` once beforehand so index creation isn't timed.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import sys, time
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.app.test_client().get({path!r})
+finished = time.perf_counter()
+print(f"{{imported - started}}\\t{{finished - imported}}")
+"""
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--runs", type=int, default=20)
+    arg_parser.add_argument("--path", default="/health")
+    args = arg_parser.parse_args()
+
+    imports, first_requests = [], []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, "-c", CHILD.format(root=ROOT_DIR, path=args.path)],
+            check=True, capture_output=True, text=True, cwd=ROOT_DIR
+        ).stdout.strip().splitlines()[-1]
+        import_seconds, request_seconds = output.split("\t")
+        imports.append(float(import_seconds) * 1000)
+        first_requests.append(float(request_seconds) * 1000)
+
+    print(f"{'':<16} {'median ms':>10} {'p99 ms':>10} {'max ms':>10}")
+    for label, values in (("import app", imports), ("first request", first_requests)):
+        print(f"{label:<16} {statistics.median(values):>10.1f} {_percentile(values, 0.99):>10.1f} "
+              f"{max(values):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
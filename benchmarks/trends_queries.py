@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Measures the findings trends (trends.py): one-year /trends queries, per
+account and org-wide, daily and weekly, read from the rollup buckets of
+many accounts, and the cost of recording one scan.
+
+Usage:
+    DB_NAME=trends_benchmark python benchmarks/trends_queries.py [--accounts 300] [--days 365] [--rules 150]
+
+Run it against a scratch database: it writes org-wide buckets, which real
+scans would also land in, and empties the trends collections at the end.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from migrations import run_migrations  # noqa: E402
+from mongo_connect import db  # noqa: E402
+from trends import (ACCOUNT_SCOPE, FINDINGS_TIMESERIES_COLLECTION, FINDINGS_TRENDS_COLLECTION, ORG_SCOPE,  # noqa: E402
+                    TREND_SCANS_COLLECTION, TrendCounter, bucket_start, find_trends, record_scan_trends)
+
+SERVICES = ("ec2", "iam", "s3", "vpc", "rds", "cloudtrail")
+
+
+def _rules(count):
+    return [(f"{SERVICES[n % len(SERVICES)]}-rule-{n}", SERVICES[n % len(SERVICES)],
+             "danger" if n % 4 == 0 else "warning") for n in range(count)]
+
+
+def _bucket(rules, rng):
+    by_rule = {rule: {"service": service, "level": level, "flagged_items": rng.randint(1, 50), "checked_items": 100}
+               for rule, service, level in rules if rng.random() < 0.6}
+    by_level = {}
+    for counts in by_rule.values():
+        by_level[counts["level"]] = by_level.get(counts["level"], 0) + counts["flagged_items"]
+    return {"flagged_items": sum(by_level.values()), "by_level": by_level, "by_service": {}, "by_rule": by_rule}
+
+
+def _seed(accounts, days, rules, end):
+    """Buckets as the ingests would leave them, written directly for speed."""
+    rng = random.Random(42)
+    collection = db[FINDINGS_TRENDS_COLLECTION]
+    for period, step in (("day", 1), ("week", 7)):
+        starts = sorted({bucket_start(end - timedelta(days=n), period) for n in range(0, days, step)})
+        for start in starts:
+            org = {"scope": ORG_SCOPE, "account_id": None, "period": period, "start": start, "scans": accounts,
+                   "accounts": accounts, **_bucket(rules, rng)}
+            docs = [org] + [{"scope": ACCOUNT_SCOPE, "account_id": f"benchmark-{a}", "period": period, "start": start,
+                             "as_of": start, "scans": 1, **_bucket(rules, rng)} for a in range(accounts)]
+            collection.insert_many(docs, ordered=False)
+
+
+def _timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--accounts", type=int, default=300)
+    arg_parser.add_argument("--days", type=int, default=365)
+    arg_parser.add_argument("--rules", type=int, default=150)
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    args = arg_parser.parse_args()
+
+    run_migrations()
+    end = datetime.now(timezone.utc)
+    since = end - timedelta(days=args.days)
+    rules = _rules(args.rules)
+    try:
+        started = time.perf_counter()
+        _seed(args.accounts, args.days, rules, end)
+        print(f"seeded {db[FINDINGS_TRENDS_COLLECTION].count_documents({})} buckets "
+              f"in {time.perf_counter() - started:.1f}s")
+
+        queries = {
+            "account day": lambda: find_trends("benchmark-7", "day", since, end),
+            "org day": lambda: find_trends(None, "day", since, end),
+            "org week": lambda: find_trends(None, "week", since, end),
+            "org day rule": lambda: find_trends(None, "day", since, end, rule=rules[0][0]),
+            "org day danger": lambda: find_trends(None, "day", since, end, level="danger"),
+            "org day by_rule": lambda: find_trends(None, "day", since, end, by_rule=True),
+        }
+        print(f"{'query':<18} {'points':>6} {'best ms':>8}")
+        for name, query in queries.items():
+            print(f"{name:<18} {len(query()['points']):>6} {_timed(query, args.repeat):>8.1f}")
+
+        counter = TrendCounter()
+        for rule, service, level in rules:
+            counter.add_service(service, {"findings": {rule: {"level": level, "flagged_items": 3, "checked_items": 9}}})
+        started = time.perf_counter()
+        scans = 20
+        for n in range(scans):
+            record_scan_trends(f"benchmark-{n}", end + timedelta(seconds=n + 1), counter)
+        print(f"record one scan: {(time.perf_counter() - started) * 1000 / scans:.1f} ms")
+    finally:
+        db[FINDINGS_TRENDS_COLLECTION].delete_many({})
+        db[TREND_SCANS_COLLECTION].delete_many({})
+        db[FINDINGS_TIMESERIES_COLLECTION].delete_many({"meta.account_id": {"$regex": "^benchmark-"}})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+# bulk_writer.py
+import os
+import json
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Number of upserts sent to MongoDB per bulk_write call
+BULK_WRITE_BATCH_SIZE = int(os.getenv("BULK_WRITE_BATCH_SIZE", "1000"))
+# Number of batches written concurrently (1 = write inline)
+BULK_WRITE_WORKERS = int(os.getenv("BULK_WRITE_WORKERS", "4"))
+# What happens to resources missing from a new scan: "delete" or "mark"
+RESOURCE_REMOVAL_MODE = os.getenv("RESOURCE_REMOVAL_MODE", "delete")
+
+# Field holding the hash of a resource document's content
+CONTENT_HASH_FIELD = "content_hash"
+
+
+def content_hash(doc: Dict[str, Any]) -> str:
+    """Stable hash of a document: SHA-256 of its canonical (sorted, compact) JSON."""
+    canonical = json.dumps(doc, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class BulkUpsertWriter:
+    """
+    Buffers upserts per collection and sends them as unordered bulk_write
+    batches of UpdateOne operations, keeping per-collection counts of
+    inserted, modified and unchanged documents.
+
+    With more than one worker, full batches are handed to a thread pool so
+    different collections are written concurrently. Each collection has at
+    most one batch in flight, and the number of queued batches is bounded
+    so memory stays flat while the producer keeps parsing.
+    """
+
+    def __init__(self, db, batch_size: Optional[int] = None, max_workers: Optional[int] = None):
+        self._db = db
+        self.batch_size = max(1, batch_size or BULK_WRITE_BATCH_SIZE)
+        self.max_workers = max(1, max_workers or BULK_WRITE_WORKERS)
+        self._pending: Dict[str, List[Union[UpdateOne, DeleteOne]]] = {}
+        self.stats: Dict[str, Dict[str, int]] = {}
+        self._errors: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._in_flight: Dict[str, Future] = {}
+        self._slots = threading.BoundedSemaphore(self.max_workers * 2)
+        if self.max_workers > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                thread_name_prefix="bulk-writer")
+
+    def __enter__(self) -> "BulkUpsertWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self._shutdown()
+
+    def upsert(self, collection: str, filter: Dict[str, Any], doc: Dict[str, Any],
+               unset: Iterable[str] = ()) -> None:
+        """Queues a `$set` upsert of `doc` on the document matching `filter`."""
+        update: Dict[str, Any] = {"$set": doc}
+        if unset:
+            update["$unset"] = {field: "" for field in unset}
+        self._queue(collection, UpdateOne(filter, update, upsert=True))
+
+    def update(self, collection: str, filter: Dict[str, Any], update: Dict[str, Any]) -> None:
+        """Queues a plain (non-upsert) update of the document matching `filter`."""
+        self._queue(collection, UpdateOne(filter, update))
+
+    def delete(self, collection: str, filter: Dict[str, Any]) -> None:
+        """Queues the deletion of the document matching `filter`."""
+        self._queue(collection, DeleteOne(filter))
+
+    def _queue(self, collection: str, op: Union[UpdateOne, DeleteOne]) -> None:
+        ops = self._pending.setdefault(collection, [])
+        ops.append(op)
+        if len(ops) >= self.batch_size:
+            self.flush(collection)
+
+    def flush(self, collection: Optional[str] = None) -> None:
+        """Sends the pending operations of one collection, or of all of them."""
+        names = [collection] if collection else list(self._pending)
+        for name in names:
+            ops = self._pending.pop(name, None)
+            if ops:
+                self._submit(name, ops)
+
+    def close(self) -> Dict[str, Dict[str, int]]:
+        """
+        Flushes everything left and returns the per-collection counts.
+        Raises BulkWriteError if any operation failed; all batches are still attempted.
+        """
+        self.flush()
+        self._shutdown()
+        if self._errors:
+            raise BulkWriteError({
+                "writeErrors": self._errors,
+                "nInserted": 0,
+                "nUpserted": sum(s["inserted"] for s in self.stats.values()),
+                "nMatched": sum(s["modified"] + s["unchanged"] for s in self.stats.values()),
+                "nModified": sum(s["modified"] for s in self.stats.values()),
+                "nRemoved": sum(s["deleted"] for s in self.stats.values()),
+                "upserted": [],
+            })
+        return self.stats
+
+    def _shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._in_flight.clear()
+
+    def _submit(self, collection: str, ops: List[Union[UpdateOne, DeleteOne]]) -> None:
+        if self._executor is None:
+            self._write(collection, ops)
+            return
+        # Keep writes to one collection sequential
+        previous = self._in_flight.get(collection)
+        if previous is not None:
+            previous.result()
+        self._slots.acquire()
+        future = self._executor.submit(self._write, collection, ops)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._in_flight[collection] = future
+
+    def _write(self, collection: str, ops: List[Union[UpdateOne, DeleteOne]]) -> None:
+        try:
+            result = self._db[collection].bulk_write(ops, ordered=False)
+            upserted, matched, modified, deleted = (
+                result.upserted_count, result.matched_count, result.modified_count, result.deleted_count)
+            write_errors = []
+        except BulkWriteError as e:
+            details = e.details
+            upserted = details.get("nUpserted", 0)
+            matched = details.get("nMatched", 0)
+            modified = details.get("nModified", 0)
+            deleted = details.get("nRemoved", 0)
+            write_errors = details.get("writeErrors", [])
+            logger.error(f"Bulk write to '{collection}' had {len(write_errors)} errors")
+        except Exception as e:
+            logger.error(f"Bulk write to '{collection}' failed: {str(e)}")
+            upserted = matched = modified = deleted = 0
+            write_errors = [{"index": 0, "code": None, "errmsg": str(e)}] * len(ops)
+
+        with self._lock:
+            counts = self.stats.setdefault(
+                collection, {"inserted": 0, "modified": 0, "unchanged": 0, "deleted": 0, "errors": 0})
+            counts["inserted"] += upserted
+            counts["modified"] += modified
+            counts["unchanged"] += matched - modified
+            counts["deleted"] += deleted
+            counts["errors"] += len(write_errors)
+            self._errors.extend(write_errors)
+
+
+class ChangeDetectingWriter:
+    """
+    Writes one account's resources through a BulkUpsertWriter, skipping the
+    ones whose content hash didn't change since the last ingest.
+
+    The stored hashes of a collection are fetched in one query the first time
+    the collection is written to. On close, resources of the account that
+    weren't seen in this ingest are deleted, or flagged with removed/removed_at
+    when RESOURCE_REMOVAL_MODE is "mark". Counts are reported per collection
+    as added/changed/removed/unchanged.
+
+    A partial scan (some regions or services only) passes a `scope`: called
+    with a collection, it returns the filter selecting the stored documents
+    the scan covers ({} for all of them), or None if it covers none. Only
+    those can be removed; the others are left as they are.
+
+    An optional `history` recorder (history.ScanHistoryRecorder) is told about
+    every added, changed and removed resource.
+    """
+
+    def __init__(self, db, account_id: str, batch_size: Optional[int] = None,
+                 max_workers: Optional[int] = None, removal_mode: Optional[str] = None,
+                 collections: Iterable[str] = (), history=None,
+                 scope: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None):
+        self._db = db
+        self.account_id = account_id
+        self.history = history
+        self.scope = scope
+        # Collections checked for removed resources even if nothing is written to them
+        self.collections: Set[str] = set(collections)
+        self.removal_mode = removal_mode or RESOURCE_REMOVAL_MODE
+        if self.removal_mode not in ("delete", "mark"):
+            raise ValueError(f"Invalid resource removal mode: {self.removal_mode!r}")
+        self._writer = BulkUpsertWriter(db, batch_size, max_workers)
+        # collection -> {key: (_id, content hash, removed flag)}
+        self._existing: Dict[str, Dict[Tuple, Tuple[Any, Optional[str], bool]]] = {}
+        self._seen: Dict[str, Set[Tuple]] = {}
+        # Collections loaded without key fields, whose keys are document _ids
+        self._keyed_by_id: Set[str] = set()
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def __enter__(self) -> "ChangeDetectingWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self._writer.__exit__(exc_type, exc, tb)
+
+    def _counts(self, collection: str) -> Dict[str, int]:
+        return self.stats.setdefault(collection, {"added": 0, "changed": 0, "removed": 0, "unchanged": 0})
+
+    def _load_existing(self, collection: str, key_fields: List[str]) -> Dict[Tuple, Tuple[Any, Optional[str], bool]]:
+        existing = self._existing.get(collection)
+        if existing is None:
+            projection = {field: True for field in key_fields}
+            projection.update({CONTENT_HASH_FIELD: True, "removed": True})
+            existing = {
+                # Without key fields (see close) documents are told apart by _id
+                (tuple(doc.get(field) for field in key_fields) if key_fields else (doc["_id"],)):
+                    (doc["_id"], doc.get(CONTENT_HASH_FIELD), bool(doc.get("removed")))
+                for doc in self._db[collection].find({"account_id": self.account_id}, projection)
+            }
+            self._existing[collection] = existing
+            self._seen[collection] = set()
+            if not key_fields:
+                self._keyed_by_id.add(collection)
+        return existing
+
+    def upsert(self, collection: str, filter: Dict[str, Any], doc: Dict[str, Any],
+               unhashed: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Hashes `doc` and queues its upsert only if it is new or changed.
+        `unhashed` fields (e.g. the scan that wrote it) are written along
+        with it but left out of the hash, so they alone don't rewrite it.
+        """
+        key_fields = [field for field in filter if field != "account_id"]
+        existing = self._load_existing(collection, key_fields)
+        key = tuple(filter[field] for field in key_fields)
+        self._seen[collection].add(key)
+
+        digest = content_hash(doc)
+        counts = self._counts(collection)
+        previous = existing.get(key)
+        doc = {**doc, CONTENT_HASH_FIELD: digest}
+        if previous is not None and previous[1] == digest and not previous[2]:
+            counts["unchanged"] += 1
+            if self.history is not None and self.history.needs_baseline:
+                self.history.record_version(collection, key, doc)
+            return
+
+        counts["added" if previous is None or previous[2] else "changed"] += 1
+        unset = ("removed", "removed_at") if previous is not None and previous[2] else ()
+        if unhashed:
+            doc.update(unhashed)
+        self._writer.upsert(collection, filter, doc, unset=unset)
+        if self.history is not None:
+            self.history.record_version(collection, key, doc)
+
+    def _scope_filter(self, collection: str) -> Optional[Dict[str, Any]]:
+        return {} if self.scope is None else self.scope(collection)
+
+    def close(self) -> Dict[str, Dict[str, int]]:
+        """
+        Removes (or marks) resources of the account missing from this ingest,
+        in every collection written to plus `collections`, as far as the
+        scan's scope covers them, then flushes everything. Returns the
+        per-collection counts.
+        """
+        for collection in self.collections - set(self._existing):
+            if self._scope_filter(collection) is None:
+                continue
+            # Nothing of this type in the new scan: every stored resource (in scope) is gone
+            self._load_existing(collection, [])
+        removed_at = datetime.now(timezone.utc)
+        for collection, existing in self._existing.items():
+            scope_filter = self._scope_filter(collection)
+            if scope_filter is None:
+                continue
+            covered = None
+            if scope_filter:
+                covered = {doc["_id"] for doc in self._db[collection].find(
+                    {"account_id": self.account_id, **scope_filter}, {"_id": True})}
+            seen = self._seen.get(collection, set())
+            for key, (doc_id, _, removed) in existing.items():
+                if key in seen or removed or (covered is not None and doc_id not in covered):
+                    continue
+                self._counts(collection)["removed"] += 1
+                if self.history is not None:
+                    if collection in self._keyed_by_id:
+                        self.history.record_collection_removal(collection, scope_filter)
+                    else:
+                        self.history.record_removal(collection, key)
+                if self.removal_mode == "delete":
+                    self._writer.delete(collection, {"_id": doc_id})
+                else:
+                    self._writer.update(collection, {"_id": doc_id},
+                                        {"$set": {"removed": True, "removed_at": removed_at}})
+        self._writer.close()
+        return self.stats
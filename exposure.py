@@ -0,0 +1,341 @@
+# exposure.py
+import json
+import base64
+import ipaddress
+import logging
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from pymongo.errors import ExecutionTimeout
+from mongo_connect import db
+from bulk_writer import ChangeDetectingWriter
+from queries import MONGO_QUERY_TIMEOUT_MS, RESOURCE_PAGE_SIZE, QueryError, QueryTimeout
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EXPOSURE_COLLECTION = "network_exposure"
+
+# Fields exposure can be filtered on by equality; port, protocol, cidr and public are handled apart
+EXPOSURE_FILTER_FIELDS = ("resource_id", "resource_type", "security_group", "region", "vpc_id", "origin")
+
+PORT_BITS = 16
+# Protocols a port applies to; the others (ICMP) have message types instead
+_PORT_PROTOCOLS = ("TCP", "UDP", "ALL")
+# Stored for internal matching only
+_INTERNAL_FIELDS = {"_id": False, "content_hash": False, "port_blocks": False, "cidr_key": False,
+                    "cidr_start": False, "cidr_end": False}
+
+
+# -------------------------------------------------------------------
+# Ports and CIDRs as aligned blocks
+# -------------------------------------------------------------------
+def _block_id(level: int, start: int) -> int:
+    return (level << PORT_BITS) | start
+
+
+def port_blocks(port_from: int, port_to: int) -> List[int]:
+    """
+    Splits [port_from, port_to] into the fewest aligned power-of-two blocks
+    (at most 2 x 16), each stored as one integer. A port lies in exactly one
+    of a range's blocks, and in 17 possible blocks overall (containing_blocks),
+    so "ranges containing port X" is an exact $in on a multikey index,
+    with no scan over range bounds.
+    """
+    blocks = []
+    start = port_from
+    while start <= port_to:
+        level = 0
+        while level < PORT_BITS and start % (1 << (level + 1)) == 0 and start + (1 << (level + 1)) - 1 <= port_to:
+            level += 1
+        blocks.append(_block_id(level, start))
+        start += 1 << level
+    return blocks
+
+
+def containing_blocks(port: int) -> List[int]:
+    """The 17 aligned blocks a port can be in, from the port itself to 0-65535."""
+    return [_block_id(level, port >> level << level) for level in range(PORT_BITS + 1)]
+
+
+def parse_ports(value: str) -> Optional[Tuple[int, int]]:
+    """ScoutSuite's port keys ('22', '1024-65535', 'ALL') as a range; None for ICMP message types."""
+    value = str(value).strip()
+    if value.upper() == "ALL":
+        return 0, (1 << PORT_BITS) - 1
+    if value.startswith("-"):
+        # -1 (FromPort/ToPort of -1): every port
+        return 0, (1 << PORT_BITS) - 1
+    low, _, high = value.partition("-")
+    try:
+        port_from, port_to = int(low), int(high or low)
+    except ValueError:
+        return None
+    if port_to < port_from:
+        return 0, (1 << PORT_BITS) - 1
+    return port_from, min(port_to, (1 << PORT_BITS) - 1)
+
+
+def _cidr_key(network: ipaddress._BaseNetwork) -> str:
+    width = network.max_prefixlen // 4
+    return f"{network.version}:{network.prefixlen:03d}:{int(network.network_address):0{width}x}"
+
+
+def containing_cidr_keys(network: ipaddress._BaseNetwork) -> List[str]:
+    """Keys of every network containing `network` (33 for IPv4, 129 for IPv6 at most)."""
+    return [_cidr_key(network.supernet(new_prefix=prefix)) for prefix in range(network.prefixlen + 1)]
+
+
+def cidr_fields(cidr: str) -> Dict[str, Any]:
+    """
+    The stored form of a rule's source CIDR: its canonical network key for
+    containment lookups (containing_cidr_keys), and its first/last address as
+    fixed-width hex, which sorts like the addresses, for "within" range queries.
+    """
+    try:
+        network = ipaddress.ip_network(cidr, strict=False)
+    except ValueError:
+        return {"cidr": cidr}
+    width = network.max_prefixlen // 4
+    return {
+        "cidr": str(network),
+        "cidr_version": network.version,
+        "cidr_prefix": network.prefixlen,
+        "cidr_key": _cidr_key(network),
+        "cidr_start": f"{int(network.network_address):0{width}x}",
+        "cidr_end": f"{int(network.broadcast_address):0{width}x}",
+        # 0.0.0.0/0, ::/0 and any other range that isn't private
+        "public_source": not network.is_private
+    }
+
+
+# -------------------------------------------------------------------
+# Index
+# -------------------------------------------------------------------
+def _used_by(sg: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Resources ScoutSuite found using a security group (its 'used_by' entry)."""
+    for service, usage in (sg.get("used_by") or {}).items():
+        for resource_type, resources in ((usage or {}).get("resource_type") or {}).items():
+            by_status = resources.items() if isinstance(resources, dict) else [(None, resources)]
+            for status, entries in by_status:
+                for entry in entries or []:
+                    if isinstance(entry, dict) and entry.get("id"):
+                        yield {"resource_service": service, "resource_type": resource_type,
+                               "resource_id": entry["id"], "resource_name": entry.get("name"),
+                               "resource_status": status}
+
+
+def _grants(protocols: Dict[str, Any]) -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+    """(protocol, port key, source fields) of every grant of a rules.ingress-like tree."""
+    for protocol, by_port in (protocols or {}).items():
+        for ports, grants in ((by_port or {}).get("ports") or {}).items():
+            for grant in (grants or {}).get("cidrs") or []:
+                if isinstance(grant, dict) and grant.get("CIDR"):
+                    yield protocol.upper(), ports, {"source_type": "cidr", **cidr_fields(grant["CIDR"])}
+            for grant in (grants or {}).get("security_groups") or []:
+                if isinstance(grant, dict) and grant.get("GroupId"):
+                    yield protocol.upper(), ports, {"source_type": "security_group",
+                                                    "source_security_group": grant["GroupId"],
+                                                    "source_account": grant.get("UserId"),
+                                                    "public_source": False}
+
+
+class ExposureIndexer:
+    """
+    Maintains the 'network_exposure' collection of one account: a document
+    per (resource, protocol, port range, source CIDR or security group)
+    that lets traffic in. Built from every security group's ingress rules,
+    fanned out to the resources ScoutSuite lists in its 'used_by' (a group
+    nothing uses is indexed as itself), and from the services'
+    external_attack_surface, ScoutSuite's summary of public addresses and
+    what they accept. Source groups are located with 'sg_map'. Goes through
+    a ChangeDetectingWriter: unchanged entries aren't rewritten, gone ones
+    are deleted.
+
+    Rows are only written on close(), as 'sg_map' comes after 'services' in
+    a streamed report.
+    """
+
+    def __init__(self, account_id: str, batch_size: Optional[int] = None):
+        self.account_id = account_id
+        self.batch_size = batch_size
+        self._rows: List[Dict[str, Any]] = []
+        self._sg_map: Dict[str, Any] = {}
+        self.stats: Dict[str, int] = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0}
+
+    def __enter__(self) -> "ExposureIndexer":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+
+    def _add(self, row: Dict[str, Any], protocol: str, ports: str, source: Dict[str, Any]) -> None:
+        port_range = parse_ports(ports) if protocol in _PORT_PROTOCOLS else None
+        self._rows.append({
+            **row,
+            "protocol": protocol,
+            "ports": ports,
+            "port_from": port_range[0] if port_range else None,
+            "port_to": port_range[1] if port_range else None,
+            "port_blocks": port_blocks(*port_range) if port_range else [],
+            **source
+        })
+
+    def add_service(self, service: str, service_data: Any) -> None:
+        """Collects the exposure found in one service section."""
+        if not isinstance(service_data, dict):
+            return
+        if service == "ec2":
+            for region, region_data in (service_data.get("regions") or {}).items():
+                for vpc_id, vpc in ((region_data or {}).get("vpcs") or {}).items():
+                    for sg_id, sg in ((vpc or {}).get("security_groups") or {}).items():
+                        self._add_security_group(region, vpc_id, sg_id, sg or {})
+        for address, surface in (service_data.get("external_attack_surface") or {}).items():
+            row = {"origin": "attack_surface", "region": None, "vpc_id": None, "security_group": None,
+                   "security_group_name": None, "resource_service": service, "resource_type": "public_endpoint",
+                   "resource_id": address, "resource_name": (surface or {}).get("InstanceName"),
+                   "resource_status": None, "address": address}
+            for protocol, ports, source in _grants((surface or {}).get("protocols")):
+                self._add(row, protocol, ports, source)
+
+    def _add_security_group(self, region: str, vpc_id: str, sg_id: str, sg: Dict[str, Any]) -> None:
+        ingress = ((sg.get("rules") or {}).get("ingress") or {}).get("protocols")
+        if not ingress:
+            return
+        base = {"origin": "security_group", "region": region, "vpc_id": vpc_id, "security_group": sg_id,
+                "security_group_name": sg.get("name"), "address": None}
+        resources = list(_used_by(sg)) or [{"resource_service": "ec2", "resource_type": "security_groups",
+                                            "resource_id": sg_id, "resource_name": sg.get("name"),
+                                            "resource_status": None}]
+        for protocol, ports, source in _grants(ingress):
+            for resource in resources:
+                self._add({**base, **resource}, protocol, ports, source)
+
+    def add_sg_map(self, sg_map: Any) -> None:
+        if isinstance(sg_map, dict):
+            self._sg_map = sg_map
+
+    def close(self) -> Dict[str, int]:
+        with ChangeDetectingWriter(db, self.account_id, self.batch_size, removal_mode="delete",
+                                   collections=[EXPOSURE_COLLECTION]) as writer:
+            for row in self._rows:
+                source = row.get("source_security_group")
+                if source:
+                    location = self._sg_map.get(source) or {}
+                    row["source_region"] = location.get("region")
+                    row["source_vpc"] = location.get("vpc_id")
+                key = "|".join(str(part) for part in (
+                    row["origin"], row["resource_type"], row["resource_id"], row["security_group"] or "",
+                    row["protocol"], row["ports"], row.get("cidr") or source or ""))
+                writer.upsert(EXPOSURE_COLLECTION, {"account_id": self.account_id, "key": key},
+                              {"account_id": self.account_id, "key": key, **row})
+        self._rows = []
+        self.stats = writer.stats.get(EXPOSURE_COLLECTION, self.stats)
+        return self.stats
+
+
+def store_exposure(data: Dict[str, Any], account_id: str, batch_size: Optional[int] = None) -> Dict[str, int]:
+    """Indexes the network exposure of a parsed report; returns added/changed/removed/unchanged counts."""
+    with ExposureIndexer(account_id, batch_size) as exposure:
+        for service, service_data in (data.get("services") or {}).items():
+            exposure.add_service(service, service_data)
+        exposure.add_sg_map(data.get("sg_map"))
+    return exposure.stats
+
+
+# -------------------------------------------------------------------
+# Queries
+# -------------------------------------------------------------------
+def build_exposure_filter(args: Dict[str, str], ignore: Tuple[str, ...] = ()) -> Dict[str, Any]:
+    """
+    Turns ?port=22&cidr=0.0.0.0/0&public=1 (etc.) into a query. `port` matches
+    ranges containing it, `cidr` sources containing that address or network
+    (or, with match=within, sources inside it), `public=1` sources that
+    aren't private ranges. Without account_id, one of port, cidr, resource_id
+    or security_group is required.
+    """
+    filter: Dict[str, Any] = {}
+    if args.get("account_id"):
+        filter["account_id"] = args["account_id"]
+    elif not any(args.get(name) for name in ("port", "cidr", "resource_id", "security_group")):
+        raise QueryError("Missing account_id, port, cidr, resource_id or security_group query parameter")
+
+    for name, value in args.items():
+        if name in ("account_id", "port", "protocol", "cidr", "match", "public") or name in ignore:
+            continue
+        if name not in EXPOSURE_FILTER_FIELDS:
+            raise QueryError(f"Cannot filter on '{name}'; filterable fields: "
+                             f"port, protocol, cidr, public, {', '.join(EXPOSURE_FILTER_FIELDS)}")
+        filter[name] = value
+
+    if args.get("port"):
+        try:
+            port = int(args["port"])
+        except ValueError:
+            raise QueryError(f"Invalid port: {args['port']!r}")
+        if not 0 <= port < 1 << PORT_BITS:
+            raise QueryError(f"Invalid port: {port}")
+        filter["port_blocks"] = {"$in": containing_blocks(port)}
+    if args.get("protocol"):
+        protocol = args["protocol"].upper()
+        # A rule for all protocols lets any of them in
+        filter["protocol"] = {"$in": [protocol, "ALL"]} if protocol != "ALL" else "ALL"
+    if args.get("cidr"):
+        try:
+            network = ipaddress.ip_network(args["cidr"], strict=False)
+        except ValueError:
+            raise QueryError(f"Invalid cidr: {args['cidr']!r}")
+        match = args.get("match", "contains")
+        if match == "contains":
+            filter["cidr_key"] = {"$in": containing_cidr_keys(network)}
+        elif match == "within":
+            fields = cidr_fields(str(network))
+            filter["cidr_version"] = network.version
+            filter["cidr_start"] = {"$gte": fields["cidr_start"], "$lte": fields["cidr_end"]}
+            filter["cidr_prefix"] = {"$gte": network.prefixlen}
+        else:
+            raise QueryError(f"Invalid match '{match}'; one of: contains, within")
+    if args.get("public") is not None:
+        filter["public_source"] = args["public"] == "1"
+    return filter
+
+
+def _encode_after(doc: Dict[str, Any]) -> str:
+    values = json.dumps([doc["account_id"], doc["key"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(values.encode("utf-8")).decode("ascii")
+
+
+def _decode_after(after: str) -> List[str]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(after.encode("ascii")))
+    except (ValueError, UnicodeError):
+        raise QueryError(f"Invalid after: {after!r}")
+    if not isinstance(values, list) or len(values) != 2:
+        raise QueryError(f"Invalid after: {after!r}")
+    return values
+
+
+def find_exposure_page(filter: Dict[str, Any], after: Optional[str] = None,
+                       limit: int = RESOURCE_PAGE_SIZE) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Up to `limit` exposure entries matching `filter`, by account and key,
+    starting after the `after` cursor of the previous page. Returns
+    (items, next_after). Port and CIDR matches are $in lookups on the
+    block and network keys, so they cost the same across all accounts.
+    """
+    query = dict(filter)
+    if after is not None:
+        account_id, key = _decode_after(after)
+        query["$or"] = [{"account_id": {"$gt": account_id}}, {"account_id": account_id, "key": {"$gt": key}}]
+    try:
+        items = list(db[EXPOSURE_COLLECTION].find(query, _INTERNAL_FIELDS)
+                     .sort([("account_id", 1), ("key", 1)]).limit(limit + 1)
+                     .max_time_ms(MONGO_QUERY_TIMEOUT_MS))
+    except ExecutionTimeout as e:
+        raise QueryTimeout(str(e))
+    next_after = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_after = _encode_after(items[-1])
+    return items, next_after
@@ -0,0 +1,218 @@
+# findings.py
+import json
+import base64
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo.errors import ExecutionTimeout
+from mongo_connect import db
+from bulk_writer import ChangeDetectingWriter
+from queries import MONGO_QUERY_TIMEOUT_MS, RESOURCE_PAGE_SIZE, QueryError, QueryTimeout
+from refactor import collection_name
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FINDINGS_COLLECTION = "findings"
+
+# Fields findings can be filtered on; each is covered by an index (migrations.py)
+FINDING_FILTER_FIELDS = ("level", "service", "rule", "resource_id")
+
+# Listing order; fields a request filters on are dropped from it, the rest follow
+# the (account_id, level, service, rule, item) index
+_SORT_FIELDS = ("level", "service", "rule", "item")
+
+
+def _pattern_matches(pattern: Tuple[str, ...], path: Tuple[str, ...]) -> bool:
+    return all(p == "id" or p == k for p, k in zip(pattern, path))
+
+
+def rule_resource_pattern(rule_path: Tuple[str, ...], patterns: List[Tuple[str, ...]]) -> Optional[Tuple[str, ...]]:
+    """
+    The resource container a rule's flagged items live under: the longest
+    resource pattern its path goes through, e.g. ec2.regions.id.vpcs.id.security_groups
+    for a rule on security group rules. None if the rule isn't about a stored resource.
+    """
+    best = None
+    for pattern in patterns:
+        if len(rule_path) > len(pattern) and _pattern_matches(pattern, rule_path) \
+                and (best is None or len(pattern) > len(best)):
+            best = pattern
+    return best
+
+
+class FindingsIndexer:
+    """
+    Maintains the 'findings' collection of one account: a document per
+    flagged item of every rule (services.<service>.findings.<rule>.items),
+    with the rule's service and level, and the resource the item is on
+    (its path in the report, its key, and its collection if it has one).
+    Goes through a ChangeDetectingWriter, so findings that didn't change
+    aren't rewritten and findings no longer flagged are deleted.
+    `scan_id` is that of the scan that added or last changed a finding.
+    """
+
+    def __init__(self, account_id: str, scan_id: ObjectId, patterns: List[Tuple[str, ...]],
+                 batch_size: Optional[int] = None):
+        self.account_id = account_id
+        self.scan_id = scan_id
+        self.patterns = patterns
+        self._writer = ChangeDetectingWriter(db, account_id, batch_size, removal_mode="delete",
+                                             collections=[FINDINGS_COLLECTION])
+
+    def __enter__(self) -> "FindingsIndexer":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._writer.__exit__(exc_type, exc, tb)
+
+    def add_service(self, service: str, service_data: Any) -> None:
+        """Queues the flagged items of one service section."""
+        if not isinstance(service_data, dict):
+            return
+        for rule, finding in (service_data.get("findings") or {}).items():
+            if not isinstance(finding, dict) or not finding.get("items"):
+                continue
+            rule_path = tuple((finding.get("path") or "").split("."))
+            pattern = rule_resource_pattern(rule_path, self.patterns)
+            for item in finding["items"]:
+                parts = item.split(".")
+                resource_parts = parts[:len(pattern) + 1] if pattern else parts[:len(rule_path)] or parts
+                self._writer.upsert(
+                    FINDINGS_COLLECTION,
+                    {"account_id": self.account_id, "rule": rule, "item": item},
+                    {
+                        "account_id": self.account_id,
+                        "service": service,
+                        "rule": rule,
+                        "level": finding.get("level") or "unknown",
+                        "item": item,
+                        "resource_path": ".".join(resource_parts),
+                        "resource_id": resource_parts[-1],
+                        "collection": collection_name(pattern) if pattern else None,
+                        "region": parts[2] if len(parts) > 2 and parts[1] == "regions" else None
+                    },
+                    unhashed={"scan_id": self.scan_id}
+                )
+
+    def close(self) -> Dict[str, int]:
+        return self._writer.close().get(FINDINGS_COLLECTION, {})
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Added/changed/removed/unchanged counts (complete once closed)."""
+        return self._writer.stats.get(FINDINGS_COLLECTION, {"added": 0, "changed": 0, "removed": 0, "unchanged": 0})
+
+
+def store_findings(data: Dict[str, Any], account_id: str, scan_id: ObjectId, patterns: List[Tuple[str, ...]],
+                   batch_size: Optional[int] = None) -> Dict[str, int]:
+    """Indexes every flagged item of a parsed report; returns added/changed/removed/unchanged counts."""
+    with FindingsIndexer(account_id, scan_id, patterns, batch_size) as findings:
+        for service, service_data in (data.get("services") or {}).items():
+            findings.add_service(service, service_data)
+    return findings.stats
+
+
+# -------------------------------------------------------------------
+# Queries
+# -------------------------------------------------------------------
+def build_findings_filter(account_id: Optional[str], args: Dict[str, str],
+                          ignore: Iterable[str] = ()) -> Dict[str, Any]:
+    """
+    Turns ?level=danger&service=ec2 (etc.) into a query; only FINDING_FILTER_FIELDS
+    are accepted. Without an account, only resource_id lookups (across accounts) are.
+    """
+    if not account_id and not args.get("resource_id"):
+        raise QueryError("Missing account_id query parameter")
+    filter: Dict[str, Any] = {"account_id": account_id} if account_id else {}
+    for name, value in args.items():
+        if name == "account_id" or name in ignore:
+            continue
+        if name not in FINDING_FILTER_FIELDS:
+            raise QueryError(f"Cannot filter on '{name}'; filterable fields: {', '.join(FINDING_FILTER_FIELDS)}")
+        filter[name] = value
+    return filter
+
+
+def _encode_after(doc: Dict[str, Any], sort_fields: List[str]) -> str:
+    values = json.dumps([doc.get(field) for field in sort_fields], separators=(",", ":"))
+    return base64.urlsafe_b64encode(values.encode("utf-8")).decode("ascii")
+
+
+def _decode_after(after: str, sort_fields: List[str]) -> List[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(after.encode("ascii")))
+    except (ValueError, UnicodeError):
+        raise QueryError(f"Invalid after: {after!r}")
+    if not isinstance(values, list) or len(values) != len(sort_fields):
+        raise QueryError(f"Invalid after: {after!r}")
+    return values
+
+
+def find_findings_page(filter: Dict[str, Any], after: Optional[str] = None,
+                       limit: int = RESOURCE_PAGE_SIZE) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Up to `limit` findings matching `filter`, by level, service, rule and
+    item, starting after the `after` cursor of the previous page. Returns
+    (items, next_after). Keyset pagination on the (account_id, level,
+    service, rule, item) index, so deep pages cost the same as the first.
+    """
+    sort_fields = [field for field in _SORT_FIELDS if field not in filter]
+    query = dict(filter)
+    if after is not None:
+        values = _decode_after(after, sort_fields)
+        # (a, b, c) > (x, y, z): a > x, or a == x and b > y, or ...
+        query["$or"] = [
+            {**{field: values[i] for i, field in enumerate(sort_fields[:n])}, sort_fields[n]: {"$gt": values[n]}}
+            for n in range(len(sort_fields))
+        ]
+    try:
+        items = list(db[FINDINGS_COLLECTION].find(query, {"_id": False, "content_hash": False})
+                     .sort([(field, 1) for field in sort_fields]).limit(limit + 1)
+                     .max_time_ms(MONGO_QUERY_TIMEOUT_MS))
+    except ExecutionTimeout as e:
+        raise QueryTimeout(str(e))
+    next_after = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_after = _encode_after(items[-1], sort_fields)
+    for item in items:
+        if "scan_id" in item:
+            item["scan_id"] = str(item["scan_id"])
+    return items, next_after
+
+
+def findings_summary(filter: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Flagged item counts of the findings matching `filter`: in total, by
+    level, by service and level, and per rule (most flagged first). One
+    $group over the (account_id, level, service, rule) index keys, so it
+    is answered from the index without reading the documents.
+    """
+    try:
+        rows = list(db[FINDINGS_COLLECTION].aggregate([
+            {"$match": filter},
+            {"$group": {"_id": {"level": "$level", "service": "$service", "rule": "$rule"}, "count": {"$sum": 1}}}
+        ], maxTimeMS=MONGO_QUERY_TIMEOUT_MS))
+    except ExecutionTimeout as e:
+        raise QueryTimeout(str(e))
+
+    by_level: Dict[str, int] = {}
+    by_service: Dict[str, Dict[str, int]] = {}
+    by_rule = []
+    for row in rows:
+        level, service, count = row["_id"]["level"], row["_id"]["service"], row["count"]
+        by_level[level] = by_level.get(level, 0) + count
+        levels = by_service.setdefault(service, {})
+        levels[level] = levels.get(level, 0) + count
+        by_rule.append({"rule": row["_id"]["rule"], "service": service, "level": level, "count": count})
+    by_rule.sort(key=lambda rule: (-rule["count"], rule["rule"]))
+    return {
+        "flagged_items": sum(by_level.values()),
+        "rules": len(by_rule),
+        "by_level": by_level,
+        "by_service": by_service,
+        "by_rule": by_rule
+    }
@@ -0,0 +1,34 @@
+# gunicorn.conf.py
+# Picked up automatically by `gunicorn app:app` run from this directory.
+import os
+
+from mongo_connect import db_connection
+from migrations import run_migrations
+from report_manager import report_manager
+from retention import retention_engine
+from jobs import scan_queue
+
+# Threaded workers: a /scout/progress stream stays open for up to SCAN_PROGRESS_STREAM_SECONDS,
+# which would tie up a sync worker and outlive its 30 s timeout. gthread workers serve each
+# request on a thread and only time out when the worker itself stops responding.
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+
+
+def on_starting(server):
+    """Runs in the master before any worker is forked, so index migrations happen once per deploy."""
+    run_migrations()
+    # Workers must not inherit the master's client
+    db_connection.close()
+
+
+def post_fork(server, worker):
+    """Creates the worker's client right away; the health monitor's first ping warms the pool."""
+    db_connection.get_db()
+    # Workers claim reports in the catalog, so each can run the archiver
+    report_manager.start_archiver()
+    # Passes take a lock in MongoDB, so only one worker runs one at a time
+    retention_engine.start()
+    # Picks up jobs queued before this worker started, by other workers or
+    # requeued after a worker died, and recovers their lapsed leases
+    scan_queue.start()
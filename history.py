@@ -0,0 +1,218 @@
+# history.py
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from bson import ObjectId
+from bulk_writer import BulkUpsertWriter
+from mongo_connect import db
+from refactor import resource_id_field
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Collections
+SCANS_COLLECTION = "scans"
+RESOURCE_HISTORY_COLLECTION = "resource_history"
+
+# Report directory timestamps, e.g. reports/scout/<account>/20240325_120000
+REPORT_TIMESTAMP_FORMAT = "%Y%m%d_%H%M%S"
+
+
+def _utc(value: datetime) -> datetime:
+    """Naive datetimes (as returned by pymongo) are UTC."""
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def parse_timestamp(value: str) -> datetime:
+    """
+    Parses an as_of / report timestamp: ISO 8601 ('2024-03-25T12:00:00Z',
+    '2021-10-01 20:47:09+0200') or a report directory name ('20240325_120000').
+    Naive values are taken as UTC. Raises ValueError if it can't be parsed.
+    """
+    value = value.strip()
+    try:
+        parsed = datetime.strptime(value, REPORT_TIMESTAMP_FORMAT)
+    except ValueError:
+        if value.endswith("Z"):
+            value = value[:-1] + "+00:00"
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            parsed = datetime.strptime(value, "%Y-%m-%d %H:%M:%S%z")
+    return _utc(parsed)
+
+
+def report_scan_time(data: Dict[str, Any]) -> datetime:
+    """When Scout Suite ran the report (last_run.time), else now."""
+    last_run = data.get("last_run")
+    if isinstance(last_run, dict) and last_run.get("time"):
+        try:
+            return parse_timestamp(last_run["time"])
+        except ValueError:
+            logger.warning(f"Unparseable last_run.time {last_run['time']!r}, using current time")
+    return datetime.now(timezone.utc)
+
+
+class ScanHistoryRecorder:
+    """
+    Records one scan of an account in the point-in-time history.
+
+    Every scan gets a 'scans' document. 'resource_history' keeps one document
+    per version of a resource, valid from the scan that first saw that content
+    (valid_from / first_seen_scan) until the scan where it changed or
+    disappeared (valid_to, with last_seen_scan the scan before). Only added,
+    changed and removed resources are written, so storage grows with change
+    volume rather than with scans x resources. Each version also carries the
+    resource ID as `sort_key`, the order of the paged as_of listings.
+    """
+
+    def __init__(self, account_id: str, scan_time: datetime, account_name: Optional[str] = None,
+                 report_timestamp: Optional[str] = None, batch_size: Optional[int] = None):
+        self.account_id = account_id
+        self.scan_id = ObjectId()
+        self.scan_time = _utc(scan_time)
+
+        previous = db[SCANS_COLLECTION].find_one(
+            {"account_id": account_id, "status": "completed"},
+            {"_id": True},
+            sort=[("scan_time", -1)]
+        )
+        self.previous_scan_id = previous["_id"] if previous else None
+        # Without a previous scan, unchanged resources have no open version yet
+        self.needs_baseline = self.previous_scan_id is None
+
+        db[SCANS_COLLECTION].insert_one({
+            "_id": self.scan_id,
+            "account_id": account_id,
+            "account_name": account_name,
+            "report_timestamp": report_timestamp,
+            "scan_time": self.scan_time,
+            "previous_scan_id": self.previous_scan_id,
+            "ingested_at": datetime.now(timezone.utc),
+            "status": "ingesting"
+        })
+        self._writer = BulkUpsertWriter(db, batch_size, max_workers=1)
+        # collection -> filter on the resources of its versions to close
+        self._closed_collections: Dict[str, Dict[str, Any]] = {}
+
+    def _close_filter(self, collection: str, key: Tuple) -> Dict[str, Any]:
+        return {
+            "account_id": self.account_id,
+            "collection": collection,
+            "key": list(key),
+            "valid_to": None,
+            # Never the version written by this scan, whatever order the batch runs in
+            "first_seen_scan": {"$ne": self.scan_id}
+        }
+
+    def _close_update(self) -> Dict[str, Any]:
+        return {"$set": {"valid_to": self.scan_time, "last_seen_scan": self.previous_scan_id}}
+
+    def record_version(self, collection: str, key: Tuple, doc: Dict[str, Any]) -> None:
+        """A resource was added or changed: close its open version and open a new one."""
+        self._writer.update(RESOURCE_HISTORY_COLLECTION, self._close_filter(collection, key),
+                            self._close_update())
+        self._writer.upsert(
+            RESOURCE_HISTORY_COLLECTION,
+            {"account_id": self.account_id, "collection": collection, "key": list(key),
+             "first_seen_scan": self.scan_id},
+            {"valid_from": self.scan_time, "valid_to": None, "last_seen_scan": None,
+             "sort_key": doc.get(resource_id_field(collection)), "doc": doc}
+        )
+
+    def record_removal(self, collection: str, key: Tuple) -> None:
+        """A resource is missing from this scan: close its open version."""
+        self._writer.update(RESOURCE_HISTORY_COLLECTION, self._close_filter(collection, key),
+                            self._close_update())
+
+    def record_collection_removal(self, collection: str, filter: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Nothing of this type is left: close every open version of the
+        collection, or those whose resource matches `filter` (a partial scan).
+        """
+        self._closed_collections[collection] = filter or {}
+
+    def finish(self, collections: Dict[str, Dict[str, int]]) -> ObjectId:
+        """Flushes the history writes and marks the scan completed."""
+        self._writer.close()
+        for collection, filter in self._closed_collections.items():
+            db[RESOURCE_HISTORY_COLLECTION].update_many(
+                {"account_id": self.account_id, "collection": collection, "valid_to": None,
+                 "first_seen_scan": {"$ne": self.scan_id}, **{f"doc.{field}": value for field, value in filter.items()}},
+                self._close_update()
+            )
+        db[SCANS_COLLECTION].update_one(
+            {"_id": self.scan_id},
+            {"$set": {"status": "completed", "collections": collections}}
+        )
+        return self.scan_id
+
+    def fail(self, error: str) -> None:
+        """
+        Marks the scan failed. The versions recorded so far are still written:
+        the resource batches already flushed carry their new content hashes,
+        so the next scan sees those resources as unchanged and would never
+        record them.
+        """
+        try:
+            self._writer.close()
+        except Exception as e:
+            logger.error(f"Failed to flush the history of scan {self.scan_id}: {str(e)}")
+        db[SCANS_COLLECTION].update_one(
+            {"_id": self.scan_id},
+            {"$set": {"status": "error", "error": error}}
+        )
+
+
+# -------------------------------------------------------------------
+# Point-in-time reads
+# -------------------------------------------------------------------
+def find_resources_as_of(collection: str, filter: Dict[str, Any], as_of: datetime,
+                         limit: int = 0, sort_field: Optional[str] = None, after: Optional[Any] = None,
+                         fields: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Yields the documents of `collection` matching `filter` (which must contain
+    account_id) as they were at `as_of`, answered from the validity intervals.
+    `sort_field`/`after` give the same keyset paging as the live collections,
+    and `fields` limits the returned fields. Sorting (and filtering) on the
+    collection's resource ID goes through the versions' `sort_key`, which the
+    (account_id, collection, sort_key, valid_from) index covers.
+    """
+    id_field = resource_id_field(collection)
+    query: Dict[str, Any] = {
+        "account_id": filter["account_id"],
+        "collection": collection,
+        "valid_from": {"$lte": _utc(as_of)},
+        "$or": [{"valid_to": None}, {"valid_to": {"$gt": _utc(as_of)}}]
+    }
+    for field, value in filter.items():
+        if field != "account_id":
+            query["sort_key" if field == id_field else f"doc.{field}"] = value
+    sort_path = "sort_key" if sort_field == id_field else f"doc.{sort_field}"
+    if sort_field and after is not None:
+        query[sort_path] = {"$gt": after, **({"$eq": query[sort_path]} if sort_path in query else {})}
+
+    projection: Dict[str, Any] = {"_id": False, "doc": True}
+    if fields:
+        projection = {f"doc.{field}": True for field in list(fields) + ([sort_field] if sort_field else [])}
+        projection["_id"] = False
+
+    cursor = db[RESOURCE_HISTORY_COLLECTION].find(query, projection)
+    if sort_field:
+        cursor = cursor.sort(sort_path, 1)
+    if limit:
+        cursor = cursor.limit(limit)
+    for version in cursor:
+        doc = version.get("doc", {})
+        doc.pop("content_hash", None)
+        yield doc
+
+
+def find_scan(account_name: str, report_timestamp: str) -> Optional[Dict[str, Any]]:
+    """The scan ingested from reports/scout/<account_name>/<report_timestamp>, if any."""
+    return db[SCANS_COLLECTION].find_one(
+        {"account_name": account_name, "report_timestamp": report_timestamp, "status": "completed"},
+        sort=[("ingested_at", -1)]
+    )
@@ -0,0 +1,164 @@
+# ingest.py
+import logging
+from contextlib import ExitStack
+from typing import Any, Dict, Optional, TextIO
+
+from mongo_connect import db
+from bulk_writer import ChangeDetectingWriter
+from exposure import ExposureIndexer, store_exposure
+from findings import FindingsIndexer, store_findings
+from history import ScanHistoryRecorder, report_scan_time
+from master_store import MasterDocWriter, store_master_doc
+from parser import ScoutSuiteStreamParser, compile_resource_paths
+from refactor import (collection_name, ensure_resource_indexes, refactor_and_store_resources, removal_scope,
+                      resource_paths_for, store_service_resources)
+from resource_index import ResourceNameIndexer
+from summaries import SummaryCounter, store_account_summary
+from trends import TrendCounter, record_scan_trends, report_trends
+from response_cache import bump_generation
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def ingest_report(data: Dict[str, Any], batch_size: Optional[int] = None,
+                  account_name: Optional[str] = None, report_timestamp: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Stores a parsed Scout Suite report: raw doc in 'master', then every
+    resource in its own collection through batched bulk writes, recording
+    the scan and the resources that changed in the point-in-time history,
+    and the scan's dashboard summary in 'account_summaries'.
+    `account_name`/`report_timestamp` identify the report directory it came from.
+    Every flagged item of the report's findings goes to 'findings', and
+    its per-rule counts to the findings trends. What security groups and
+    public endpoints let in is indexed in 'network_exposure'.
+    Returns the account_id, scan_id, per-collection added/changed/removed/unchanged
+    counts (and those of 'findings' and 'network_exposure'), and the summary's
+    resource and findings counts.
+    """
+    account_id = data.get("account_id")
+    if not account_id:
+        raise KeyError("No 'account_id' found in data")
+
+    history = ScanHistoryRecorder(account_id, report_scan_time(data), account_name=account_name,
+                                  report_timestamp=report_timestamp, batch_size=batch_size)
+    try:
+        # 1) Store raw doc as compressed chunks, with a small header in 'master'
+        store_master_doc(data, account_id)
+
+        # 2) Refactor data into resource-specific collections
+        collections = refactor_and_store_resources(data, batch_size, history=history)
+
+        # 3) One document per flagged item in 'findings'
+        finding_counts = store_findings(data, account_id, history.scan_id,
+                                        compile_resource_paths(resource_paths_for(data)), batch_size)
+
+        # 3b) One document per resource, protocol, port range and source let in
+        exposure_counts = store_exposure(data, account_id, batch_size)
+
+        # 4) Materialize the dashboard counts of this scan
+        summary = store_account_summary(data, account_id, history.scan_id, history.scan_time, collections,
+                              account_name=account_name, report_timestamp=report_timestamp)
+
+        # 5) Flagged items per rule over time (daily/weekly rollups)
+        record_scan_trends(account_id, history.scan_time, report_trends(data), account_name=account_name)
+        history.finish(collections)
+    except Exception as e:
+        history.fail(str(e))
+        raise
+
+    # Cached API responses of this account are stale now
+    bump_generation(account_id)
+
+    logger.info(f"Ingested report for account {account_id}: {collections}, findings {finding_counts}")
+    return {"account_id": account_id, "scan_id": str(history.scan_id), "collections": collections,
+            "finding_items": finding_counts, "exposure": exposure_counts, "resource_counts": summary["resource_counts"],
+            "findings": summary["findings"]}
+
+
+def ingest_report_stream(fp: TextIO, batch_size: Optional[int] = None, account_name: Optional[str] = None,
+                         report_timestamp: Optional[str] = None, label: str = "<stream>") -> Dict[str, Any]:
+    """
+    Same as ingest_report, but reads the report from a text stream (e.g. an
+    upload still in progress) one section at a time: each service is stored
+    as a master chunk, its resources queued for the bulk writers and its
+    counts added to the summary before the next one is read, so memory is
+    bounded by the largest service section rather than the whole report.
+    The header entries before 'services' (account_id, last_run, metadata)
+    are enough to open the scan. `label` names the stream in errors.
+    """
+    stream = ScoutSuiteStreamParser(label, fp=fp)
+    counter = SummaryCounter()
+    trends = TrendCounter()
+    history = master = writer = names = findings = exposure = None
+    account_id = None
+    patterns = []
+    deferred = []
+
+    def open_scan(stack: ExitStack) -> None:
+        nonlocal history, master, writer, names, findings, exposure, account_id, patterns
+        account_id = stream.account_id
+        if not account_id:
+            raise KeyError("No 'account_id' found in data")
+        history = ScanHistoryRecorder(account_id, report_scan_time(stream.header), account_name=account_name,
+                                      report_timestamp=report_timestamp, batch_size=batch_size)
+        master = MasterDocWriter(account_id)
+        patterns = compile_resource_paths(resource_paths_for(stream.header))
+        ensure_resource_indexes(patterns)
+        writer = stack.enter_context(ChangeDetectingWriter(
+            db, account_id, batch_size, collections=[collection_name(p) for p in patterns], history=history,
+            scope=removal_scope(stream.header, patterns)))
+        names = stack.enter_context(ResourceNameIndexer(account_id, batch_size))
+        findings = stack.enter_context(FindingsIndexer(account_id, history.scan_id, patterns, batch_size))
+        exposure = stack.enter_context(ExposureIndexer(account_id, batch_size))
+        trends.add_last_run(stream.header.get("last_run"))
+        for key, value in deferred:
+            master.add_section(key, value)
+            if key == "sg_map":
+                exposure.add_sg_map(value)
+        deferred.clear()
+
+    try:
+        with ExitStack() as stack:
+            for key, value in stream.iter_sections():
+                if history is None and key.startswith("services."):
+                    open_scan(stack)
+                if key.startswith("services."):
+                    service = key.split(".", 1)[1]
+                    master.add_section(key, value)
+                    counter.add_service(service, value)
+                    store_service_resources(writer, account_id, service, value, patterns, names)
+                    findings.add_service(service, value)
+                    exposure.add_service(service, value)
+                    trends.add_service(service, value)
+                elif isinstance(value, (dict, list)):
+                    if master is None:
+                        deferred.append((key, value))
+                    else:
+                        master.add_section(key, value)
+                        if key == "sg_map":
+                            exposure.add_sg_map(value)
+            if history is None:
+                # A report without services
+                open_scan(stack)
+        collections = writer.stats
+
+        master.finish(stream.header)
+        summary = store_account_summary(None, account_id, history.scan_id, history.scan_time, collections,
+                                        account_name=account_name, report_timestamp=report_timestamp,
+                                        counter=counter)
+        record_scan_trends(account_id, history.scan_time, trends, account_name=account_name)
+        history.finish(collections)
+    except Exception as e:
+        if history is not None:
+            history.fail(str(e))
+        raise
+
+    # Cached API responses of this account are stale now
+    bump_generation(account_id)
+
+    logger.info(f"Ingested streamed report for account {account_id}: {collections}, findings {findings.stats}")
+    return {"account_id": account_id, "scan_id": str(history.scan_id), "collections": collections,
+            "finding_items": findings.stats, "exposure": exposure.stats, "resource_counts": summary["resource_counts"],
+            "findings": summary["findings"]}
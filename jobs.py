@@ -0,0 +1,292 @@
+# jobs.py
+import os
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from mongo_connect import db
+from parser import open_report, resolve_report_path
+from ingest import ingest_report_stream
+from scout_runner import ScoutScanError, run_scout_in_process, run_scout_suite
+from report_manager import report_manager
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Scans run at the same time by this process
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "2"))
+# Scans run at the same time for one account, across all processes
+SCAN_MAX_PER_ACCOUNT = int(os.getenv("SCAN_MAX_PER_ACCOUNT", "1"))
+# How often idle workers look for jobs queued by other processes
+SCAN_POLL_INTERVAL_SECONDS = float(os.getenv("SCAN_POLL_INTERVAL_SECONDS", "5"))
+# "subprocess" runs `scout aws` and ingests its results file; "inprocess" runs scout through its
+# Python API in a worker process that ingests the results directly (scout_inprocess.py)
+SCAN_MODE = os.getenv("SCAN_MODE", "subprocess")
+# A running job's lease on its account slot lapses when not renewed for this long
+# (its worker died); the job is then requeued, up to SCAN_MAX_ATTEMPTS runs, or failed
+SCAN_LEASE_SECONDS = int(os.getenv("SCAN_LEASE_SECONDS", "300"))
+SCAN_MAX_ATTEMPTS = int(os.getenv("SCAN_MAX_ATTEMPTS", "2"))
+
+# Lower runs first
+PRIORITIES = {"high": 0, "normal": 10, "low": 20}
+
+# Job statuses
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+ERROR = "error"
+STOPPED = "stopped"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def parse_priority(value: Any) -> int:
+    """Accepts 'high'/'normal'/'low' or an integer (lower runs first)."""
+    if value is None:
+        return PRIORITIES["normal"]
+    if isinstance(value, str) and value.lower() in PRIORITIES:
+        return PRIORITIES[value.lower()]
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid priority: {value!r}")
+
+
+class ScanJobQueue:
+    """
+    Runs Scout Suite scans in the background.
+
+    Jobs live in the 'scan_jobs' collection, which is the queue itself:
+    workers claim the oldest job of the best priority whose account is
+    under SCAN_MAX_PER_ACCOUNT running scans, so several gunicorn workers
+    can share one queue. Each process runs at most SCAN_WORKERS scans.
+
+    An account has SCAN_MAX_PER_ACCOUNT slots in 'scan_leases' (one
+    document per slot); a job only runs while it holds one, taken by an
+    upsert that fails on a live lease, so concurrent workers can't exceed
+    the limit. Running jobs renew their lease; when one lapses, its job is
+    requeued (or failed after SCAN_MAX_ATTEMPTS runs) and the slot freed.
+    """
+
+    def __init__(self, max_workers: int = SCAN_WORKERS, max_per_account: int = SCAN_MAX_PER_ACCOUNT):
+        self.max_workers = max(1, max_workers)
+        self.max_per_account = max(1, max_per_account)
+        self._wakeup = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._stopping = False
+
+    def start(self) -> None:
+        """Starts the worker threads (once per process)."""
+        with self._wakeup:
+            if self._threads:
+                return
+            for index in range(self.max_workers):
+                thread = threading.Thread(target=self._worker, name=f"scan-worker-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self) -> None:
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+
+    def submit(self, account_name: str, profile_name: str = "default", region: Optional[str] = None,
+               username: Optional[str] = None, priority: Any = None,
+               batch_size: Optional[int] = None) -> str:
+        """Queues a scan and returns its job ID right away."""
+        job_id = uuid.uuid4().hex
+        db["scan_jobs"].insert_one({
+            "_id": job_id,
+            "status": QUEUED,
+            "priority": parse_priority(priority),
+            "account_name": account_name,
+            "profile_name": profile_name,
+            "region": region,
+            "username": username,
+            "batch_size": batch_size,
+            "created_at": _now(),
+            "started_at": None,
+            "finished_at": None,
+            "exit_code": None,
+            "error": None
+        })
+        logger.info(f"Queued scan job {job_id} for account {account_name}")
+        self.start()
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return db["scan_jobs"].find_one({"_id": job_id})
+
+    # -- workers ---------------------------------------------------------
+    def _acquire_slot(self, account_name: str, lease: Dict[str, Any]) -> Optional[str]:
+        """Takes a free or lapsed slot of the account; returns its ID, None if all are held."""
+        now = _now()
+        for slot in range(self.max_per_account):
+            slot_id = f"{account_name}:{slot}"
+            try:
+                db["scan_leases"].update_one({"_id": slot_id, "expires_at": {"$lt": now}},
+                                             {"$set": lease}, upsert=True)
+                return slot_id
+            except DuplicateKeyError:
+                # Held by a live lease
+                continue
+        return None
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        """Atomically moves the next runnable job from queued to running, holding a slot of its account."""
+        self._recover_stale()
+        busy_accounts = set()
+        for candidate in db["scan_jobs"].find({"status": QUEUED}, {"account_name": True}).sort(
+                [("priority", ASCENDING), ("created_at", ASCENDING)]).limit(100):
+            account_name = candidate["account_name"]
+            if account_name in busy_accounts:
+                continue
+            token = uuid.uuid4().hex
+            now = _now()
+            slot_id = self._acquire_slot(account_name, {"job_id": candidate["_id"], "token": token,
+                                                        "expires_at": now + timedelta(seconds=SCAN_LEASE_SECONDS)})
+            if slot_id is None:
+                busy_accounts.add(account_name)
+                continue
+            job = db["scan_jobs"].find_one_and_update(
+                {"_id": candidate["_id"], "status": QUEUED},
+                {"$set": {"status": RUNNING, "started_at": now, "heartbeat_at": now, "worker_pid": os.getpid(),
+                          "lease": token, "lease_slot": slot_id},
+                 "$inc": {"attempts": 1}},
+                return_document=ReturnDocument.AFTER
+            )
+            if job is not None:
+                return job
+            # Claimed by another worker in the meantime
+            db["scan_leases"].delete_one({"_id": slot_id, "token": token})
+        return None
+
+    def _recover_stale(self) -> None:
+        """Requeues or fails running jobs whose worker stopped renewing their lease."""
+        stale = _now() - timedelta(seconds=SCAN_LEASE_SECONDS)
+        for job in db["scan_jobs"].find({"status": RUNNING, "$or": [
+                {"heartbeat_at": {"$lt": stale}},
+                # Claimed before leases existed
+                {"heartbeat_at": {"$exists": False}, "started_at": {"$lt": stale}}]}):
+            retry = job.get("attempts", 1) < SCAN_MAX_ATTEMPTS
+            update = {"status": QUEUED, "started_at": None} if retry else {
+                "status": ERROR, "finished_at": _now(), "error": "Scan worker stopped responding"}
+            recovered = db["scan_jobs"].update_one(
+                {"_id": job["_id"], "status": RUNNING, "lease": job.get("lease")},
+                {"$set": update, "$unset": {"lease": "", "lease_slot": "", "heartbeat_at": ""}})
+            if recovered.modified_count:
+                db["scan_leases"].delete_one({"job_id": job["_id"], "token": job.get("lease")})
+                logger.warning(f"Scan job {job['_id']} of account {job['account_name']} lost its worker; "
+                               f"{'requeued' if retry else 'failed'}")
+
+    def _heartbeat(self, job: Dict[str, Any], done: threading.Event) -> None:
+        """Renews a running job's lease until `done` is set."""
+        while not done.wait(max(1, SCAN_LEASE_SECONDS // 5)):
+            now = _now()
+            try:
+                db["scan_leases"].update_one({"_id": job["lease_slot"], "token": job["lease"]},
+                                             {"$set": {"expires_at": now + timedelta(seconds=SCAN_LEASE_SECONDS)}})
+                db["scan_jobs"].update_one({"_id": job["_id"], "lease": job["lease"]},
+                                           {"$set": {"heartbeat_at": now}})
+            except Exception as e:
+                logger.error(f"Failed to renew the lease of scan job {job['_id']}: {str(e)}")
+
+    def _worker(self) -> None:
+        while not self._stopping:
+            try:
+                job = self._claim()
+            except Exception as e:
+                logger.error(f"Failed to claim scan job: {str(e)}")
+                job = None
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(SCAN_POLL_INTERVAL_SECONDS)
+                continue
+            done = threading.Event()
+            threading.Thread(target=self._heartbeat, args=(job, done), name=f"scan-lease-{job['_id']}",
+                             daemon=True).start()
+            try:
+                self._run(job)
+            finally:
+                done.set()
+                db["scan_leases"].delete_one({"_id": job["lease_slot"], "token": job["lease"]})
+            # A finished scan may unblock a job of the same account
+            with self._wakeup:
+                self._wakeup.notify_all()
+
+    def _run(self, job: Dict[str, Any]) -> None:
+        job_id = job["_id"]
+        update: Dict[str, Any] = {}
+        try:
+            logger.info(f"Starting scan job {job_id} for account {job['account_name']}")
+            report_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            db["scan_jobs"].update_one({"_id": job_id}, {"$set": {"report_timestamp": report_timestamp}})
+            timings: Dict[str, Any] = {"mode": SCAN_MODE}
+            scan_args = dict(
+                account_name=job["account_name"],
+                profile_name=job.get("profile_name") or "default",
+                region=job.get("region"),
+                timestamp=report_timestamp,
+                username=job.get("username"),
+                job_id=job_id,
+                on_start=lambda pid: db["scan_jobs"].update_one({"_id": job_id}, {"$set": {"pid": pid}}),
+                timings=timings
+            )
+            update["timings"] = timings
+
+            if SCAN_MODE == "inprocess":
+                # Scanned and ingested in one go; the report is only on disk if archived
+                result = run_scout_in_process(batch_size=job.get("batch_size"), **scan_args)
+                update["scan_finished_at"] = _now()
+                update["exit_code"] = 0
+                update["result_path"] = result.get("report_path")
+            else:
+                output_path = run_scout_suite(**scan_args)
+                update["scan_finished_at"] = _now()
+                update["exit_code"] = 0
+                update["result_path"] = output_path
+
+                # Parsed and ingested one service section at a time
+                stage_started = time.perf_counter()
+                with open_report(resolve_report_path(output_path)) as fp:
+                    result = ingest_report_stream(fp, batch_size=job.get("batch_size"), account_name=job["account_name"],
+                                                  report_timestamp=report_timestamp, label=output_path)
+                timings["ingest_seconds"] = round(time.perf_counter() - stage_started, 3)
+                report_manager.mark_ingested(job["account_name"], report_timestamp, result)
+            update["account_id"] = result["account_id"]
+            update["scan_id"] = result["scan_id"]
+            update["collections"] = result["collections"]
+            update["status"] = COMPLETED
+        except ScoutScanError as e:
+            update["exit_code"] = e.return_code
+            update["status"] = STOPPED if e.return_code < 0 else ERROR
+            update["error"] = str(e)
+        except Exception as e:
+            logger.error(f"Scan job {job_id} failed: {str(e)}")
+            if "result_path" in update:
+                # The report is on disk and catalogued, only its ingestion failed
+                report_manager.mark_failed(job["account_name"], report_timestamp, str(e))
+            update["status"] = ERROR
+            update["error"] = str(e)
+
+        update["finished_at"] = _now()
+        update["duration_seconds"] = (update["finished_at"] - job["started_at"].replace(
+            tzinfo=timezone.utc)).total_seconds()
+        # Unless the lease lapsed and the job was requeued meanwhile
+        db["scan_jobs"].update_one({"_id": job_id, "lease": job["lease"]},
+                                   {"$set": update, "$unset": {"lease": "", "lease_slot": ""}})
+        logger.info(f"Scan job {job_id} finished with status {update['status']}")
+
+
+# Create global scan queue instance
+scan_queue = ScanJobQueue()
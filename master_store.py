@@ -0,0 +1,207 @@
+# master_store.py
+import os
+import json
+import zlib
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from mongo_connect import db
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# zlib level used for the raw report chunks
+MASTER_CHUNK_COMPRESSION_LEVEL = int(os.getenv("MASTER_CHUNK_COMPRESSION_LEVEL", "6"))
+# Compressed chunks larger than this are split into several parts (BSON max is 16 MB)
+MASTER_CHUNK_MAX_BYTES = int(os.getenv("MASTER_CHUNK_MAX_BYTES", str(8 * 1024 * 1024)))
+
+
+def _chunk_sections(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Splits a report into the sections stored as separate chunks:
+    one per service ("services.ec2", ...) and one per other non-scalar
+    top-level key ("last_run", "metadata", "sg_map", ...).
+    """
+    sections = {}
+    for key, value in data.items():
+        if key == "services" and isinstance(value, dict):
+            for service, service_data in value.items():
+                sections[f"services.{service}"] = service_data
+        elif isinstance(value, (dict, list)):
+            sections[key] = value
+    return sections
+
+
+def _report_timestamp(data: Dict[str, Any]) -> str:
+    last_run = data.get("last_run")
+    if isinstance(last_run, dict) and last_run.get("time"):
+        return last_run["time"]
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S%z")
+
+
+class MasterDocWriter:
+    """
+    Writes a report into 'master_chunks' one section at a time (add_section),
+    then publishes it with its header in 'master' (finish), so a report can
+    be stored as it is parsed without ever holding all of it.
+    """
+
+    def __init__(self, account_id: str):
+        self.account_id = account_id
+        self.generation = ObjectId()
+        self.manifest: List[Dict[str, Any]] = []
+
+    def add_section(self, key: str, section: Any) -> None:
+        raw = json.dumps(section, separators=(",", ":")).encode("utf-8")
+        compressed = zlib.compress(raw, MASTER_CHUNK_COMPRESSION_LEVEL)
+        parts = [compressed[i:i + MASTER_CHUNK_MAX_BYTES]
+                 for i in range(0, len(compressed), MASTER_CHUNK_MAX_BYTES)] or [b""]
+        db["master_chunks"].insert_many([
+            {
+                "account_id": self.account_id,
+                "generation": self.generation,
+                "key": key,
+                "part": index,
+                "data": part
+            }
+            for index, part in enumerate(parts)
+        ])
+        self.manifest.append({
+            "key": key,
+            "parts": len(parts),
+            "size": len(raw),
+            "compressed_size": len(compressed)
+        })
+
+    def finish(self, header: Dict[str, Any]) -> None:
+        """
+        `header` holds the report's top-level entries other than 'services';
+        its small scalars (provider_code, partition, ...) stay readable on the
+        'master' doc.
+        """
+        scalars = {k: v for k, v in header.items()
+                   if k != "services" and not isinstance(v, (dict, list))}
+
+        # Switch the header to this generation unless a newer one (a concurrent
+        # ingest of the same account started later) is already installed;
+        # the unique account_id index turns that case's upsert into a duplicate.
+        try:
+            previous = db["master"].find_one_and_replace(
+                {"account_id": self.account_id,
+                 "$or": [{"generation": {"$lt": self.generation}}, {"generation": {"$exists": False}}]},
+                {
+                    **scalars,
+                    "account_id": self.account_id,
+                    "timestamp": _report_timestamp(header),
+                    "generation": self.generation,
+                    "chunks": self.manifest
+                },
+                projection={"generation": True},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            db["master_chunks"].delete_many({"account_id": self.account_id, "generation": self.generation})
+            logger.info(f"Discarded master chunks for account {self.account_id}: a newer report is installed")
+            return
+
+        # Only the generation just replaced is dropped; ingests still writing theirs
+        # clean up after themselves, and crashed ones are purged by the retention engine
+        if previous and previous.get("generation"):
+            db["master_chunks"].delete_many({"account_id": self.account_id, "generation": previous["generation"]})
+        logger.info(f"Stored {len(self.manifest)} master chunks for account {self.account_id}")
+
+
+def store_master_doc(data: Dict[str, Any], account_id: str) -> None:
+    """
+    Stores the raw data as compressed per-service chunks in 'master_chunks',
+    and a small header (account, timestamp, chunk manifest) in 'master'.
+    Overwrites or upserts as needed.
+    """
+    writer = MasterDocWriter(account_id)
+    for key, section in _chunk_sections(data).items():
+        writer.add_section(key, section)
+    writer.finish(data)
+
+
+def decode_chunk(parts: Iterable[Dict[str, Any]]) -> Any:
+    """Joins and decompresses the 'master_chunks' parts of one section (sorted by part)."""
+    compressed = b"".join(bytes(part["data"]) for part in parts)
+    return json.loads(zlib.decompress(compressed).decode("utf-8"))
+
+
+def walk_path(node: Any, parts: List[str]) -> Optional[Any]:
+    for part in parts:
+        if not isinstance(node, dict) or part not in node:
+            return None
+        node = node[part]
+    return node
+
+
+def resolve_master_path(master_doc: Dict[str, Any], path: str) -> Tuple[Optional[str], List[str], Optional[Any]]:
+    """
+    Works out where `path` lives for a 'master' header: (chunk key, path parts
+    within that chunk, None) when it is inside a chunk, else (None, [], value)
+    with the value read from the header itself (None if it doesn't exist).
+    """
+    parts = path.split(".")
+    if "raw_data" in master_doc:
+        # Written before reports were chunked
+        return None, [], walk_path(master_doc["raw_data"], parts)
+
+    keys = [chunk["key"] for chunk in master_doc.get("chunks", [])]
+    chunk_key = ".".join(parts[:2]) if parts[0] == "services" else parts[0]
+    if chunk_key not in keys:
+        # Scalar top-level values live on the header itself
+        value = master_doc.get(path) if len(parts) == 1 and path != "services" else None
+        return None, [], value
+    return chunk_key, parts[len(chunk_key.split(".")):], None
+
+
+def _chunk_query(account_id: str, generation: ObjectId, key: str) -> Dict[str, Any]:
+    return {"account_id": account_id, "generation": generation, "key": key}
+
+
+def _load_chunk(account_id: str, generation: ObjectId, key: str) -> Any:
+    parts = db["master_chunks"].find(
+        _chunk_query(account_id, generation, key),
+        {"_id": False, "data": True}
+    ).sort("part", 1)
+    return decode_chunk(parts)
+
+
+def load_master_section(account_id: str, path: str) -> Optional[Any]:
+    """
+    Lazily loads one part of the raw report, e.g. 'services.ec2',
+    'services.ec2.regions.us-east-1' or 'last_run.summary'.
+    Only the chunk holding that path is fetched and decompressed.
+    Returns None if the account or path doesn't exist.
+    """
+    master_doc = db["master"].find_one({"account_id": account_id}, {"_id": False})
+    if not master_doc:
+        return None
+    chunk_key, parts, value = resolve_master_path(master_doc, path)
+    if chunk_key is None:
+        return value
+    return walk_path(_load_chunk(account_id, master_doc["generation"], chunk_key), parts)
+
+
+def load_master_doc(account_id: str) -> Optional[Dict[str, Any]]:
+    """Reassembles the full raw report of an account from its chunks."""
+    master_doc = db["master"].find_one({"account_id": account_id}, {"_id": False})
+    if not master_doc:
+        return None
+    if "raw_data" in master_doc:
+        return master_doc["raw_data"]
+
+    data = {k: v for k, v in master_doc.items() if k not in ("generation", "chunks", "timestamp")}
+    for chunk in master_doc.get("chunks", []):
+        section = _load_chunk(account_id, master_doc["generation"], chunk["key"])
+        if chunk["key"].startswith("services."):
+            data.setdefault("services", {})[chunk["key"].split(".", 1)[1]] = section
+        else:
+            data[chunk["key"]] = section
+    return data
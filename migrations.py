@@ -0,0 +1,243 @@
+# migrations.py
+import os
+import sys
+import socket
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from mongo_connect import db
+from refactor import resource_id_field
+from trends import FINDINGS_TIMESERIES_COLLECTION, TRENDS_RAW_RETENTION_DAYS
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_COLLECTION = "schema_migrations"
+# A runner that died holding the lock loses it after this long
+MIGRATION_LOCK_TIMEOUT_SECONDS = int(os.getenv("MIGRATION_LOCK_TIMEOUT_SECONDS", "600"))
+
+_LOCK_ID = "lock"
+
+
+# -------------------------------------------------------------------
+# Migration steps; append new ones, never edit or reorder applied ones.
+# Each step must be idempotent (create_index is).
+# -------------------------------------------------------------------
+def _initial_indexes():
+    # EC2 instances indexes
+    db.ec2_instances.create_index([("account_id", 1), ("instance_id", 1)], unique=True)
+    db.ec2_instances.create_index([("region", 1)])
+    db.ec2_instances.create_index([("vpc_id", 1)])
+    db.ec2_instances.create_index([("account_id", 1), ("region", 1), ("instance_id", 1)])
+    db.ec2_instances.create_index([("account_id", 1), ("vpc_id", 1), ("instance_id", 1)])
+
+    # S3 buckets indexes
+    db.s3_buckets.create_index([("account_id", 1)])
+    db.s3_buckets.create_index([("name", 1)])
+    db.s3_buckets.create_index([("account_id", 1), ("region", 1), ("id", 1)])
+    db.s3_buckets.create_index([("account_id", 1), ("name", 1), ("id", 1)])
+
+    # IAM users indexes
+    db.iam_users.create_index([("account_id", 1)])
+    db.iam_users.create_index([("username", 1)])
+    db.iam_users.create_index([("account_id", 1), ("name", 1), ("id", 1)])
+
+    # Master collection indexes
+    db.master.create_index([("account_id", 1)], unique=True)
+    db.master_chunks.create_index([("account_id", 1), ("generation", 1), ("key", 1), ("part", 1)])
+
+    # Scan history indexes
+    db.scans.create_index([("account_id", 1), ("scan_time", -1)])
+    db.scans.create_index([("account_name", 1), ("report_timestamp", 1)])
+    db.resource_history.create_index([("account_id", 1), ("collection", 1), ("valid_from", 1), ("valid_to", 1)])
+    db.resource_history.create_index([("account_id", 1), ("collection", 1), ("key", 1), ("valid_to", 1)])
+
+    # Resource name index
+    db.resource_names.create_index([("account_id", 1), ("path", 1)], unique=True)
+    db.resource_names.create_index([("account_id", 1), ("terms", 1)])
+
+    # Dashboard summary indexes
+    db.account_summaries.create_index([("scan_id", 1)], unique=True)
+    db.account_summaries.create_index([("account_id", 1), ("scan_time", -1)])
+    db.account_summaries.create_index([("scan_time", -1)])
+
+    # Scan job queue indexes
+    db.scan_jobs.create_index([("status", 1), ("priority", 1), ("created_at", 1)])
+    db.scan_jobs.create_index([("account_name", 1), ("status", 1)])
+
+
+def _response_cache_indexes():
+    # Shared response cache entries expire on their own
+    db.response_cache.create_index([("expires_at", 1)], expireAfterSeconds=0)
+    db.response_cache.create_index([("account_id", 1)])
+
+
+def _report_catalog_indexes():
+    db.report_catalog.create_index([("account_name", 1), ("timestamp", 1)], unique=True)
+    db.report_catalog.create_index([("account_name", 1), ("report_time", -1)])
+    db.report_catalog.create_index([("status", 1)])
+
+
+def _scan_progress_indexes():
+    # Mirrored scan progress events, streamed in order and expired on their own
+    db.scan_progress.create_index([("job_id", 1), ("seq", 1)], unique=True)
+    db.scan_progress.create_index([("expires_at", 1)], expireAfterSeconds=0)
+
+
+def _findings_indexes():
+    # One document per flagged item: the ingest key, "all dangers in account X"
+    # (also answers the counts by level/service/rule from the index alone),
+    # and "all findings for resource Y"
+    db.findings.create_index([("account_id", 1), ("rule", 1), ("item", 1)], unique=True)
+    db.findings.create_index([("account_id", 1), ("level", 1), ("service", 1), ("rule", 1), ("item", 1)])
+    db.findings.create_index([("account_id", 1), ("resource_id", 1)])
+    db.findings.create_index([("resource_id", 1)])
+
+
+def _findings_trends():
+    # Raw trend points as a time-series collection (MongoDB 5.0+), expiring
+    # after TRENDS_RAW_RETENTION_DAYS; a plain indexed collection on older servers
+    if FINDINGS_TIMESERIES_COLLECTION not in db.list_collection_names():
+        options = {"timeseries": {"timeField": "time", "metaField": "meta", "granularity": "hours"}}
+        if TRENDS_RAW_RETENTION_DAYS > 0:
+            options["expireAfterSeconds"] = TRENDS_RAW_RETENTION_DAYS * 86400
+        try:
+            db.create_collection(FINDINGS_TIMESERIES_COLLECTION, **options)
+        except OperationFailure as e:
+            logger.warning(f"Time-series collections unsupported ({str(e)}), using a regular collection")
+            db[FINDINGS_TIMESERIES_COLLECTION].create_index([("meta.account_id", 1), ("time", 1)])
+    db[FINDINGS_TIMESERIES_COLLECTION].create_index([("meta.rule", 1), ("time", 1)])
+
+    # Rollup buckets: one per (account or org, day or week); range queries walk the start
+    db.findings_trends.create_index([("scope", 1), ("account_id", 1), ("period", 1), ("start", 1)], unique=True)
+    db.findings_trend_scans.create_index([("account_id", 1), ("scan_time", 1)], unique=True)
+
+
+def _retention_indexes():
+    # Compacting an account's resource history finds versions by when they ended
+    db.resource_history.create_index([("account_id", 1), ("valid_to", 1)])
+    db.retention_runs.create_index([("started_at", -1)])
+
+
+def _network_exposure_indexes():
+    # The ingest key; "what lets port X in" (a range's aligned port blocks, all
+    # accounts, optionally public sources only); "whose source contains address
+    # Y" (its network and supernets); "which sources are inside network Z";
+    # and per resource/security group
+    db.network_exposure.create_index([("account_id", 1), ("key", 1)], unique=True)
+    db.network_exposure.create_index([("port_blocks", 1), ("public_source", 1), ("account_id", 1), ("key", 1)])
+    db.network_exposure.create_index([("cidr_key", 1), ("account_id", 1), ("key", 1)])
+    db.network_exposure.create_index([("cidr_version", 1), ("cidr_start", 1), ("cidr_prefix", 1)])
+    db.network_exposure.create_index([("account_id", 1), ("resource_id", 1)])
+    db.network_exposure.create_index([("resource_id", 1)])
+    db.network_exposure.create_index([("security_group", 1)])
+
+
+def _history_sort_keys():
+    # Paged as_of listings sort versions by resource ID: copy it to the top level
+    # of the versions written before it was stored there, then index it
+    for collection in db.resource_history.distinct("collection"):
+        id_field = resource_id_field(collection)
+        requests = []
+        for version in db.resource_history.find({"collection": collection, "sort_key": {"$exists": False}},
+                                                {f"doc.{id_field}": True}):
+            sort_key = (version.get("doc") or {}).get(id_field)
+            requests.append(UpdateOne({"_id": version["_id"]}, {"$set": {"sort_key": sort_key}}))
+            if len(requests) == 1000:
+                db.resource_history.bulk_write(requests, ordered=False)
+                requests = []
+        if requests:
+            db.resource_history.bulk_write(requests, ordered=False)
+    db.resource_history.create_index([("account_id", 1), ("collection", 1), ("sort_key", 1), ("valid_from", 1)])
+
+MIGRATIONS: List[Tuple[int, str, Callable[[], None]]] = [
+    (1, "initial indexes", _initial_indexes),
+    (2, "response cache indexes", _response_cache_indexes),
+    (3, "report catalog indexes", _report_catalog_indexes),
+    (4, "scan progress indexes", _scan_progress_indexes),
+    (5, "findings indexes", _findings_indexes),
+    (6, "findings trends", _findings_trends),
+    (7, "retention indexes", _retention_indexes),
+    (8, "network exposure indexes", _network_exposure_indexes),
+    (9, "resource history sort keys", _history_sort_keys),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def applied_versions() -> List[int]:
+    return sorted(doc["_id"] for doc in db[MIGRATIONS_COLLECTION].find({"_id": {"$type": "int"}}, {"_id": True}))
+
+
+def _acquire_lock(owner: str) -> bool:
+    now = datetime.now(timezone.utc)
+    try:
+        db[MIGRATIONS_COLLECTION].update_one(
+            {"_id": _LOCK_ID, "$or": [{"expires_at": {"$lt": now}}, {"owner": owner}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=MIGRATION_LOCK_TIMEOUT_SECONDS)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        # Someone else holds a live lock
+        return False
+
+
+def _release_lock(owner: str) -> None:
+    db[MIGRATIONS_COLLECTION].delete_one({"_id": _LOCK_ID, "owner": owner})
+
+
+def run_migrations() -> List[int]:
+    """
+    Applies every migration not yet recorded in 'schema_migrations', in order.
+    Runs once per deployment (gunicorn master, `python migrations.py`), not per
+    worker; a lock keeps concurrent runners from overlapping. Returns the
+    versions applied by this call.
+    """
+    done = set(applied_versions())
+    pending = [m for m in MIGRATIONS if m[0] not in done]
+    if not pending:
+        logger.info(f"MongoDB schema is up to date (version {LATEST_VERSION})")
+        return []
+
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    if not _acquire_lock(owner):
+        logger.info("Another process is running migrations, skipping")
+        return []
+
+    applied = []
+    try:
+        for version, name, step in pending:
+            # Re-check under the lock in case another runner just finished it
+            if db[MIGRATIONS_COLLECTION].find_one({"_id": version}):
+                continue
+            logger.info(f"Applying migration {version}: {name}")
+            try:
+                step()
+            except OperationFailure as e:
+                logger.error(f"Migration {version} ({name}) failed: {str(e)}")
+                raise
+            db[MIGRATIONS_COLLECTION].insert_one({
+                "_id": version,
+                "name": name,
+                "applied_at": datetime.now(timezone.utc),
+                "applied_by": owner
+            })
+            applied.append(version)
+    finally:
+        _release_lock(owner)
+
+    logger.info(f"Applied migrations {applied}, schema is at version {LATEST_VERSION}")
+    return applied
+
+
+if __name__ == "__main__":
+    try:
+        run_migrations()
+    except Exception as e:
+        logger.error(f"Migrations failed: {str(e)}")
+        sys.exit(1)
@@ -1,9 +1,10 @@
 # mongo_connect.py
 from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, OperationFailure
 import os
+import time
 import logging
-from typing import Optional
+import threading
+from typing import Any, Dict, Optional
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -19,7 +20,18 @@ MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))
 CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
 SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
 
+# Seconds between background pings of the health monitor
+HEALTH_CHECK_INTERVAL_SECONDS = float(os.getenv("MONGO_HEALTH_CHECK_INTERVAL_SECONDS", "10"))
+
 class MongoDBConnection:
+    """
+    Process-wide MongoClient, created on first use rather than at import so
+    importing the app never blocks on the server (and gunicorn workers each
+    create their own client after forking).
+
+    pymongo reconnects on its own, so nothing pings per call: a daemon thread
+    pings every HEALTH_CHECK_INTERVAL_SECONDS and keeps health() up to date.
+    """
     _instance: Optional['MongoDBConnection'] = None
     _client: Optional[MongoClient] = None
     _db = None
@@ -27,14 +39,15 @@ class MongoDBConnection:
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(MongoDBConnection, cls).__new__(cls)
+            cls._instance._lock = threading.Lock()
+            cls._instance._monitor = None
+            cls._instance._healthy = None
+            cls._instance._last_error = None
+            cls._instance._last_check = None
         return cls._instance
 
-    def __init__(self):
-        if self._client is None:
-            self._connect()
-
     def _connect(self):
-        """Establish connection to MongoDB with retry logic"""
+        """Create the client; this doesn't wait for the server (server selection is lazy)"""
         try:
             self._client = MongoClient(
                 MONGO_URI,
@@ -43,30 +56,52 @@ class MongoDBConnection:
                 connectTimeoutMS=CONNECT_TIMEOUT_MS,
                 serverSelectionTimeoutMS=SERVER_SELECTION_TIMEOUT_MS
             )
-            
-            # Test the connection
-            self._client.admin.command('ping')
-            
             self._db = self._client[DB_NAME]
-            logger.info(f"Successfully connected to MongoDB at {MONGO_URI}")
-            
-        except ConnectionFailure as e:
-            logger.error(f"Failed to connect to MongoDB: {str(e)}")
-            raise
+            logger.info(f"MongoDB client created for {MONGO_URI}")
         except Exception as e:
-            logger.error(f"Unexpected error connecting to MongoDB: {str(e)}")
+            logger.error(f"Unexpected error creating MongoDB client: {str(e)}")
             raise
-
-    def get_db(self):
-        """Get database instance with connection check"""
+        self._start_monitor()
+
+    def _start_monitor(self):
+        if self._monitor is not None and self._monitor.is_alive():
+            return
+        self._monitor = threading.Thread(target=self._monitor_loop, name="mongo-health", daemon=True)
+        self._monitor.start()
+
+    def _monitor_loop(self):
+        while self._client is not None:
+            self.check_health()
+            time.sleep(HEALTH_CHECK_INTERVAL_SECONDS)
+
+    def check_health(self) -> bool:
+        """Pings the server once and records the outcome"""
+        client = self._client
+        if client is None:
+            return False
         try:
-            # Check if connection is still alive
-            self._client.admin.command('ping')
-            return self._db
+            client.admin.command('ping')
+            if self._healthy is False:
+                logger.info("MongoDB connection restored")
+            self._healthy, self._last_error = True, None
         except Exception as e:
-            logger.warning(f"MongoDB connection lost, attempting to reconnect: {str(e)}")
-            self._connect()
-            return self._db
+            if self._healthy is not False:
+                logger.warning(f"MongoDB health check failed: {str(e)}")
+            self._healthy, self._last_error = False, str(e)
+        self._last_check = time.time()
+        return self._healthy
+
+    def health(self) -> Dict[str, Any]:
+        """Last known state from the health monitor (healthy is None until the first ping)"""
+        return {"healthy": self._healthy, "last_error": self._last_error, "last_check": self._last_check}
+
+    def get_db(self):
+        """Get database instance, creating the client on first use"""
+        if self._db is None:
+            with self._lock:
+                if self._db is None:
+                    self._connect()
+        return self._db
 
     def close(self):
         """Close MongoDB connection"""
@@ -76,36 +111,20 @@ class MongoDBConnection:
             self._db = None
             logger.info("MongoDB connection closed")
 
+
+class LazyDatabase:
+    """
+    Module-level `db`: forwards every access to db_connection.get_db(),
+    so `from mongo_connect import db` works without connecting at import.
+    """
+
+    def __getattr__(self, name):
+        return getattr(db_connection.get_db(), name)
+
+    def __getitem__(self, name):
+        return db_connection.get_db()[name]
+
+
 # Create global MongoDB connection instance
 db_connection = MongoDBConnection()
-db = db_connection.get_db()
-
-def setup_indexes():
-    """Set up MongoDB indexes for better query performance"""
-    try:
-        # EC2 instances indexes
-        db.ec2_instances.create_index([("account_id", 1), ("instance_id", 1)], unique=True)
-        db.ec2_instances.create_index([("region", 1)])
-        db.ec2_instances.create_index([("vpc_id", 1)])
-
-        # S3 buckets indexes
-        db.s3_buckets.create_index([("account_id", 1)])
-        db.s3_buckets.create_index([("name", 1)])
-
-        # IAM users indexes
-        db.iam_users.create_index([("account_id", 1)])
-        db.iam_users.create_index([("username", 1)])
-
-        # Master collection indexes
-        db.master.create_index([("account_id", 1)], unique=True)
-
-        logger.info("Successfully created MongoDB indexes")
-    except OperationFailure as e:
-        logger.error(f"Failed to create MongoDB indexes: {str(e)}")
-        raise
-    except Exception as e:
-        logger.error(f"Unexpected error creating MongoDB indexes: {str(e)}")
-        raise
-
-# Call this when your application starts
-setup_indexes()
+db = LazyDatabase()
@@ -0,0 +1,431 @@
+# orchestrator.py
+import os
+import sys
+import glob
+import json
+import heapq
+import random
+import signal
+import logging
+import argparse
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from ingest import ingest_report_stream
+from parser import open_report
+from report_manager import report_manager
+from scout_runner import SCOUT_LOG_DIR, run_scout_suite, scout_pid_file
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Scout processes run at once; 0 derives it from CPUs and memory
+ORCHESTRATOR_MAX_CONCURRENCY = int(os.getenv("ORCHESTRATOR_MAX_CONCURRENCY", "0"))
+# Scout mostly waits on AWS APIs, so a CPU can drive a few of them
+ORCHESTRATOR_SCANS_PER_CPU = float(os.getenv("ORCHESTRATOR_SCANS_PER_CPU", "2"))
+# Memory one scout process may need; no scan starts unless this much is available
+ORCHESTRATOR_MEMORY_PER_SCAN_MB = int(os.getenv("ORCHESTRATOR_MEMORY_PER_SCAN_MB", "1024"))
+# Attempts per account, and the delay before the first retry (doubled for each further one)
+ORCHESTRATOR_MAX_ATTEMPTS = int(os.getenv("ORCHESTRATOR_MAX_ATTEMPTS", "3"))
+ORCHESTRATOR_BACKOFF_SECONDS = float(os.getenv("ORCHESTRATOR_BACKOFF_SECONDS", "60"))
+# Finished reports ingested at once
+ORCHESTRATOR_INGEST_WORKERS = int(os.getenv("ORCHESTRATOR_INGEST_WORKERS", "2"))
+# How long a cancelled scout process gets to exit after SIGTERM before SIGKILL
+ORCHESTRATOR_KILL_GRACE_SECONDS = float(os.getenv("ORCHESTRATOR_KILL_GRACE_SECONDS", "10"))
+
+# Outcome of each account
+COMPLETED = "completed"
+FAILED = "failed"
+INGEST_FAILED = "ingest_failed"
+CANCELLED = "cancelled"
+
+
+class ScanTarget(NamedTuple):
+    account_name: str
+    profile_name: str = "default"
+    region: Optional[str] = None
+
+
+def parse_targets(lines: List[str]) -> List[ScanTarget]:
+    """Reads 'account[,profile[,region]]' lines; blank lines and '#' comments are skipped."""
+    targets = []
+    for line in lines:
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        parts = [part.strip() for part in line.split(",")]
+        targets.append(ScanTarget(parts[0], (parts[1] if len(parts) > 1 and parts[1] else "default"),
+                                  parts[2] if len(parts) > 2 and parts[2] else None))
+    return targets
+
+
+def _available_memory_bytes() -> Optional[int]:
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def default_concurrency() -> int:
+    """Scans the host can run at once: bounded by CPUs and by available memory."""
+    if ORCHESTRATOR_MAX_CONCURRENCY > 0:
+        return ORCHESTRATOR_MAX_CONCURRENCY
+    by_cpu = int((os.cpu_count() or 1) * ORCHESTRATOR_SCANS_PER_CPU)
+    memory = _available_memory_bytes()
+    by_memory = memory // (ORCHESTRATOR_MEMORY_PER_SCAN_MB * 1024 * 1024) if memory else by_cpu
+    return max(1, min(by_cpu, by_memory))
+
+
+def _is_scout_process(pid: int) -> bool:
+    """Guards against PID reuse: the PID must still belong to a scout process (where /proc tells)."""
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return b"scout" in f.read().lower()
+    except FileNotFoundError:
+        return False
+    except OSError:
+        return True
+
+
+def terminate_scout(pid_file: str, grace_seconds: float = ORCHESTRATOR_KILL_GRACE_SECONDS) -> bool:
+    """
+    Stops the scout process recorded in a PID file, and its process group:
+    SIGTERM first, SIGKILL if it is still alive after `grace_seconds`.
+    Returns False if there was nothing to stop.
+    """
+    try:
+        with open(pid_file) as f:
+            pid = int(f.read().strip())
+    except (OSError, ValueError):
+        return False
+    if not _is_scout_process(pid):
+        return False
+
+    def signal_group(sig):
+        try:
+            # scout_runner starts scout as a session leader, so its PID is its group ID
+            os.killpg(pid, sig)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            os.kill(pid, sig)
+        return True
+
+    if not signal_group(signal.SIGTERM):
+        return False
+    deadline = time.monotonic() + grace_seconds
+    while time.monotonic() < deadline:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        time.sleep(0.2)
+    logger.warning(f"Scout process {pid} ignored SIGTERM, killing it")
+    signal_group(signal.SIGKILL)
+    return True
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+class ScanOrchestrator:
+    """
+    Scans many accounts in parallel: up to `concurrency` scout processes at
+    once (and no new one while available memory is below
+    ORCHESTRATOR_MEMORY_PER_SCAN_MB), retrying failed scans with exponential
+    backoff, and handing each finished report to a separate ingest pool so
+    scan slots free up right away.
+
+    Every scout process writes its PID file under logs/scout as
+    '<run_id>-<n>-<attempt>.scout_pid'; cancel() (also on SIGTERM/SIGINT of
+    the CLI) stops the running ones through those files, and
+    `python orchestrator.py cancel <run_id>` does the same from another shell.
+    """
+
+    def __init__(self, targets: List[ScanTarget], concurrency: Optional[int] = None,
+                 max_attempts: int = ORCHESTRATOR_MAX_ATTEMPTS, backoff_seconds: float = ORCHESTRATOR_BACKOFF_SECONDS,
+                 ingest_workers: int = ORCHESTRATOR_INGEST_WORKERS, batch_size: Optional[int] = None,
+                 run_id: Optional[str] = None):
+        self.targets = list(targets)
+        self.concurrency = max(1, concurrency or default_concurrency())
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_seconds = backoff_seconds
+        self.batch_size = batch_size
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self._ingest_pool = ThreadPoolExecutor(max_workers=max(1, ingest_workers),
+                                               thread_name_prefix=f"ingest-{self.run_id}")
+        self._cond = threading.Condition()
+        # (ready_at, index, attempt), ready_at in time.monotonic()
+        self._pending = [(0.0, index, 1) for index in range(len(self.targets))]
+        heapq.heapify(self._pending)
+        self._in_flight = 0
+        self._running: Dict[str, int] = {}
+        self._cancelled = False
+        # One ingest at a time per account: the same account listed with several
+        # profiles or regions would otherwise race on the per-account upserts
+        self._account_locks = {t.account_name: threading.Lock() for t in self.targets}
+        self._shared_accounts: Dict[str, int] = {}
+        for t in self.targets:
+            self._shared_accounts[t.account_name] = self._shared_accounts.get(t.account_name, 0) + 1
+        self.results: List[Dict[str, Any]] = [
+            {"account_name": t.account_name, "profile_name": t.profile_name, "region": t.region,
+             "status": None, "attempts": 0, "scan_seconds": 0.0, "ingest_seconds": None, "error": None}
+            for t in self.targets
+        ]
+
+    # -- scheduling ------------------------------------------------------
+    def _next(self) -> Optional[tuple]:
+        """Blocks until a scan may start; None once there is nothing left to do."""
+        with self._cond:
+            while True:
+                if self._cancelled or (not self._pending and self._in_flight == 0):
+                    return None
+                if self._pending:
+                    wait = self._pending[0][0] - time.monotonic()
+                    if wait <= 0 and (self._in_flight == 0 or self._memory_allows()):
+                        item = heapq.heappop(self._pending)
+                        self._in_flight += 1
+                        return item
+                    self._cond.wait(max(0.5, wait) if wait > 0 else 5)
+                else:
+                    # Scans in flight may still come back for a retry
+                    self._cond.wait()
+
+    @staticmethod
+    def _memory_allows() -> bool:
+        memory = _available_memory_bytes()
+        return memory is None or memory >= ORCHESTRATOR_MEMORY_PER_SCAN_MB * 1024 * 1024
+
+    def _done(self, retry: Optional[tuple] = None) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            if retry is not None and not self._cancelled:
+                heapq.heappush(self._pending, retry)
+            self._cond.notify_all()
+
+    def _backoff(self, attempt: int) -> float:
+        return self.backoff_seconds * (2 ** (attempt - 1)) * random.uniform(0.75, 1.25)
+
+    # -- work ------------------------------------------------------------
+    def _worker(self) -> None:
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            _, index, attempt = item
+            retry = None
+            try:
+                retry = self._scan(index, attempt)
+            finally:
+                self._done(retry)
+
+    def _started(self, job_id: str, pid: int) -> None:
+        self._running[job_id] = pid
+        if self._cancelled:
+            # cancel() ran while this process was being started
+            threading.Thread(target=terminate_scout, args=(scout_pid_file(job_id),), daemon=True).start()
+
+    def _scan(self, index: int, attempt: int) -> Optional[tuple]:
+        """Runs one scout attempt; returns the retry to schedule, if any."""
+        target = self.targets[index]
+        result = self.results[index]
+        if self._cancelled:
+            return None
+        job_id = f"{self.run_id}-{index}-{attempt}"
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        if self._shared_accounts.get(target.account_name, 0) > 1:
+            # Another target of the same account may start in the same second:
+            # keep their report directories (and catalog entries) apart
+            timestamp = f"{timestamp}-{index}"
+        result["attempts"] = attempt
+        started = time.perf_counter()
+        try:
+            output_path = run_scout_suite(
+                account_name=target.account_name,
+                profile_name=target.profile_name,
+                region=target.region,
+                timestamp=timestamp,
+                job_id=job_id,
+                on_start=lambda pid: self._started(job_id, pid)
+            )
+        except Exception as e:
+            result["scan_seconds"] += time.perf_counter() - started
+            result["error"] = str(e)
+            # A negative return code is a signal; only a cancel of this run makes it a stop,
+            # otherwise (e.g. the OOM killer) the scan is retried like any failure
+            if self._cancelled:
+                result["status"] = CANCELLED
+                return None
+            if attempt < self.max_attempts:
+                delay = self._backoff(attempt)
+                logger.warning(f"Scan of {target.account_name} failed (attempt {attempt}/{self.max_attempts}), "
+                               f"retrying in {delay:.0f}s: {str(e)}")
+                return time.monotonic() + delay, index, attempt + 1
+            result["status"] = FAILED
+            logger.error(f"Scan of {target.account_name} failed after {attempt} attempts: {str(e)}")
+            return None
+        finally:
+            self._running.pop(job_id, None)
+
+        result["scan_seconds"] += time.perf_counter() - started
+        result["error"] = None
+        self._ingest_pool.submit(self._ingest, index, output_path, timestamp)
+        return None
+
+    def _ingest(self, index: int, output_path: str, timestamp: str) -> None:
+        target = self.targets[index]
+        result = self.results[index]
+        started = time.perf_counter()
+        try:
+            with self._account_locks[target.account_name], open_report(output_path) as fp:
+                ingested = ingest_report_stream(fp, self.batch_size, account_name=target.account_name,
+                                                report_timestamp=timestamp, label=output_path)
+            report_manager.mark_ingested(target.account_name, timestamp, ingested)
+            result.update({
+                "status": COMPLETED,
+                "account_id": ingested["account_id"],
+                "scan_id": ingested["scan_id"],
+                "resources": sum(ingested["resource_counts"].values())
+            })
+        except Exception as e:
+            logger.error(f"Ingesting the report of {target.account_name} failed: {str(e)}")
+            report_manager.mark_failed(target.account_name, timestamp, str(e))
+            result.update({"status": INGEST_FAILED, "error": str(e)})
+        finally:
+            result["ingest_seconds"] = time.perf_counter() - started
+
+    # -- control ---------------------------------------------------------
+    def run(self) -> Dict[str, Any]:
+        """Scans and ingests every target; blocks until done or cancelled and returns the summary."""
+        logger.info(f"Orchestrator run {self.run_id}: {len(self.targets)} accounts, concurrency {self.concurrency}")
+        started = time.perf_counter()
+        workers = [threading.Thread(target=self._worker, name=f"scan-{self.run_id}-{n}", daemon=True)
+                   for n in range(min(self.concurrency, len(self.targets)))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self._ingest_pool.shutdown(wait=True)
+        for result in self.results:
+            if result["status"] is None:
+                result["status"] = CANCELLED
+        return self.summary(time.perf_counter() - started)
+
+    def cancel(self) -> None:
+        """Stops scheduling scans and terminates the running scout processes through their PID files."""
+        with self._cond:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            self._pending.clear()
+            self._cond.notify_all()
+        logger.warning(f"Cancelling orchestrator run {self.run_id}")
+        for job_id in list(self._running):
+            terminate_scout(scout_pid_file(job_id))
+
+    def summary(self, wall_clock_seconds: float) -> Dict[str, Any]:
+        statuses: Dict[str, int] = {}
+        for result in self.results:
+            statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+        durations = [r["scan_seconds"] + (r["ingest_seconds"] or 0) for r in self.results if r["attempts"]]
+        completed = statuses.get(COMPLETED, 0)
+        resources = sum(r.get("resources", 0) for r in self.results)
+        return {
+            "run_id": self.run_id,
+            "concurrency": self.concurrency,
+            "wall_clock_seconds": round(wall_clock_seconds, 3),
+            "accounts": len(self.targets),
+            "statuses": statuses,
+            "accounts_per_hour": round(completed / wall_clock_seconds * 3600, 2) if wall_clock_seconds else None,
+            "resources_per_second": round(resources / wall_clock_seconds, 2) if wall_clock_seconds else None,
+            "account_seconds": {
+                "mean": round(statistics.mean(durations), 3),
+                "p50": round(_percentile(durations, 0.50), 3),
+                "p95": round(_percentile(durations, 0.95), 3),
+                "max": round(max(durations), 3)
+            } if durations else None,
+            # Serial time over wall-clock time: how much the parallelism bought
+            "speedup": round(sum(durations) / wall_clock_seconds, 2) if wall_clock_seconds and durations else None,
+            "results": self.results
+        }
+
+
+def cancel_run(run_id: str) -> int:
+    """
+    Cancels a run from another process: signals the orchestrator (which stops
+    its scans itself) and terminates any scout process of the run whose PID
+    file is still there. Returns the number of scout processes stopped.
+    """
+    orchestrator_pid_file = os.path.join(SCOUT_LOG_DIR, f"{run_id}.orchestrator_pid")
+    try:
+        with open(orchestrator_pid_file) as f:
+            os.kill(int(f.read().strip()), signal.SIGTERM)
+    except (OSError, ValueError):
+        pass
+    stopped = 0
+    for pid_file in glob.glob(os.path.join(SCOUT_LOG_DIR, f"{glob.escape(run_id)}-*.scout_pid")):
+        stopped += terminate_scout(pid_file)
+    return stopped
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    arg_parser = argparse.ArgumentParser(description="Scan many accounts in parallel and ingest the reports.")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    scan = commands.add_parser("scan", help="scan the accounts of a file ('account[,profile[,region]]' per line)")
+    scan.add_argument("accounts_file", help="file of accounts, '-' for stdin")
+    scan.add_argument("--concurrency", type=int, default=None)
+    scan.add_argument("--max-attempts", type=int, default=ORCHESTRATOR_MAX_ATTEMPTS)
+    scan.add_argument("--backoff", type=float, default=ORCHESTRATOR_BACKOFF_SECONDS)
+    scan.add_argument("--ingest-workers", type=int, default=ORCHESTRATOR_INGEST_WORKERS)
+    scan.add_argument("--batch-size", type=int, default=None)
+    scan.add_argument("--summary", help="also write the JSON summary to this file")
+    cancel = commands.add_parser("cancel", help="cancel a running orchestrator run")
+    cancel.add_argument("run_id")
+    args = arg_parser.parse_args(argv)
+
+    if args.command == "cancel":
+        print(f"Stopped {cancel_run(args.run_id)} scout processes")
+        return 0
+
+    with (sys.stdin if args.accounts_file == "-" else open(args.accounts_file)) as f:
+        targets = parse_targets(f.readlines())
+    orchestrator = ScanOrchestrator(targets, concurrency=args.concurrency, max_attempts=args.max_attempts,
+                                    backoff_seconds=args.backoff, ingest_workers=args.ingest_workers,
+                                    batch_size=args.batch_size)
+
+    pid_file = os.path.join(SCOUT_LOG_DIR, f"{orchestrator.run_id}.orchestrator_pid")
+    with open(pid_file, "w") as f:
+        f.write(str(os.getpid()))
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: threading.Thread(target=orchestrator.cancel, daemon=True).start())
+    print(f"Run ID: {orchestrator.run_id} (cancel with: python orchestrator.py cancel {orchestrator.run_id})")
+    try:
+        summary = orchestrator.run()
+    finally:
+        os.remove(pid_file)
+
+    output = json.dumps(summary, indent=2, default=str)
+    if args.summary:
+        with open(args.summary, "w") as f:
+            f.write(output)
+    print(output)
+    return 0 if summary["statuses"].get(COMPLETED, 0) == len(targets) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,21 +1,88 @@
 # parser.py
+import gzip
 import json
 import os
+import re
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+# Resource containers split out of the report by default, in the same
+# "services.<service>.<...>" notation as ScoutSuite's provider metadata.json,
+# where an "id" segment matches any key.
+DEFAULT_RESOURCE_PATHS = [
+    "services.s3.buckets",
+    "services.iam.users",
+    "services.ec2.regions.id.vpcs.id.instances",
+    "services.ec2.regions.id.vpcs.id.security_groups",
+]
+
+# Size of each read from the results file while streaming
+STREAM_CHUNK_SIZE = int(os.getenv("PARSER_STREAM_CHUNK_SIZE", str(64 * 1024)))
+
+# Archived reports are new2.js.gz or new2.js.zst next to where new2.js was
+REPORT_COMPRESSION_SUFFIXES = {".gz": "gzip", ".zst": "zstd"}
+
+try:
+    import zstandard
+except ImportError:  # optional; only needed for zstd-compressed reports
+    zstandard = None
+
+_WHITESPACE = " \t\n\r"
+_STRUCTURAL_RE = re.compile(r'["{}\[\]]')
+_STRING_END_RE = re.compile(r'(?:[^"\\]|\\.)*"', re.DOTALL)
+
+
+class ResourceEvent(NamedTuple):
+    """One resource yielded while walking a Scout Suite report."""
+    service: str
+    resource_path: Tuple[str, ...]
+    resource: Any
+
+
+def resolve_report_path(file_path: str) -> str:
+    """
+    Returns `file_path` if it exists, else its compressed archive
+    (file_path + '.gz' / '.zst'). Raises FileNotFoundError if neither does.
+    """
+    if os.path.isfile(file_path):
+        return file_path
+    for suffix in REPORT_COMPRESSION_SUFFIXES:
+        if os.path.isfile(file_path + suffix):
+            return file_path + suffix
+    raise FileNotFoundError(f"File not found: {file_path}")
+
+
+def report_compression(file_path: str) -> Optional[str]:
+    """'gzip' / 'zstd' for an archived report, None for a plain one."""
+    return REPORT_COMPRESSION_SUFFIXES.get(os.path.splitext(file_path)[1])
+
+
+def open_report(file_path: str, mode: str = "rt"):
+    """
+    Opens a report file for reading, decompressing archived ones on the fly
+    (a stream, not a full in-memory copy). `mode` is "rt" or "rb".
+    """
+    compression = report_compression(file_path)
+    encoding = "utf-8" if "t" in mode else None
+    if compression == "gzip":
+        return gzip.open(file_path, mode, encoding=encoding)
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError(f"{file_path} is zstd-compressed but the 'zstandard' package is not installed")
+        return zstandard.open(file_path, mode, encoding=encoding)
+    return open(file_path, mode, encoding=encoding)
 
-import json
-import os
 
 def parse_scoutsuite_file(file_path: str) -> dict:
     """
     Reads a 'new2.js' file containing
       scoutsuite_results = { "account_id": "...", ... };
-    and returns a Python dict with the JSON data.
+    and returns a Python dict with the JSON data. Archived reports
+    (new2.js.gz / new2.js.zst) are decompressed transparently.
     """
 
-    if not os.path.isfile(file_path):
-        raise FileNotFoundError(f"File not found: {file_path}")
-
-    with open(file_path, "r", encoding="utf-8") as f:
+    file_path = resolve_report_path(file_path)
+    with open_report(file_path) as f:
         content = f.read()
 
     # 1) Remove the variable assignment (assumes "scoutsuite_results =")
@@ -35,3 +102,325 @@ def parse_scoutsuite_file(file_path: str) -> dict:
 
     # 4) Parse it as JSON
     return json.loads(content)
+
+
+# -------------------------------------------------------------------
+# Resource path patterns
+# -------------------------------------------------------------------
+def compile_resource_paths(resource_paths: Iterable[str]) -> List[Tuple[str, ...]]:
+    """
+    Turns metadata-style paths ("services.ec2.regions.id.vpcs.id.instances")
+    into key tuples relative to 'services'.
+    """
+    patterns = []
+    for path in resource_paths:
+        parts = tuple(path.split("."))
+        if parts and parts[0] == "services":
+            parts = parts[1:]
+        if parts and parts not in patterns:
+            patterns.append(parts)
+    return patterns
+
+
+def _segment_matches(pattern_part: str, key: str) -> bool:
+    return pattern_part == "id" or pattern_part == key
+
+
+def match_resource_pattern(resource_path: Tuple[str, ...],
+                           patterns: List[Tuple[str, ...]]) -> Optional[Tuple[str, ...]]:
+    """
+    Returns the pattern under which `resource_path` (container path + resource key)
+    was emitted, or None if it doesn't belong to any of them.
+    """
+    container = resource_path[:-1]
+    for pattern in patterns:
+        if len(pattern) == len(container) and all(
+                _segment_matches(p, k) for p, k in zip(pattern, container)):
+            return pattern
+    return None
+
+
+def _classify(path: Tuple[str, ...], patterns: List[Tuple[str, ...]]) -> Tuple[bool, bool]:
+    """
+    Returns (is_container, has_descendants) for a path:
+    whether its children are resources, and whether deeper patterns go through it.
+    """
+    is_container = has_descendants = False
+    for pattern in patterns:
+        if len(pattern) < len(path):
+            continue
+        if all(_segment_matches(p, k) for p, k in zip(pattern, path)):
+            if len(pattern) == len(path):
+                is_container = True
+            else:
+                has_descendants = True
+    return is_container, has_descendants
+
+
+def iter_resources(data: Dict[str, Any],
+                   resource_paths: Optional[Iterable[str]] = None,
+                   _patterns: Optional[List[Tuple[str, ...]]] = None,
+                   _path: Tuple[str, ...] = ()) -> Iterator[ResourceEvent]:
+    """
+    Yields a ResourceEvent for every resource of an already parsed report
+    (or of the sub-tree of 'services' found at `_path`).
+    """
+    patterns = _patterns if _patterns is not None else compile_resource_paths(
+        resource_paths or DEFAULT_RESOURCE_PATHS)
+    node = data.get("services", {}) if not _path else data
+    if not isinstance(node, dict):
+        return
+
+    for key, value in node.items():
+        path = _path + (key,)
+        is_container, has_descendants = _classify(path, patterns)
+        if is_container and isinstance(value, dict):
+            for resource_id, resource in value.items():
+                yield ResourceEvent(path[0], path + (resource_id,), resource)
+        if has_descendants and isinstance(value, dict):
+            yield from iter_resources(value, _patterns=patterns, _path=path)
+
+
+# -------------------------------------------------------------------
+# Streaming parser
+# -------------------------------------------------------------------
+class ScoutSuiteStreamParser:
+    """
+    Incrementally parses a 'new2.js' file and yields a ResourceEvent per resource,
+    without ever holding the whole document in memory.
+
+    Every top-level key other than 'services' (account_id, last_run, metadata,
+    sg_map, ...) is decoded into `header` as it is read. Only resources are
+    materialized under 'services'; everything else there is skipped.
+
+    `resource_paths` may also be a callable taking the header read so far;
+    it is resolved when 'services' is reached, so the paths can depend on
+    the report's provider or embedded metadata.
+
+    `fp` reads from an already open text stream (e.g. a report being
+    uploaded) instead of opening `file_path`, which then only names it in errors.
+    """
+
+    def __init__(self, file_path: str,
+                 resource_paths: Union[Iterable[str], Callable[[Dict[str, Any]], Iterable[str]], None] = None,
+                 chunk_size: int = STREAM_CHUNK_SIZE, fp=None):
+        self.file_path = resolve_report_path(file_path) if fp is None else file_path
+        self._source = fp
+        self._resource_paths = resource_paths
+        self.patterns: List[Tuple[str, ...]] = []
+        if not callable(resource_paths):
+            self.patterns = compile_resource_paths(resource_paths or DEFAULT_RESOURCE_PATHS)
+        self.header: Dict[str, Any] = {}
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._fp = None
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._carry = ""
+
+    @property
+    def account_id(self) -> Optional[str]:
+        return self.header.get("account_id")
+
+    def __iter__(self) -> Iterator[ResourceEvent]:
+        with self._reading():
+            yield from self._parse_document()
+
+    def iter_sections(self) -> Iterator[Tuple[str, Any]]:
+        """
+        Yields (key, value) for every top-level entry, with 'services' split
+        into one ("services.<service>", section) per service, so at most one
+        service section is held in memory at a time. Entries other than
+        'services' also land in `header`, as with iteration.
+        """
+        with self._reading():
+            for key in self._document_keys():
+                if key == "services" and self._peek() == "{":
+                    for service in self._iter_object():
+                        yield f"services.{service}", self._decode_value()
+                else:
+                    self.header[key] = self._decode_value()
+                    yield key, self.header[key]
+
+    @contextmanager
+    def _reading(self):
+        with (nullcontext(self._source) if self._source is not None else open_report(self.file_path)) as fp:
+            self._fp = fp
+            self._buf, self._pos, self._eof, self._carry = "", 0, False, ""
+            try:
+                yield
+            finally:
+                self._fp = None
+                self._buf = ""
+
+    # -- buffer management --------------------------------------------
+    def _fill(self, size: Optional[int] = None) -> bool:
+        """Appends the next chunk to the buffer; returns False at EOF."""
+        if self._eof:
+            return False
+        data = self._fp.read(size or self._chunk_size)
+        if not data:
+            self._eof = True
+            data, self._carry = self._carry, ""
+            if not data:
+                return False
+        else:
+            # Same trailing comma fixes as parse_scoutsuite_file, on the held
+            # back characters too, so a match split across two chunks is
+            # fixed; then hold back the last few for the next chunk.
+            data = (self._carry + data).replace("},\n}", "}\n}").replace("},}", "}}")
+            data, self._carry = data[:-3], data[-3:]
+        self._buf = self._buf[self._pos:] + data
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        """Returns the next non-whitespace character without consuming it."""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, chars: str) -> str:
+        char = self._peek()
+        if not char or char not in chars:
+            raise ValueError(f"Expected one of {chars!r} but found {char!r} "
+                             f"while parsing {self.file_path}")
+        self._pos += 1
+        return char
+
+    def _decode_value(self) -> Any:
+        """Decodes the next complete JSON value, reading more input as needed."""
+        self._peek()
+        read_size = self._chunk_size
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+                # A number (or literal) ending exactly at the buffer edge may be cut short
+                if end < len(self._buf) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            # Grow reads geometrically so large values don't get re-decoded too often
+            self._fill(read_size)
+            read_size *= 2
+
+    def _skip_value(self) -> None:
+        """Skips over the next JSON value without building it."""
+        char = self._peek()
+        if char not in "{[\"":
+            self._decode_value()
+            return
+        depth = 0
+        while True:
+            match = _STRUCTURAL_RE.search(self._buf, self._pos)
+            if match is None:
+                self._pos = len(self._buf)
+                if not self._fill():
+                    raise ValueError(f"Unexpected end of file while parsing {self.file_path}")
+                continue
+            char = match.group()
+            self._pos = match.end()
+            if char == '"':
+                self._skip_string_tail()
+            elif char in "{[":
+                # Containers that fit in the buffer go through the C decoder in one call
+                try:
+                    _, end = self._decoder.raw_decode(self._buf, match.start())
+                except json.JSONDecodeError:
+                    end = len(self._buf)
+                if end < len(self._buf):
+                    self._pos = end
+                    if depth == 0:
+                        return
+                    continue
+                depth += 1
+            else:
+                depth -= 1
+            if depth == 0:
+                return
+
+    def _skip_string_tail(self) -> None:
+        start = self._pos
+        while True:
+            match = _STRING_END_RE.match(self._buf, start)
+            if match is not None:
+                self._pos = match.end()
+                return
+            offset = start - self._pos
+            if not self._fill():
+                raise ValueError(f"Unterminated string while parsing {self.file_path}")
+            start = self._pos + offset
+
+    def _iter_object(self) -> Iterator[str]:
+        """Yields keys of the object at the cursor; the caller consumes each value."""
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self._decode_value()
+            self._expect(":")
+            yield key
+            if self._expect(",}") == "}":
+                return
+            if self._peek() == "}":  # tolerate a trailing comma
+                self._pos += 1
+                return
+
+    # -- document walk -------------------------------------------------
+    def _document_keys(self) -> Iterator[str]:
+        """Yields the top-level keys; the caller consumes each value."""
+        # Strip the "scoutsuite_results =" assignment, if any
+        if self._peek() not in "{[":
+            while True:
+                index = self._buf.find("=", self._pos)
+                if index != -1:
+                    self._pos = index + 1
+                    break
+                self._pos = len(self._buf)
+                if not self._fill():
+                    raise ValueError(f"No JSON document found in {self.file_path}")
+        yield from self._iter_object()
+        # Anything after the document (typically ';') is ignored
+
+    def _parse_document(self) -> Iterator[ResourceEvent]:
+        for key in self._document_keys():
+            if key == "services" and self._peek() == "{":
+                if callable(self._resource_paths):
+                    self.patterns = compile_resource_paths(self._resource_paths(self.header))
+                yield from self._walk(())
+            else:
+                self.header[key] = self._decode_value()
+
+    def _walk(self, path: Tuple[str, ...]) -> Iterator[ResourceEvent]:
+        for key in self._iter_object():
+            child = path + (key,)
+            is_container, has_descendants = _classify(child, self.patterns)
+            if self._peek() != "{" or not (is_container or has_descendants):
+                self._skip_value()
+            elif is_container:
+                for resource_id in self._iter_object():
+                    resource_path = child + (resource_id,)
+                    resource = self._decode_value()
+                    yield ResourceEvent(child[0], resource_path, resource)
+                    if has_descendants and isinstance(resource, dict):
+                        yield from iter_resources(resource, _patterns=self.patterns,
+                                                  _path=resource_path)
+            else:
+                yield from self._walk(child)
+
+
+def iter_scoutsuite_resources(file_path: str,
+                              resource_paths: Optional[Iterable[str]] = None) -> Iterator[ResourceEvent]:
+    """
+    Streams (service, resource_path, resource) events out of a 'new2.js' file.
+    Use ScoutSuiteStreamParser directly to also get at the report header (account_id, ...).
+    """
+    return iter(ScoutSuiteStreamParser(file_path, resource_paths))
@@ -0,0 +1,268 @@
+# queries.py
+import os
+import re
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, Generator, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from pymongo.errors import ExecutionTimeout
+from mongo_connect import db
+from bulk_writer import RESOURCE_REMOVAL_MODE
+from refactor import resource_id_field
+from history import find_resources_as_of
+from master_store import decode_chunk, resolve_master_path, walk_path
+from resource_index import RESOURCE_NAMES_COLLECTION
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Page size when a request passes after= without limit=
+RESOURCE_PAGE_SIZE = int(os.getenv("RESOURCE_PAGE_SIZE", "100"))
+# Largest limit= accepted
+RESOURCE_MAX_PAGE_SIZE = int(os.getenv("RESOURCE_MAX_PAGE_SIZE", "1000"))
+# Documents fetched per round trip while streaming an unpaged listing
+RESOURCE_STREAM_BATCH_SIZE = int(os.getenv("RESOURCE_STREAM_BATCH_SIZE", "500"))
+
+# Fields the list endpoints can filter on; each has an (account_id, field, resource ID)
+# index (migrations.py), so filtered pages are still index-ordered
+RESOURCE_FILTER_FIELDS = {
+    "ec2_instances": ("region", "vpc_id", "instance_id"),
+    "s3_buckets": ("region", "name"),
+    "iam_users": ("name",),
+}
+
+# Server-side time limit (maxTimeMS) of every query run through run_query, sync or async
+MONGO_QUERY_TIMEOUT_MS = int(os.getenv("MONGO_QUERY_TIMEOUT_MS", "5000"))
+
+# Most candidates reported for an ambiguous resource name
+RESOURCE_LOOKUP_MAX_MATCHES = int(os.getenv("RESOURCE_LOOKUP_MAX_MATCHES", "50"))
+
+# Query parameters that are not filters
+LIST_PARAMS = ("account_id", "after", "limit", "fields", "as_of", "format")
+
+_FIELD_RE = re.compile(r"^[A-Za-z0-9_\-]+(\.[A-Za-z0-9_\-]+)*$")
+
+
+class QueryError(ValueError):
+    """A malformed list request (bad limit, unknown filter, ...), reported as a 400."""
+
+
+class QueryTimeout(Exception):
+    """A query ran past MONGO_QUERY_TIMEOUT_MS (or waited too long for a connection slot)."""
+
+
+class FindSpec(NamedTuple):
+    """
+    One find() to run. Query functions below are generators that yield
+    FindSpecs and receive their results, so the same function runs on
+    pymongo (run_query) and on motor (async_db.async_mongo.run_query).
+    """
+    collection: str
+    filter: Dict[str, Any]
+    projection: Optional[Dict[str, Any]] = None
+    sort: Optional[List[Tuple[str, int]]] = None
+    limit: int = 0
+    one: bool = False
+
+
+# A query function: yields FindSpecs, gets back a list of documents (or one
+# document / None when `one` is set), and returns its result
+Query = Generator[FindSpec, Any, Any]
+
+
+def run_find(spec: FindSpec) -> Any:
+    """Runs one FindSpec on the shared pymongo connection."""
+    cursor = db[spec.collection].find(spec.filter, spec.projection).max_time_ms(MONGO_QUERY_TIMEOUT_MS)
+    if spec.sort:
+        cursor = cursor.sort(spec.sort)
+    if spec.one:
+        return next(cursor.limit(1), None)
+    if spec.limit:
+        cursor = cursor.limit(spec.limit)
+    return list(cursor)
+
+
+def run_query(query: Query) -> Any:
+    """Drives a query function to completion with blocking pymongo calls."""
+    try:
+        spec = next(query)
+        while True:
+            spec = query.send(run_find(spec))
+    except StopIteration as done:
+        return done.value
+    except ExecutionTimeout as e:
+        raise QueryTimeout(str(e))
+
+
+class ResourcePage(NamedTuple):
+    """One page of a keyset-paginated listing; pass next_after as after= for the next one."""
+    items: List[Dict[str, Any]]
+    next_after: Optional[str]
+
+
+def parse_limit(value: Optional[str]) -> int:
+    if value is None or value == "":
+        return RESOURCE_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise QueryError(f"Invalid limit: {value!r}")
+    if limit < 1:
+        raise QueryError("limit must be at least 1")
+    return min(limit, RESOURCE_MAX_PAGE_SIZE)
+
+
+def parse_fields(value: Optional[str]) -> Optional[List[str]]:
+    """'instance_id,state,tags.Name' -> ['instance_id', 'state', 'tags.Name']; None means all fields."""
+    if not value:
+        return None
+    fields = [field.strip() for field in value.split(",") if field.strip()]
+    for field in fields:
+        if not _FIELD_RE.match(field):
+            raise QueryError(f"Invalid field name: {field!r}")
+    return fields or None
+
+
+def build_resource_filter(collection: str, account_id: str, args: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Turns the filter query parameters (e.g. ?region=us-east-1) into a query.
+    Only indexed fields are accepted, so a filter never causes a collection scan.
+    """
+    allowed = RESOURCE_FILTER_FIELDS.get(collection, ())
+    filter: Dict[str, Any] = {"account_id": account_id}
+    for name, value in args.items():
+        if name in LIST_PARAMS:
+            continue
+        if name not in allowed:
+            raise QueryError(f"Cannot filter on '{name}'; filterable fields: {', '.join(allowed) or 'none'}")
+        filter[name] = value
+    return filter
+
+
+def live_filter(filter: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    `filter` restricted to resources in the latest scan: with
+    RESOURCE_REMOVAL_MODE=mark, those missing from it stay stored, flagged removed.
+    """
+    if RESOURCE_REMOVAL_MODE == "mark":
+        return {**filter, "removed": {"$ne": True}}
+    return filter
+
+
+def _projection(collection: str, fields: Optional[Iterable[str]]) -> Dict[str, Any]:
+    if not fields:
+        return {"_id": False, "content_hash": False}
+    projection = {field: True for field in fields}
+    # The sort key is always returned, it is the cursor for the next page
+    projection[resource_id_field(collection)] = True
+    projection["_id"] = False
+    return projection
+
+
+# -------------------------------------------------------------------
+# Query functions (shared by the Flask app and the FastAPI service)
+# -------------------------------------------------------------------
+def resource_page_query(collection: str, filter: Dict[str, Any], after: Optional[str] = None,
+                        limit: int = RESOURCE_PAGE_SIZE, fields: Optional[List[str]] = None) -> Query:
+    """
+    Up to `limit` resources sorted by resource ID, starting after `after`.
+    Uses the (account_id, ..., resource ID) index, so every page costs the same
+    however deep into the listing it is.
+    """
+    id_field = resource_id_field(collection)
+    query = dict(live_filter(filter))
+    if after is not None:
+        # Keeps an equality filter on the resource ID itself (?instance_id=...)
+        query[id_field] = {"$gt": after, **({"$eq": query[id_field]} if id_field in query else {})}
+    items = yield FindSpec(collection, query, _projection(collection, fields), sort=[(id_field, 1)],
+                           limit=limit + 1)
+    return _make_page(collection, items, limit)
+
+
+def resource_lookup_query(account_id: str, name: str, collection: Optional[str] = None) -> Query:
+    """
+    Finds resources known as `name` (key, name, ID or ARN) through the
+    'resource_names' index. Returns {"matches": [...], "resource": doc},
+    with the resource document only when exactly one resource matched.
+    """
+    filter: Dict[str, Any] = {"account_id": account_id, "terms": name}
+    if collection:
+        filter["collection"] = collection
+    matches = yield FindSpec(RESOURCE_NAMES_COLLECTION, filter,
+                             {"_id": False, "path": True, "service": True, "collection": True, "filter": True},
+                             limit=RESOURCE_LOOKUP_MAX_MATCHES)
+    resource = None
+    if len(matches) == 1:
+        resource = yield FindSpec(matches[0]["collection"], live_filter(matches[0]["filter"]),
+                                  {"_id": False, "content_hash": False}, one=True)
+    return {"matches": matches, "resource": resource}
+
+
+def ec2_instances_query(account_id: str) -> Query:
+    """Every EC2 instance of the account, as {"instance_id": ..., "metadata": {...}}."""
+    docs = yield FindSpec("ec2_instances", live_filter({"account_id": account_id}),
+                          {"_id": False, "content_hash": False}, sort=[("instance_id", 1)])
+    return [{"instance_id": doc["instance_id"], "metadata": doc} for doc in docs]
+
+
+def master_section_query(account_id: str, path: str) -> Query:
+    """One part of the account's raw report (see master_store.load_master_section)."""
+    master_doc = yield FindSpec("master", {"account_id": account_id}, {"_id": False}, one=True)
+    if not master_doc:
+        return None
+    chunk_key, parts, value = resolve_master_path(master_doc, path)
+    if chunk_key is None:
+        return value
+    chunks = yield FindSpec("master_chunks",
+                            {"account_id": account_id, "generation": master_doc["generation"], "key": chunk_key},
+                            {"_id": False, "data": True}, sort=[("part", 1)])
+    return walk_path(decode_chunk(chunks), parts)
+
+
+def _make_page(collection: str, items: List[Dict[str, Any]], limit: int) -> ResourcePage:
+    # One extra document tells whether there is a next page without a count
+    next_after = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_after = items[-1].get(resource_id_field(collection))
+    return ResourcePage(items, next_after)
+
+
+def find_resource_page(collection: str, filter: Dict[str, Any], after: Optional[str] = None,
+                       limit: int = RESOURCE_PAGE_SIZE, fields: Optional[List[str]] = None,
+                       as_of: Optional[datetime] = None) -> ResourcePage:
+    """resource_page_query on the live collection, or the same page as of `as_of`."""
+    if as_of is not None:
+        items = list(find_resources_as_of(collection, filter, as_of, limit=limit + 1,
+                                          sort_field=resource_id_field(collection), after=after, fields=fields))
+        return _make_page(collection, items, limit)
+    return run_query(resource_page_query(collection, filter, after, limit, fields))
+
+
+def iter_resource_docs(collection: str, filter: Dict[str, Any], fields: Optional[List[str]] = None,
+                       as_of: Optional[datetime] = None) -> Iterator[Dict[str, Any]]:
+    """Yields every matching resource, fetching RESOURCE_STREAM_BATCH_SIZE documents at a time."""
+    id_field = resource_id_field(collection)
+    if as_of is not None:
+        yield from find_resources_as_of(collection, filter, as_of, sort_field=id_field, fields=fields)
+        return
+    cursor = db[collection].find(live_filter(filter), _projection(collection, fields)).sort(id_field, 1)
+    yield from cursor.batch_size(RESOURCE_STREAM_BATCH_SIZE)
+
+
+def iter_ndjson(docs: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """One JSON document per line."""
+    for doc in docs:
+        yield json.dumps(doc, default=str) + "\n"
+
+
+def iter_json_array(docs: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """A JSON array, written one element at a time."""
+    yield "["
+    first = True
+    for doc in docs:
+        yield ("" if first else ",") + json.dumps(doc, default=str)
+        first = False
+    yield "]\n"
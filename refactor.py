@@ -1,116 +1,243 @@
 # refactor.py
-from typing import Dict, Any
+import json
+import os
+import logging
+from functools import lru_cache
+from typing import Callable, Dict, Any, List, Optional, Set, Tuple
+from pymongo.errors import OperationFailure
 from mongo_connect import db
+from bulk_writer import ChangeDetectingWriter
+from resource_index import ResourceNameIndexer
+from parser import (DEFAULT_RESOURCE_PATHS, ResourceEvent, compile_resource_paths, iter_resources,
+                    match_resource_pattern)
 
-def store_master_doc(data: Dict[str, Any], account_id: str) -> None:
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Provider metadata.json files of the bundled Scout Suite checkout, used when
+# the scoutsuite package itself isn't importable
+BUNDLED_PROVIDERS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "ScoutSuite", "ScoutSuite", "providers")
+
+# Collections that predate the generic engine keep their own ID field
+RESOURCE_ID_FIELDS = {
+    "ec2_instances": "instance_id",
+    "ec2_security_groups": "sg_id",
+}
+
+# Context field stored for an "id" segment, keyed by the segment before it.
+# Anything else becomes "<singular>_id" (vpcs -> vpc_id, projects -> project_id).
+CONTEXT_FIELDS = {
+    "regions": "region",
+}
+
+# Collections whose indexes were already created by this process
+_indexed_collections: Set[str] = set()
+
+# -------------------------------------------------------------------
+# Resource paths and collection layout
+# -------------------------------------------------------------------
+def _providers_dir() -> str:
+    try:
+        import ScoutSuite.providers
+        return os.path.dirname(ScoutSuite.providers.__file__)
+    except ImportError:
+        return BUNDLED_PROVIDERS_DIR
+
+
+def _metadata_resource_paths(metadata: Dict[str, Any]) -> List[str]:
+    """Lists every resource 'path' of a provider metadata dict."""
+    paths = []
+    for services in metadata.values():
+        for service in services.values():
+            for resource in service.get("resources", {}).values():
+                if resource.get("path"):
+                    paths.append(resource["path"])
+    return paths
+
+
+@lru_cache(maxsize=None)
+def load_provider_resource_paths(provider_code: str) -> Tuple[str, ...]:
+    """
+    Returns the resource paths listed in Scout Suite's metadata.json
+    for the given provider, or an empty tuple if it isn't known.
+    """
+    metadata_path = os.path.join(_providers_dir(), provider_code, "metadata.json")
+    if not os.path.isfile(metadata_path):
+        return ()
+    with open(metadata_path, "r", encoding="utf-8") as f:
+        return tuple(_metadata_resource_paths(json.load(f)))
+
+
+def resource_paths_for(header: Dict[str, Any]) -> List[str]:
+    """
+    Picks the resource paths for a report: the provider's metadata.json,
+    else the metadata embedded in the report, else the defaults.
+    """
+    paths = list(load_provider_resource_paths(header.get("provider_code") or "aws"))
+    if not paths and isinstance(header.get("metadata"), dict):
+        paths = _metadata_resource_paths(header["metadata"])
+    return paths or list(DEFAULT_RESOURCE_PATHS)
+
+
+def collection_name(pattern: Tuple[str, ...]) -> str:
+    """services.ec2.regions.id.vpcs.id.instances -> 'ec2_instances'"""
+    return f"{pattern[0]}_{pattern[-1]}"
+
+
+def resource_id_field(collection: str) -> str:
+    return RESOURCE_ID_FIELDS.get(collection, "id")
+
+
+def context_fields(pattern: Tuple[str, ...]) -> List[Tuple[int, str]]:
+    """
+    Returns (position, field name) for every "id" segment of a pattern,
+    e.g. [(2, 'region'), (4, 'vpc_id')] for ec2.regions.id.vpcs.id.instances.
     """
-    Stores the raw data in a 'master' collection.
-    Overwrites or upserts as needed.
+    fields = []
+    for index, segment in enumerate(pattern):
+        if segment == "id" and index > 0:
+            parent = pattern[index - 1]
+            fields.append((index, CONTEXT_FIELDS.get(parent, f"{parent.rstrip('s')}_id")))
+    return fields
+
+
+def removal_scope(header: Dict[str, Any],
+                  patterns: List[Tuple[str, ...]]) -> Optional[Callable[[str], Optional[Dict[str, Any]]]]:
+    """
+    The part of the account a report covers, for ChangeDetectingWriter:
+    a scan limited to some services or regions (last_run.run_parameters,
+    as `scout --services/--skip/--regions/--exclude-regions` record them)
+    only says which resources are gone from those. Returns None for a
+    full scan, else a function giving the filter on a collection's stored
+    resources the report covers, None when it covers none of them.
+    """
+    last_run = header.get("last_run")
+    parameters = last_run.get("run_parameters") if isinstance(last_run, dict) else None
+    if not isinstance(parameters, dict):
+        return None
+    services, skipped = set(parameters.get("services") or ()), set(parameters.get("skipped_services") or ())
+    regions, excluded = list(parameters.get("regions") or ()), list(parameters.get("excluded_regions") or ())
+    if not (services or skipped or regions or excluded):
+        return None
+
+    region_filter: Dict[str, Any] = {}
+    if regions:
+        region_filter["$in"] = regions
+    if excluded:
+        region_filter["$nin"] = excluded
+    layout = {collection_name(pattern): pattern for pattern in patterns}
+
+    def scope(collection: str) -> Optional[Dict[str, Any]]:
+        pattern = layout.get(collection)
+        if pattern is None:
+            return {}
+        if (services and pattern[0] not in services) or pattern[0] in skipped:
+            return None
+        if not region_filter:
+            return {}
+        if "regions" in pattern[:-1]:
+            return {CONTEXT_FIELDS["regions"]: region_filter}
+        if pattern[-1] == "regions":
+            # The regions themselves (e.g. cloudtrail_regions), keyed by name
+            return {resource_id_field(collection): region_filter}
+        return {}
+
+    return scope
+
+
+def ensure_resource_indexes(patterns: List[Tuple[str, ...]]) -> None:
+    """
+    Creates the indexes of every resource collection: a unique key on
+    account + context + resource ID, and one per context field.
+    create_index is idempotent; this only avoids re-sending it per ingest.
+    """
+    for pattern in patterns:
+        name = collection_name(pattern)
+        if name in _indexed_collections:
+            continue
+        fields = [field for _, field in context_fields(pattern)]
+        try:
+            db[name].create_index(
+                [("account_id", 1)] + [(field, 1) for field in fields] + [(resource_id_field(name), 1)],
+                unique=True
+            )
+            for field in fields:
+                db[name].create_index([("account_id", 1), (field, 1)])
+        except OperationFailure as e:
+            logger.error(f"Failed to create indexes for '{name}': {str(e)}")
+            continue
+        _indexed_collections.add(name)
+
+
+# -------------------------------------------------------------------
+# Resource storage
+# -------------------------------------------------------------------
+def _store_resource(writer: ChangeDetectingWriter, account_id: str, event: ResourceEvent,
+                    patterns: List[Tuple[str, ...]], names: Optional[ResourceNameIndexer] = None) -> None:
     """
-    # Use 'master' collection or a name of your choice
-    master_collection = db["master"]
-
-    # Upsert one doc per (account_id).
-    # The raw data can be large, but usually fits in a single doc if not extremely huge.
-    master_collection.find_one_and_update(
-        {"account_id": account_id},
-        {"$set": {"account_id": account_id, "raw_data": data}},
-        upsert=True
-    )
-
-def refactor_and_store_resources(data: Dict[str, Any]) -> None:
+    Queues an upsert of one resource into the collection of its resource type,
+    flattened with its region/vpc (or other) context fields, and of its
+    entry in the resource name index.
+    """
+    resource = event.resource
+    pattern = match_resource_pattern(event.resource_path, patterns)
+    if pattern is None or not isinstance(resource, dict):
+        return
+
+    name = collection_name(pattern)
+    id_field = resource_id_field(name)
+    context = {field: event.resource_path[index] for index, field in context_fields(pattern)}
+
+    # Nested resource types (cloudtrail regions -> trails) get their own
+    # collection, so don't store them a second time inside their parent.
+    nested = {p[len(pattern) + 1] for p in patterns
+              if len(p) == len(pattern) + 2 and p[:len(pattern) + 1] == pattern + ("id",)}
+
+    doc = {key: value for key, value in resource.items() if key not in nested}
+    doc.update(context)
+    doc["account_id"] = account_id
+    doc[id_field] = event.resource_path[-1]
+
+    filter = {"account_id": account_id, **context, id_field: event.resource_path[-1]}
+    writer.upsert(name, filter, doc)
+    if names is not None:
+        names.add(event, name, filter)
+
+def store_service_resources(writer: ChangeDetectingWriter, account_id: str, service: str, service_data: Any,
+                            patterns: List[Tuple[str, ...]], names: Optional[ResourceNameIndexer] = None) -> None:
+    """Queues the resources of one service section, for reports ingested one service at a time."""
+    for event in iter_resources({"services": {service: service_data}}, _patterns=patterns):
+        _store_resource(writer, account_id, event, patterns, names)
+
+def refactor_and_store_resources(data: Dict[str, Any], batch_size: Optional[int] = None,
+                                 history=None) -> Dict[str, Dict[str, int]]:
     """
     Refactors the big dictionary from Scout Suite and stores resources
     into separate collections based on service or scope (global, regional, VPC).
+    Every resource path of the provider's metadata.json gets its own collection;
+    writes go out in bulk batches of `batch_size`, one writer per collection,
+    spread over a worker pool. Resources whose content hash didn't change are
+    not rewritten, and those missing from the report are removed (only from
+    the services and regions it covers, see removal_scope).
+    Changes are also recorded in `history` (a history.ScanHistoryRecorder), if given.
+    Returns per-collection added/changed/removed/unchanged counts.
     """
     if "account_id" not in data:
         raise KeyError("No 'account_id' found in data")
     account_id = data["account_id"]
 
+    patterns = compile_resource_paths(resource_paths_for(data))
+    ensure_resource_indexes(patterns)
+
     # Typically, Scout Suite puts stuff under data["services"]
-    services = data.get("services", {})
-
-    # ----------------------------------------------------------------
-    # Example: store S3 buckets in a "s3_buckets" collection
-    # ----------------------------------------------------------------
-    s3_info = services.get("s3", {})
-    # Buckets are generally global (not region-specific in the same sense)
-    buckets = s3_info.get("buckets", {})
-    for b_id, b_data in buckets.items():
-        b_data["id"] = b_id
-        b_data["account_id"] = account_id
-        db["s3_buckets"].find_one_and_update(
-            {"account_id": account_id, "id": b_id},
-            {"$set": b_data},
-            upsert=True
-        )
-
-    # ----------------------------------------------------------------
-    # Example: store IAM resources (global)
-    # ----------------------------------------------------------------
-    iam_info = services.get("iam", {})
-    # Could be users, roles, policies, groups, etc.
-    # We'll do a quick example with "users".
-    users = iam_info.get("users", {})
-    for u_id, u_data in users.items():
-        u_data["id"] = u_id
-        u_data["account_id"] = account_id
-        db["iam_users"].find_one_and_update(
-            {"account_id": account_id, "id": u_id},
-            {"$set": u_data},
-            upsert=True
-        )
-
-    # ----------------------------------------------------------------
-    # Example: store "EC2" resources (region -> vpcs -> instances, security_groups, etc.)
-    # ----------------------------------------------------------------
-    ec2_info = services.get("ec2", {})
-    regions = ec2_info.get("regions", {})
-    for region_name, region_data in regions.items():
-        vpcs = region_data.get("vpcs", {})
-        for vpc_id, vpc_data in vpcs.items():
-            # 1) Instances
-            instances = vpc_data.get("instances", {})
-            for inst_id, inst_data in instances.items():
-                doc = {
-                    "account_id": account_id,
-                    "region": region_name,
-                    "vpc_id": vpc_id,
-                    "instance_id": inst_id,
-                    **inst_data
-                }
-                db["ec2_instances"].find_one_and_update(
-                    {"account_id": account_id, "instance_id": inst_id},
-                    {"$set": doc},
-                    upsert=True
-                )
-
-            # 2) Security Groups
-            sec_groups = vpc_data.get("security_groups", {})
-            for sg_id, sg_data in sec_groups.items():
-                doc = {
-                    "account_id": account_id,
-                    "region": region_name,
-                    "vpc_id": vpc_id,
-                    "sg_id": sg_id,
-                    **sg_data
-                }
-                db["ec2_security_groups"].find_one_and_update(
-                    {"account_id": account_id, "sg_id": sg_id},
-                    {"$set": doc},
-                    upsert=True
-                )
-
-    # ----------------------------------------------------------------
-    # ... repeat for RDS, ELB, CloudTrail, CloudWatch, Route53, etc. ...
-    #
-    # Each type might have a different shape, e.g. route53 is "hosted_zones" -> ...
-    # You can follow the same pattern:
-    #   1) gather the dict with resources
-    #   2) loop over each resource
-    #   3) upsert into a dedicated collection
-    #
-    # This modular approach ensures each resource type is easy to query later.
-    # ----------------------------------------------------------------
-
-    print(f"Refactoring & storing resources for account_id={account_id} completed.")
+    collections = [collection_name(pattern) for pattern in patterns]
+    with ChangeDetectingWriter(db, account_id, batch_size, collections=collections, history=history,
+                               scope=removal_scope(data, patterns)) as writer, \
+            ResourceNameIndexer(account_id, batch_size) as names:
+        for event in iter_resources(data, _patterns=patterns):
+            _store_resource(writer, account_id, event, patterns, names)
+
+    logger.info(f"Refactoring & storing resources for account_id={account_id} completed.")
+    return writer.stats
@@ -1,7 +1,19 @@
 import os
+import sys
+import gzip
+import shutil
+import socket
+import hashlib
 import logging
-from datetime import datetime
-from typing import Optional
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import DESCENDING
+from mongo_connect import db
+from history import parse_timestamp
+from parser import open_report, report_compression, resolve_report_path, zstandard
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -11,12 +23,83 @@ logger = logging.getLogger(__name__)
 BASE_REPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reports")
 SCOUT_REPORT_DIR = os.path.join(BASE_REPORT_DIR, "scout")
 TEMP_REPORT_DIR = os.path.join(BASE_REPORT_DIR, "temp")
+REPORT_FILE = os.path.join("scoutsuite-results", "new2.js")
+
+REPORT_CATALOG_COLLECTION = "report_catalog"
+_HASH_CHUNK_BYTES = 1024 * 1024
+
+# Archival of older reports: "gzip" or "zstd" (needs the zstandard package)
+REPORT_COMPRESSION = os.getenv("REPORT_COMPRESSION", "gzip").lower()
+REPORT_COMPRESSION_LEVEL = int(os.getenv("REPORT_COMPRESSION_LEVEL", "6"))
+# Newest reports of each account that stay uncompressed for fast access
+REPORT_KEEP_UNCOMPRESSED = int(os.getenv("REPORT_KEEP_UNCOMPRESSED", "3"))
+# Reports older than this are deleted (0 keeps them forever); the newest one of an account never is
+REPORT_RETENTION_DAYS = int(os.getenv("REPORT_RETENTION_DAYS", "0"))
+# How often the background archiver applies the policy (0 disables it)
+REPORT_ARCHIVE_INTERVAL_SECONDS = int(os.getenv("REPORT_ARCHIVE_INTERVAL_SECONDS", "3600"))
+# A process that died while compressing a report loses its claim after this long
+REPORT_ARCHIVE_CLAIM_SECONDS = int(os.getenv("REPORT_ARCHIVE_CLAIM_SECONDS", "1800"))
+
+_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+# Ingestion status of a catalogued report
+PENDING = "pending"
+INGESTED = "ingested"
+FAILED = "failed"
+
+
+def _content_sha256(path: str) -> Tuple[str, int]:
+    """sha256 and size of the report's (decompressed) content."""
+    digest = hashlib.sha256()
+    size = 0
+    with open_report(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def _open_compressed(path: str, compression: str):
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("REPORT_COMPRESSION=zstd needs the 'zstandard' package")
+        return zstandard.open(path, "wb", cctx=zstandard.ZstdCompressor(level=REPORT_COMPRESSION_LEVEL))
+    return gzip.open(path, "wb", compresslevel=REPORT_COMPRESSION_LEVEL)
+
+
+def _report_time(timestamp: str, mtime: float) -> datetime:
+    """When the report was taken: its directory name, else the file's mtime."""
+    try:
+        return parse_timestamp(timestamp)
+    except ValueError:
+        return datetime.fromtimestamp(mtime, timezone.utc)
+
+
+def _public(entry: Dict[str, Any]) -> Dict[str, Any]:
+    entry = {k: v.isoformat() if isinstance(v, datetime) else v
+             for k, v in entry.items() if k != "_id" and not k.startswith("archive_")}
+    entry["created_at"] = entry["report_time"]
+    return entry
+
 
 class ReportManager:
+    """
+    Keeps report files under reports/scout/<account>/<timestamp>/ and
+    catalogs each one in 'report_catalog' (path, size, content hash,
+    counts and ingestion status), so listing and "latest" lookups are
+    index queries instead of directory scans. reconcile() rebuilds the
+    catalog from disk. Older reports are compressed or pruned by
+    apply_retention(), in the background once start_archiver() is called.
+    """
+
     def __init__(self):
         # Create necessary directories
         os.makedirs(SCOUT_REPORT_DIR, exist_ok=True)
         os.makedirs(TEMP_REPORT_DIR, exist_ok=True)
+        self._archive_lock = threading.Lock()
+        self._archiver: Optional[threading.Thread] = None
+        self._archive_totals: Dict[str, Any] = {"compressed": 0, "bytes_in": 0, "bytes_out": 0, "seconds": 0.0,
+                                                "pruned": 0, "bytes_pruned": 0, "last_run": None}
 
     def get_report_path(self, account_name: str, timestamp: Optional[str] = None) -> str:
         """
@@ -54,39 +137,308 @@ class ReportManager:
         except Exception as e:
             logger.error(f"Error cleaning up temporary files: {str(e)}")
 
+    # ---------------------------------------------------------------
+    # Report catalog
+    # ---------------------------------------------------------------
+    def register_report(self, account_name: str, timestamp: str, path: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Catalogs (or refreshes) the report file of account_name/timestamp.
+        The ingestion status is reset to pending when the content changed.
+        """
+        if path is None:
+            path = resolve_report_path(os.path.join(SCOUT_REPORT_DIR, account_name, timestamp, REPORT_FILE))
+        stat = os.stat(path)
+        content_hash, raw_size = _content_sha256(path)
+        now = datetime.now(timezone.utc)
+
+        key = {"account_name": account_name, "timestamp": timestamp}
+        previous = db[REPORT_CATALOG_COLLECTION].find_one(key, {"content_hash": True})
+        fields = {
+            "path": path,
+            "size": stat.st_size,
+            "raw_size": raw_size,
+            "compression": report_compression(path),
+            "mtime": stat.st_mtime,
+            "content_hash": content_hash,
+            "report_time": _report_time(timestamp, stat.st_mtime),
+            "updated_at": now
+        }
+        if previous is None or previous.get("content_hash") != content_hash:
+            fields.update({"status": PENDING, "account_id": None, "scan_id": None, "resource_count": None,
+                           "finding_count": None, "error": None})
+        db[REPORT_CATALOG_COLLECTION].update_one(
+            key, {"$set": fields, "$setOnInsert": {"registered_at": now}}, upsert=True
+        )
+        logger.info(f"Catalogued report {account_name}/{timestamp} ({stat.st_size} bytes)")
+        return {**key, **fields}
+
+    def mark_ingested(self, account_name: str, timestamp: str, result: Dict[str, Any]) -> None:
+        """Records the outcome of ingest_report() on a catalogued report."""
+        db[REPORT_CATALOG_COLLECTION].update_one(
+            {"account_name": account_name, "timestamp": timestamp},
+            {"$set": {
+                "status": INGESTED,
+                "account_id": result["account_id"],
+                "scan_id": result["scan_id"],
+                "resource_count": sum(result.get("resource_counts", {}).values()),
+                "finding_count": result.get("findings", {}).get("total"),
+                "error": None,
+                "ingested_at": datetime.now(timezone.utc)
+            }}
+        )
+
+    def mark_failed(self, account_name: str, timestamp: str, error: str) -> None:
+        db[REPORT_CATALOG_COLLECTION].update_one(
+            {"account_name": account_name, "timestamp": timestamp},
+            {"$set": {"status": FAILED, "error": error}}
+        )
+
     def get_latest_report(self, account_name: str) -> Optional[str]:
         """Get the path to the latest report for an account"""
-        account_dir = os.path.join(SCOUT_REPORT_DIR, account_name)
-        if not os.path.exists(account_dir):
-            return None
+        for entry in db[REPORT_CATALOG_COLLECTION].find(
+                {"account_name": account_name}, {"path": True, "timestamp": True}
+        ).sort([("report_time", DESCENDING), ("timestamp", DESCENDING)]):
+            try:
+                # The archiver may have just compressed it
+                return resolve_report_path(entry["path"])
+            except FileNotFoundError:
+                pass
+            # Removed from disk behind our back
+            logger.warning(f"Dropping missing report {entry['path']} from the catalog")
+            db[REPORT_CATALOG_COLLECTION].delete_one({"_id": entry["_id"]})
+        return None
 
-        # Get all timestamp directories and sort them
-        timestamps = [d for d in os.listdir(account_dir) if os.path.isdir(os.path.join(account_dir, d))]
-        if not timestamps:
+    def list_account_reports(self, account_name: str, since: Optional[datetime] = None,
+                             until: Optional[datetime] = None, limit: int = 0) -> List[Dict[str, Any]]:
+        """
+        List reports of an account, newest first, optionally only those
+        taken in [since, until].
+        """
+        query: Dict[str, Any] = {"account_name": account_name}
+        if since or until:
+            query["report_time"] = {}
+            if since:
+                query["report_time"]["$gte"] = since
+            if until:
+                query["report_time"]["$lte"] = until
+        cursor = db[REPORT_CATALOG_COLLECTION].find(query).sort(
+            [("report_time", DESCENDING), ("timestamp", DESCENDING)]
+        )
+        if limit:
+            cursor = cursor.limit(limit)
+        return [_public(entry) for entry in cursor]
+
+    def reconcile(self, account_name: Optional[str] = None) -> Dict[str, int]:
+        """
+        Rebuilds the catalog from the report directories: catalogs reports
+        it doesn't know, re-hashes those whose size or mtime changed, and
+        drops entries whose file is gone. Returns what it did.
+        """
+        counts = {"added": 0, "updated": 0, "unchanged": 0, "removed": 0}
+        if account_name:
+            accounts = [account_name]
+        else:
+            accounts = sorted(
+                {d for d in os.listdir(SCOUT_REPORT_DIR) if os.path.isdir(os.path.join(SCOUT_REPORT_DIR, d))}
+                | set(db[REPORT_CATALOG_COLLECTION].distinct("account_name"))
+            )
+        for account in accounts:
+            known = {
+                entry["timestamp"]: entry
+                for entry in db[REPORT_CATALOG_COLLECTION].find(
+                    {"account_name": account}, {"timestamp": True, "path": True, "size": True, "mtime": True}
+                )
+            }
+            account_dir = os.path.join(SCOUT_REPORT_DIR, account)
+            on_disk = set()
+            if os.path.isdir(account_dir):
+                for timestamp in os.listdir(account_dir):
+                    try:
+                        path = resolve_report_path(os.path.join(account_dir, timestamp, REPORT_FILE))
+                    except FileNotFoundError:
+                        continue
+                    on_disk.add(timestamp)
+                    entry = known.get(timestamp)
+                    stat = os.stat(path)
+                    if (entry and entry.get("path") == path and entry.get("size") == stat.st_size
+                            and entry.get("mtime") == stat.st_mtime):
+                        counts["unchanged"] += 1
+                        continue
+                    self.register_report(account, timestamp, path)
+                    counts["updated" if entry else "added"] += 1
+
+            missing = [entry["_id"] for timestamp, entry in known.items() if timestamp not in on_disk]
+            if missing:
+                db[REPORT_CATALOG_COLLECTION].delete_many({"_id": {"$in": missing}})
+                counts["removed"] += len(missing)
+
+        logger.info(f"Reconciled report catalog: {counts}")
+        return counts
+
+    # ---------------------------------------------------------------
+    # Archival and retention
+    # ---------------------------------------------------------------
+    def compress_report(self, account_name: str, timestamp: str) -> Optional[Dict[str, Any]]:
+        """
+        Replaces an ingested report's new2.js with new2.js.gz/.zst and points
+        the catalog at it. Each report is claimed in the catalog first, so
+        several processes can archive at once. Returns bytes in/out and
+        seconds taken, or None if the report is not (or no longer) eligible.
+        """
+        now = datetime.now(timezone.utc)
+        owner = f"{socket.gethostname()}:{os.getpid()}"
+        entry = db[REPORT_CATALOG_COLLECTION].find_one_and_update(
+            {"account_name": account_name, "timestamp": timestamp, "compression": None,
+             "status": {"$ne": PENDING},
+             "$or": [{"archive_claim_until": None}, {"archive_claim_until": {"$lt": now}}]},
+            {"$set": {"archive_claimed_by": owner,
+                      "archive_claim_until": now + timedelta(seconds=REPORT_ARCHIVE_CLAIM_SECONDS)}},
+            projection={"path": True}
+        )
+        if entry is None:
             return None
 
-        latest_timestamp = sorted(timestamps)[-1]
-        report_path = os.path.join(account_dir, latest_timestamp, "scoutsuite-results", "new2.js")
-        
-        return report_path if os.path.exists(report_path) else None
+        source = entry["path"]
+        target = source + _SUFFIXES.get(REPORT_COMPRESSION, ".gz")
+        temp_path = target + ".tmp"
+        started = time.perf_counter()
+        try:
+            bytes_in = os.path.getsize(source)
+            with open(source, "rb") as src, _open_compressed(temp_path, REPORT_COMPRESSION) as dst:
+                shutil.copyfileobj(src, dst, _HASH_CHUNK_BYTES)
+            os.replace(temp_path, target)
+            os.remove(source)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            db[REPORT_CATALOG_COLLECTION].update_one(
+                {"_id": entry["_id"]}, {"$unset": {"archive_claimed_by": "", "archive_claim_until": ""}}
+            )
+            raise
+        elapsed = time.perf_counter() - started
 
-    def list_account_reports(self, account_name: str) -> list:
-        """List all reports available for an account"""
-        account_dir = os.path.join(SCOUT_REPORT_DIR, account_name)
-        if not os.path.exists(account_dir):
-            return []
-
-        reports = []
-        for timestamp in os.listdir(account_dir):
-            report_path = os.path.join(account_dir, timestamp, "scoutsuite-results", "new2.js")
-            if os.path.exists(report_path):
-                reports.append({
-                    "timestamp": timestamp,
-                    "path": report_path,
-                    "created_at": datetime.strptime(timestamp, "%Y%m%d_%H%M%S").isoformat()
-                })
-        
-        return sorted(reports, key=lambda x: x["timestamp"], reverse=True)
+        stat = os.stat(target)
+        db[REPORT_CATALOG_COLLECTION].update_one(
+            {"_id": entry["_id"]},
+            {"$set": {"path": target, "size": stat.st_size, "mtime": stat.st_mtime,
+                      "compression": report_compression(target), "compressed_at": datetime.now(timezone.utc)},
+             "$unset": {"archive_claimed_by": "", "archive_claim_until": ""}}
+        )
+        logger.info(f"Compressed report {account_name}/{timestamp}: {bytes_in} -> {stat.st_size} bytes "
+                    f"in {elapsed:.2f}s")
+        return {"bytes_in": bytes_in, "bytes_out": stat.st_size, "seconds": elapsed}
+
+    def prune_report(self, account_name: str, timestamp: str) -> int:
+        """Deletes a report's directory and catalog entry. Returns the bytes freed."""
+        now = datetime.now(timezone.utc)
+        entry = db[REPORT_CATALOG_COLLECTION].find_one_and_delete(
+            {"account_name": account_name, "timestamp": timestamp,
+             "$or": [{"archive_claim_until": None}, {"archive_claim_until": {"$lt": now}}]},
+            projection={"size": True}
+        )
+        if entry is None:
+            return 0
+        report_dir = os.path.join(SCOUT_REPORT_DIR, account_name, timestamp)
+        freed = 0
+        for root, _, files in os.walk(report_dir):
+            freed += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+        shutil.rmtree(report_dir, ignore_errors=True)
+        logger.info(f"Pruned report {account_name}/{timestamp} ({freed} bytes)")
+        return freed
+
+    def apply_retention(self, account_name: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Applies the retention policy to every account (or one): the newest
+        REPORT_KEEP_UNCOMPRESSED ingested reports stay as they are, older
+        ones get compressed, and those older than REPORT_RETENTION_DAYS are
+        deleted, except for an account's newest report.
+        """
+        counts = {"compressed": 0, "bytes_in": 0, "bytes_out": 0, "seconds": 0.0, "pruned": 0, "bytes_pruned": 0}
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=REPORT_RETENTION_DAYS)
+                  if REPORT_RETENTION_DAYS > 0 else None)
+        accounts = [account_name] if account_name else db[REPORT_CATALOG_COLLECTION].distinct("account_name")
+        for account in accounts:
+            entries = db[REPORT_CATALOG_COLLECTION].find(
+                {"account_name": account}, {"timestamp": True, "report_time": True, "compression": True}
+            ).sort([("report_time", DESCENDING), ("timestamp", DESCENDING)])
+            for index, entry in enumerate(list(entries)):
+                try:
+                    if index > 0 and cutoff and entry["report_time"].replace(tzinfo=timezone.utc) < cutoff:
+                        counts["bytes_pruned"] += self.prune_report(account, entry["timestamp"])
+                        counts["pruned"] += 1
+                    elif index >= REPORT_KEEP_UNCOMPRESSED and entry.get("compression") is None:
+                        done = self.compress_report(account, entry["timestamp"])
+                        if done:
+                            counts["compressed"] += 1
+                            counts["bytes_in"] += done["bytes_in"]
+                            counts["bytes_out"] += done["bytes_out"]
+                            counts["seconds"] += done["seconds"]
+                except Exception as e:
+                    logger.error(f"Failed to archive report {account}/{entry['timestamp']}: {str(e)}")
+
+        with self._archive_lock:
+            for key, value in counts.items():
+                self._archive_totals[key] += value
+            self._archive_totals["last_run"] = datetime.now(timezone.utc).isoformat()
+        if counts["compressed"] or counts["pruned"]:
+            logger.info(f"Report retention: {counts}")
+        return counts
+
+    def storage_stats(self) -> Dict[str, Any]:
+        """Disk used by catalogued reports per account, and the archiver's totals in this process."""
+        accounts = list(db[REPORT_CATALOG_COLLECTION].aggregate([
+            {"$group": {
+                "_id": "$account_name",
+                "reports": {"$sum": 1},
+                "compressed": {"$sum": {"$cond": [{"$ifNull": ["$compression", False]}, 1, 0]}},
+                "disk_bytes": {"$sum": "$size"},
+                "raw_bytes": {"$sum": "$raw_size"}
+            }},
+            {"$sort": {"_id": 1}}
+        ]))
+        for account in accounts:
+            account["account_name"] = account.pop("_id")
+        with self._archive_lock:
+            archiver = dict(self._archive_totals)
+        archiver["compress_mb_per_second"] = (
+            archiver["bytes_in"] / 1024 / 1024 / archiver["seconds"] if archiver["seconds"] else None
+        )
+        return {
+            "disk_bytes": sum(a["disk_bytes"] for a in accounts),
+            "raw_bytes": sum(a["raw_bytes"] for a in accounts),
+            "accounts": accounts,
+            "archiver": archiver
+        }
+
+    def start_archiver(self, interval: int = REPORT_ARCHIVE_INTERVAL_SECONDS) -> None:
+        """Starts the background thread applying the retention policy (once per process)."""
+        with self._archive_lock:
+            if interval <= 0 or self._archiver is not None:
+                return
+            self._archiver = threading.Thread(target=self._archive_loop, args=(interval,),
+                                              name="report-archiver", daemon=True)
+            self._archiver.start()
+
+    def _archive_loop(self, interval: int) -> None:
+        while True:
+            try:
+                self.apply_retention()
+            except Exception as e:
+                logger.error(f"Report retention failed: {str(e)}")
+            time.sleep(interval)
 
 # Create global report manager instance
-report_manager = ReportManager() 
\ No newline at end of file
+report_manager = ReportManager()
+
+
+if __name__ == "__main__":
+    # python report_manager.py reconcile|archive|stats [account_name]
+    commands = {
+        "reconcile": report_manager.reconcile,
+        "archive": report_manager.apply_retention,
+        "stats": lambda account_name=None: report_manager.storage_stats()
+    }
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        print("Usage: python report_manager.py reconcile|archive|stats [account_name]")
+        sys.exit(2)
+    print(commands[sys.argv[1]](*sys.argv[2:3]))
@@ -0,0 +1,191 @@
+# report_upload.py
+import io
+import os
+import queue
+import logging
+import threading
+from typing import Any, Dict, Iterator, Optional
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+from ingest import ingest_report_stream
+from report_manager import REPORT_FILE, report_manager
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Size of each read from the request body
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(64 * 1024)))
+# Chunks received but not yet parsed; the upload waits when ingestion falls this far behind
+UPLOAD_QUEUE_CHUNKS = int(os.getenv("UPLOAD_QUEUE_CHUNKS", "16"))
+
+
+class UploadError(ValueError):
+    """The request body doesn't carry a report."""
+
+
+class ReportPipe(io.RawIOBase):
+    """
+    Hands the chunks of a request body from the request thread to the
+    ingesting thread through a bounded queue, so at most
+    UPLOAD_QUEUE_CHUNKS chunks are buffered whatever the report size.
+    """
+
+    def __init__(self, max_chunks: int = UPLOAD_QUEUE_CHUNKS):
+        super().__init__()
+        self._queue: "queue.Queue[Optional[bytes]]" = queue.Queue(max(1, max_chunks))
+        self._pending = b""
+        self._eof = False
+        self._reader_done = threading.Event()
+        self.reader_failed = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            if self._eof:
+                return 0
+            chunk = self._queue.get()
+            if chunk is None:
+                self._eof = True
+                return 0
+            self._pending = chunk
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+    # -- writer side -----------------------------------------------------
+    def feed(self, chunk: Optional[bytes]) -> bool:
+        """
+        Queues a chunk (None marks the end of the body). Returns False once
+        the reader failed, so the sender can stop early.
+        """
+        while not self._reader_done.is_set():
+            try:
+                self._queue.put(chunk, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return not self.reader_failed
+
+    def reader_finished(self, failed: bool) -> None:
+        """Called by the reader when it stops; later chunks are dropped."""
+        self.reader_failed = failed
+        self._reader_done.set()
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+
+def _raw_chunks(stream) -> Iterator[bytes]:
+    while True:
+        chunk = stream.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _multipart_chunks(stream, boundary: bytes) -> Iterator[bytes]:
+    """
+    Yields the bytes of a multipart/form-data body's first file part (the
+    report) as they arrive; other parts are skipped.
+    """
+    decoder = MultipartDecoder(boundary)
+    in_report = found = False
+    for chunk in _raw_chunks(stream):
+        decoder.receive_data(chunk)
+        event = decoder.next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            if isinstance(event, File) and not found:
+                in_report = found = True
+            elif isinstance(event, Data) and in_report:
+                if event.data:
+                    yield event.data
+                in_report = event.more_data
+            event = decoder.next_event()
+    if not found:
+        raise UploadError("No file part in the multipart body")
+
+
+def _body_chunks(stream, content_type: Optional[str]) -> Iterator[bytes]:
+    mimetype, options = parse_options_header(content_type or "")
+    if mimetype == "multipart/form-data":
+        if not options.get("boundary"):
+            raise UploadError("multipart/form-data body without a boundary")
+        return _multipart_chunks(stream, options["boundary"].encode("latin-1"))
+    return _raw_chunks(stream)
+
+
+def receive_report(stream, content_type: Optional[str], account_name: str, timestamp: str,
+                   batch_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Spools a report being uploaded (raw or chunked body, or the file part of
+    a multipart form) into the managed report directory while a second
+    thread ingests the same bytes with ingest_report_stream, so ingestion
+    finishes shortly after the last byte arrives. Memory stays bounded by
+    the upload queue plus one service section. The file only replaces
+    new2.js once complete; it is then catalogued with its ingest outcome.
+    Returns ingest_report_stream's result plus the stored path and size.
+    """
+    report_dir = report_manager.get_report_path(account_name, timestamp)
+    target_path = os.path.join(report_dir, REPORT_FILE)
+    partial_path = target_path + ".part"
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+
+    pipe = ReportPipe()
+    outcome: Dict[str, Any] = {}
+
+    def consume():
+        failed = True
+        try:
+            with io.TextIOWrapper(io.BufferedReader(pipe, UPLOAD_CHUNK_BYTES), encoding="utf-8") as text:
+                outcome["result"] = ingest_report_stream(text, batch_size, account_name=account_name,
+                                                         report_timestamp=timestamp, label=target_path)
+            failed = False
+        except Exception as e:
+            outcome["error"] = e
+        finally:
+            pipe.reader_finished(failed)
+
+    consumer = threading.Thread(target=consume, name="upload-ingest", daemon=True)
+    consumer.start()
+    received = 0
+    complete = True
+    try:
+        with open(partial_path, "wb") as spool:
+            for chunk in _body_chunks(stream, content_type):
+                spool.write(chunk)
+                received += len(chunk)
+                if not pipe.feed(chunk):
+                    # Ingestion failed; no point receiving the rest
+                    complete = False
+                    break
+        pipe.feed(None)
+    except Exception:
+        pipe.feed(None)
+        consumer.join()
+        os.remove(partial_path)
+        raise
+    consumer.join()
+
+    if received == 0:
+        os.remove(partial_path)
+        raise UploadError("Empty request body")
+    if not complete:
+        os.remove(partial_path)
+        raise outcome["error"]
+
+    # A complete report is kept and catalogued even if its ingestion failed
+    os.replace(partial_path, target_path)
+    report_manager.register_report(account_name, timestamp, target_path)
+    if "error" in outcome:
+        report_manager.mark_failed(account_name, timestamp, str(outcome["error"]))
+        raise outcome["error"]
+    report_manager.mark_ingested(account_name, timestamp, outcome["result"])
+    logger.info(f"Received and ingested {received} bytes for {account_name}/{timestamp}")
+    return {**outcome["result"], "path": target_path, "bytes": received}
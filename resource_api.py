@@ -1,58 +1,52 @@
-from fastapi import FastAPI, HTTPException, Query
-from pymongo import MongoClient
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse
 from typing import Optional, List, Dict
 
-app = FastAPI()
+from async_db import async_mongo
+from queries import QueryTimeout, ec2_instances_query, master_section_query, resource_lookup_query
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One MongoDB client for the whole process, opened before the first request
+    await async_mongo.start()
+    yield
+    await async_mongo.close()
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.exception_handler(QueryTimeout)
+async def query_timeout_handler(request: Request, exc: QueryTimeout):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
 
 # -------------------------------------------------------------------
 # 1. HELPER: MongoDB retrieval
 # -------------------------------------------------------------------
-def get_scoutsuite_document(account_id: str):
+async def get_service_section(account_id: str, service: str):
     """
-    Connect to MongoDB and retrieve the single large Scout Suite
-    document from the 'scoutsuite' collection in the given `account_id` database.
+    Returns doc["services"][service] of the account's latest report,
+    fetching and decompressing only that service's chunk from 'master'.
     """
-    client = MongoClient("mongodb://localhost:27017")
-    db = client[account_id]         # e.g., '430150006394'
-    collection = db["scoutsuite"]   # e.g., 'scoutsuite'
-
-    # We assume there's only one main doc. If there's more than one, adapt as needed.
-    doc = collection.find_one({})
-    client.close()
-    return doc
+    return await async_mongo.run_query(master_section_query(account_id, f"services.{service}"))
 
 # -------------------------------------------------------------------
 # 2. HELPER: Gather all EC2 Instances
 # -------------------------------------------------------------------
-def get_ec2_instances(doc: dict) -> List[Dict]:
+async def get_ec2_instances(account_id: str) -> List[Dict]:
     """
-    Looks for EC2 instance data in doc["services"]["ec2"]["regions"][REGION]["vpcs"][VPC]["instances"][INSTANCE].
+    Reads the account's instances from the 'ec2_instances' collection.
     Returns a list of {"instance_id": ..., "metadata": {...}} objects.
     """
-    services = doc.get("services", {})
-    ec2_data = services.get("ec2", {})
-    regions = ec2_data.get("regions", {})
-
-    results = []
-    for region_id, region_data in regions.items():
-        # Within each region, we have "vpcs"
-        vpcs = region_data.get("vpcs", {})
-        for vpc_id, vpc_data in vpcs.items():
-            instances = vpc_data.get("instances", {})
-            for instance_id, instance_info in instances.items():
-                # Build a list of (instance_id, metadata)
-                results.append({
-                    "instance_id": instance_id,
-                    "metadata": instance_info
-                })
-    return results
+    return await async_mongo.run_query(ec2_instances_query(account_id))
 
 # -------------------------------------------------------------------
 # 3. ENDPOINT: GET /category
 # -------------------------------------------------------------------
 @app.get("/category")
-def get_resources_by_category(
-    account_id: str = Query(..., description="Account ID (database name)"),
+async def get_resources_by_category(
+    account_id: str = Query(..., description="Account ID"),
     category_name: str = Query(..., description="Service/category name, e.g. 'ec2' or 'cloudtrail'")
 ):
     """
@@ -60,15 +54,11 @@ def get_resources_by_category(
     (and their metadata) from the Scout Suite document.
     Otherwise, returns everything under doc["services"][category_name].
     """
-    doc = get_scoutsuite_document(account_id)
-    if not doc:
-        raise HTTPException(status_code=404, detail="No Scout Suite document found in this database.")
-
     category_name_lower = category_name.lower()
 
     # 1. Check if "ec2" -> do special logic
     if category_name_lower == "ec2":
-        ec2_instances = get_ec2_instances(doc)
+        ec2_instances = await get_ec2_instances(account_id)
         # Return them
         return {
             "category_name": "ec2",
@@ -76,8 +66,7 @@ def get_resources_by_category(
         }
 
     # 2. Otherwise, handle it the "general" way
-    services = doc.get("services", {})
-    category_data = services.get(category_name_lower)
+    category_data = await get_service_section(account_id, category_name_lower)
     if category_data is None:
         raise HTTPException(
             status_code=404,
@@ -92,42 +81,37 @@ def get_resources_by_category(
 # -------------------------------------------------------------------
 # 4. ENDPOINT: GET /resource (from previous example)
 # -------------------------------------------------------------------
-def find_resource_by_key(data, resource_name):
-    """
-    Recursively search for a dictionary key matching `resource_name`.
-    Returns the sub-dictionary/value if found, else None.
-    """
-    if isinstance(data, dict):
-        for k, v in data.items():
-            if k == resource_name:
-                return v
-            found = find_resource_by_key(v, resource_name)
-            if found is not None:
-                return found
-    elif isinstance(data, list):
-        for item in data:
-            found = find_resource_by_key(item, resource_name)
-            if found is not None:
-                return found
-    return None
-
 @app.get("/resource")
-def get_resource_metadata(
-    account_id: str = Query(..., description="Account ID (database name)"),
-    resource_name: str = Query(..., description="The name of the resource you're looking for")
+async def get_resource_metadata(
+    account_id: str = Query(..., description="Account ID"),
+    resource_name: str = Query(..., description="The key, name, ID or ARN of the resource you're looking for"),
+    collection: Optional[str] = Query(None, description="Only look in this collection, e.g. 's3_buckets'")
 ):
     """
-    Returns all metadata about a given resource (by name) from the
-    Scout Suite doc identified by the account_id.
+    Returns all metadata about a given resource (by name), found through
+    the 'resource_names' index built at ingest time. If several resources
+    match, responds 409 with their paths instead of picking one.
     """
-    doc = get_scoutsuite_document(account_id)
-    if not doc:
-        raise HTTPException(status_code=404, detail="No Scout Suite document found in this database.")
-
-    resource_data = find_resource_by_key(doc, resource_name)
-    if resource_data is None:
+    result = await async_mongo.run_query(resource_lookup_query(account_id, resource_name, collection))
+    matches = result["matches"]
+    if len(matches) > 1:
+        raise HTTPException(
+            status_code=409,
+            detail={
+                "message": f"Resource name '{resource_name}' is ambiguous; pass collection= to narrow it down.",
+                "matches": [{"path": m["path"], "collection": m["collection"]} for m in matches]
+            }
+        )
+    if result["resource"] is None:
         raise HTTPException(
             status_code=404,
             detail=f"Resource '{resource_name}' not found in the Scout Suite data."
         )
-    return {"resource_name": resource_name, "metadata": resource_data}
\ No newline at end of file
+
+    match = matches[0]
+    return {
+        "resource_name": resource_name,
+        "path": match["path"],
+        "collection": match["collection"],
+        "metadata": result["resource"]
+    }
@@ -0,0 +1,66 @@
+# resource_index.py
+import logging
+from typing import Any, Dict, List, Optional
+
+from mongo_connect import db
+from bulk_writer import ChangeDetectingWriter
+from parser import ResourceEvent
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RESOURCE_NAMES_COLLECTION = "resource_names"
+
+# Resource fields whose (string) values can be looked up, besides the resource key
+NAME_FIELDS = ("id", "name", "arn")
+
+
+def resource_terms(event: ResourceEvent) -> List[str]:
+    """Every string a resource can be looked up by: its key, name, ID and ARN."""
+    terms = [event.resource_path[-1]]
+    resource = event.resource if isinstance(event.resource, dict) else {}
+    for field in NAME_FIELDS:
+        value = resource.get(field)
+        if isinstance(value, str) and value and value not in terms:
+            terms.append(value)
+    return terms
+
+
+class ResourceNameIndexer:
+    """
+    Maintains the 'resource_names' inverted index of one account: a document
+    per resource with its full path in the report, its collection, the filter
+    that finds it there, and the terms it is known by (multikey indexed).
+    Goes through a ChangeDetectingWriter, so unchanged entries aren't
+    rewritten and entries of removed resources are dropped.
+    """
+
+    def __init__(self, account_id: str, batch_size: Optional[int] = None):
+        self.account_id = account_id
+        self._writer = ChangeDetectingWriter(db, account_id, batch_size, removal_mode="delete",
+                                             collections=[RESOURCE_NAMES_COLLECTION])
+
+    def __enter__(self) -> "ResourceNameIndexer":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._writer.__exit__(exc_type, exc, tb)
+
+    def add(self, event: ResourceEvent, collection: str, filter: Dict[str, Any]) -> None:
+        path = ".".join(("services",) + event.resource_path)
+        self._writer.upsert(
+            RESOURCE_NAMES_COLLECTION,
+            {"account_id": self.account_id, "path": path},
+            {
+                "account_id": self.account_id,
+                "path": path,
+                "service": event.service,
+                "collection": collection,
+                "filter": filter,
+                "terms": resource_terms(event)
+            }
+        )
+
+    def close(self) -> Dict[str, int]:
+        return self._writer.close().get(RESOURCE_NAMES_COLLECTION, {})
@@ -0,0 +1,432 @@
+# response_cache.py
+import os
+import gzip
+import json
+import zlib
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from flask import Response, current_app, request
+from pymongo import ReturnDocument
+from mongo_connect import db
+from parser import parse_scoutsuite_file, resolve_report_path
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set to "0" to turn the cache off
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+# In-process LRU size, in entries and in body bytes
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Larger responses are served but never cached
+RESPONSE_CACHE_MAX_BODY_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BODY_BYTES", str(8 * 1024 * 1024)))
+# "memory" (per process) or "mongo" (memory in front of a collection shared by all workers)
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")
+# How long entries live in the shared backend (they are also dropped when a scan is ingested)
+RESPONSE_CACHE_SHARED_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_SHARED_TTL_SECONDS", "86400"))
+# How long a process may reuse an account's generation before re-reading it (0 = every request).
+# The process that ingests sees its bump at once; other workers serve the previous
+# scan's cached responses for up to this long after it.
+RESPONSE_CACHE_GENERATION_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_GENERATION_TTL_SECONDS", "2"))
+
+# Serialized /reports/<account>/latest bodies, keyed by report file (path, mtime, size)
+REPORT_CACHE_MAX_ENTRIES = int(os.getenv("REPORT_CACHE_MAX_ENTRIES", "512"))
+REPORT_CACHE_MAX_BYTES = int(os.getenv("REPORT_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+# Keep those bodies gzip-compressed (sent as-is to clients that accept gzip)
+REPORT_CACHE_GZIP = os.getenv("REPORT_CACHE_GZIP", "1") == "1"
+REPORT_CACHE_GZIP_LEVEL = int(os.getenv("REPORT_CACHE_GZIP_LEVEL", "5"))
+# Size of the chunks cached report bodies are streamed in
+REPORT_CACHE_CHUNK_BYTES = 64 * 1024
+
+CACHE_GENERATIONS_COLLECTION = "cache_generations"
+SHARED_CACHE_COLLECTION = "response_cache"
+
+# (body, status, mimetype, etag)
+CacheEntry = Tuple[bytes, int, str, str]
+
+
+def make_etag(body: bytes) -> str:
+    """Strong ETag (unquoted): the SHA-256 of the exact response body (or cache key)."""
+    return hashlib.sha256(body).hexdigest()
+
+
+def wants_ndjson() -> bool:
+    """Whether the request asks for NDJSON (?format=ndjson or Accept) rather than a JSON array."""
+    return request.args.get("format") == "ndjson" or request.accept_mimetypes.best == "application/x-ndjson"
+
+
+class LRUCache:
+    """Thread-safe LRU of cache entries bounded by entry count and total body size."""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, max_bytes: int = RESPONSE_CACHE_MAX_BYTES):
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous[0])
+            self._entries[key] = entry
+            self._bytes += len(entry[0])
+            while len(self._entries) > self.max_entries or (self._bytes > self.max_bytes and len(self._entries) > 1):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted[0])
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "evictions": self.evictions}
+
+
+class MongoCacheBackend:
+    """Entries shared by every worker process, expired by a TTL index."""
+
+    def __init__(self, collection: str = SHARED_CACHE_COLLECTION, ttl_seconds: int = RESPONSE_CACHE_SHARED_TTL_SECONDS):
+        self._collection = db[collection]
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        doc = self._collection.find_one({"_id": key})
+        if doc is None:
+            return None
+        return bytes(doc["body"]), doc["status"], doc["mimetype"], doc["etag"]
+
+    def set(self, key: str, entry: CacheEntry, account_id: str) -> None:
+        body, status, mimetype, etag = entry
+        self._collection.replace_one({"_id": key}, {
+            "account_id": account_id,
+            "body": body,
+            "status": status,
+            "mimetype": mimetype,
+            "etag": etag,
+            "expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds)
+        }, upsert=True)
+
+    def drop_account(self, account_id: str) -> None:
+        self._collection.delete_many({"account_id": account_id})
+
+
+class ResponseCache:
+    """
+    Read-through cache of GET responses, keyed by route, account, query
+    parameters, negotiated format and the account's generation. Ingesting a scan bumps the
+    generation (bump_generation), so every entry of that account stops
+    matching at once while other accounts keep theirs.
+
+    A response's ETag is the hash of its key rather than of its body, so
+    it is known before the view runs: streamed misses carry it too, and a
+    matching If-None-Match gets a 304 even when the entry isn't cached here.
+    """
+
+    def __init__(self, backend: str = RESPONSE_CACHE_BACKEND):
+        self.local = LRUCache()
+        self.shared = MongoCacheBackend() if backend == "mongo" else None
+        self.backend = backend
+        self._generations: Dict[str, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.uncacheable = 0
+
+    # -- generations -----------------------------------------------------
+    def generation(self, account_id: str) -> int:
+        now = time.monotonic()
+        cached = self._generations.get(account_id)
+        if cached is not None and now - cached[1] < RESPONSE_CACHE_GENERATION_TTL_SECONDS:
+            return cached[0]
+        doc = db[CACHE_GENERATIONS_COLLECTION].find_one({"_id": account_id})
+        generation = doc["generation"] if doc else 0
+        self._generations[account_id] = (generation, now)
+        return generation
+
+    def bump_generation(self, account_id: str) -> int:
+        doc = db[CACHE_GENERATIONS_COLLECTION].find_one_and_update(
+            {"_id": account_id},
+            {"$inc": {"generation": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self._generations[account_id] = (doc["generation"], time.monotonic())
+        if self.shared is not None:
+            self.shared.drop_account(account_id)
+        return doc["generation"]
+
+    # -- entries ---------------------------------------------------------
+    def _key(self, account_id: str) -> str:
+        params = "&".join(f"{k}={v}" for k, v in sorted(request.args.items(multi=True)))
+        # The Accept header picks NDJSON or JSON; responses carry Vary: Accept to match
+        format = "ndjson" if wants_ndjson() else "json"
+        return f"{request.path}?{params}|{format}|{account_id}|{self.generation(account_id)}"
+
+    def _lookup(self, key: str) -> Optional[CacheEntry]:
+        entry = self.local.get(key)
+        if entry is None and self.shared is not None:
+            entry = self.shared.get(key)
+            if entry is not None:
+                self.local.set(key, entry)
+        return entry
+
+    def _store(self, key: str, account_id: str, entry: CacheEntry) -> None:
+        self.local.set(key, entry)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, entry, account_id)
+            except Exception as e:
+                logger.warning(f"Failed to write shared response cache entry: {str(e)}")
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _respond(self, entry: CacheEntry) -> Response:
+        body, status, mimetype, etag = entry
+        response = Response(body, status=status, mimetype=mimetype)
+        response.set_etag(etag)
+        response.vary.add("Accept")
+        return response
+
+    def _not_modified(self, etag: str) -> Response:
+        self._count("not_modified")
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.vary.add("Accept")
+        return response
+
+    def _tee(self, key: str, account_id: str, etag: str, response: Response) -> Iterator[bytes]:
+        """Streams a response through, caching it if it stays under the body size limit."""
+        chunks = []
+        size = 0
+        for chunk in response.response:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            if chunks is not None:
+                size += len(chunk)
+                if size > RESPONSE_CACHE_MAX_BODY_BYTES:
+                    chunks = None
+                    self._count("uncacheable")
+                else:
+                    chunks.append(chunk)
+            yield chunk
+        if chunks is not None:
+            body = b"".join(chunks)
+            self._store(key, account_id, (body, response.status_code, response.mimetype, etag))
+
+    def cached(self, view):
+        """Decorator for GET views that take ?account_id=."""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            account_id = request.args.get("account_id")
+            if not RESPONSE_CACHE_ENABLED or request.method != "GET" or not account_id:
+                return view(*args, **kwargs)
+
+            key = self._key(account_id)
+            etag = make_etag(key.encode("utf-8"))
+            if request.if_none_match.contains(etag):
+                return self._not_modified(etag)
+            entry = self._lookup(key)
+            if entry is not None:
+                self._count("hits")
+                return self._respond(entry)
+            self._count("misses")
+
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            if response.is_streamed:
+                streamed = Response(self._tee(key, account_id, etag, response), status=response.status_code,
+                                    mimetype=response.mimetype)
+                streamed.set_etag(etag)
+                streamed.vary.add("Accept")
+                return streamed
+            body = response.get_data()
+            if len(body) > RESPONSE_CACHE_MAX_BODY_BYTES:
+                self._count("uncacheable")
+                return response
+            entry = (body, response.status_code, response.mimetype, etag)
+            self._store(key, account_id, entry)
+            return self._respond(entry)
+        return wrapper
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "uncacheable": self.uncacheable
+            }
+        lookups = counters["hits"] + counters["misses"]
+        counters["hit_ratio"] = round(counters["hits"] / lookups, 4) if lookups else 0.0
+        counters.update(self.local.stats())
+        counters["backend"] = self.backend
+        counters["enabled"] = RESPONSE_CACHE_ENABLED
+        return counters
+
+
+# Create global response cache instance
+response_cache = ResponseCache()
+
+
+class ReportCache:
+    """
+    Cache of serialized report bodies for /reports/<account>/latest, so a
+    report is parsed and serialized once rather than on every request.
+    Entries are keyed by the report file's (path, mtime, size): a rewritten
+    or compressed report gets new keys and the old ones age out of the LRU,
+    which is bounded by total body bytes. A miss parses the report once and
+    caches the full body and one body per service.
+    """
+
+    def __init__(self, max_entries: int = REPORT_CACHE_MAX_ENTRIES, max_bytes: int = REPORT_CACHE_MAX_BYTES,
+                 compress: bool = REPORT_CACHE_GZIP):
+        self.local = LRUCache(max_entries, max_bytes)
+        self.compress = compress
+        self._loading: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _entry(self, body: bytes) -> CacheEntry:
+        etag = make_etag(body)
+        if self.compress:
+            body = gzip.compress(body, REPORT_CACHE_GZIP_LEVEL)
+        return body, 200, "application/json", etag
+
+    def _cache_services(self, data: Dict[str, Any], report_key: str, service: Optional[str]) -> Optional[CacheEntry]:
+        """Caches one body per service of a parsed report; returns that of `service`, if it has one."""
+        dumps = current_app.json.dumps
+        wanted = None
+        for name, section in (data.get("services") or {}).items():
+            body = dumps({"account_id": data.get("account_id"), "service": name, "data": section})
+            entry = self._entry(body.encode("utf-8"))
+            self.local.set(f"{report_key}|{name}", entry)
+            if name == service:
+                wanted = entry
+        return wanted
+
+    def _load(self, path: str, report_key: str, service: Optional[str]) -> Optional[CacheEntry]:
+        """Parses the report and caches its full body and per-service bodies; returns the one asked for."""
+        data = parse_scoutsuite_file(path)
+        full = self._entry(current_app.json.dumps(data).encode("utf-8"))
+        self.local.set(report_key, full)
+        wanted = self._cache_services(data, report_key, service)
+        return wanted if service else full
+
+    def _lookup(self, path: str, service: Optional[str]) -> Optional[CacheEntry]:
+        """
+        The cached body of the report, or of one of its services. None only
+        when the report has no such service.
+        """
+        path = resolve_report_path(path)
+        stat = os.stat(path)
+        report_key = f"{path}|{stat.st_mtime_ns}|{stat.st_size}"
+        key = f"{report_key}|{service}" if service else report_key
+        entry = self.local.get(key)
+        if entry is not None:
+            self._count("hits")
+            return entry
+        self._count("misses")
+
+        # One parse per report however many requests miss at once
+        with self._lock:
+            loading = self._loading.setdefault(report_key, threading.Lock())
+        with loading:
+            entry = self.local.get(key)
+            if entry is None:
+                full = self.local.get(report_key) if service else None
+                if full is not None:
+                    # The service body was evicted but the full one is still here: slice it from that
+                    body = gzip.decompress(full[0]) if self.compress else full[0]
+                    entry = self._cache_services(json.loads(body), report_key, service)
+                else:
+                    entry = self._load(path, report_key, service)
+        with self._lock:
+            self._loading.pop(report_key, None)
+        return entry
+
+    @staticmethod
+    def _chunks(body: bytes) -> Iterator[bytes]:
+        for start in range(0, len(body), REPORT_CACHE_CHUNK_BYTES):
+            yield body[start:start + REPORT_CACHE_CHUNK_BYTES]
+
+    @staticmethod
+    def _gunzip_chunks(body: bytes) -> Iterator[bytes]:
+        decompressor = zlib.decompressobj(wbits=31)
+        for chunk in ReportCache._chunks(body):
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+
+    def respond(self, path: str, service: Optional[str] = None) -> Optional[Response]:
+        """
+        Streams the cached body of the report at `path` (or of one of its
+        services), gzip-encoded when stored that way and the client accepts
+        it. Honors If-None-Match. Returns None if the service isn't in the report.
+        """
+        entry = self._lookup(path, service)
+        if entry is None:
+            return None
+        body, status, mimetype, etag = entry
+
+        send_gzip = self.compress and "gzip" in request.accept_encodings
+        if send_gzip:
+            # A different representation needs a different strong ETag
+            etag = f"{etag}-gzip"
+        if request.if_none_match.contains(etag):
+            self._count("not_modified")
+            response = Response(status=304)
+        elif send_gzip or not self.compress:
+            response = Response(self._chunks(body), status=status, mimetype=mimetype)
+            response.content_length = len(body)
+            if send_gzip:
+                response.content_encoding = "gzip"
+        else:
+            response = Response(self._gunzip_chunks(body), status=status, mimetype=mimetype)
+        response.set_etag(etag)
+        response.vary.add("Accept-Encoding")
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = {"hits": self.hits, "misses": self.misses, "not_modified": self.not_modified}
+        counters.update(self.local.stats())
+        counters["gzip"] = self.compress
+        return counters
+
+
+# Create global report cache instance
+report_cache = ReportCache()
+
+
+def bump_generation(account_id: str) -> int:
+    """Invalidates every cached response of an account; called after each ingest."""
+    return response_cache.bump_generation(account_id)
@@ -0,0 +1,488 @@
+# retention.py
+import os
+import sys
+import gzip
+import json
+import bisect
+import shutil
+import socket
+import logging
+import argparse
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import bson
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from mongo_connect import db
+from history import RESOURCE_HISTORY_COLLECTION, SCANS_COLLECTION
+from report_manager import report_manager
+from response_cache import bump_generation
+from scout_runner import SCOUT_LOG_DIR, scout_pid_file
+from summaries import ACCOUNT_SUMMARIES_COLLECTION
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RETENTION_POLICIES_COLLECTION = "retention_policies"
+# One document per retention pass (what it deleted and reclaimed), plus the lock between processes
+RETENTION_RUNS_COLLECTION = "retention_runs"
+# Policy of accounts without their own (and without a 'default' document); all 0 keeps every scan
+RETENTION_KEEP_ALL_DAYS = int(os.getenv("RETENTION_KEEP_ALL_DAYS", "0"))
+RETENTION_DAILY_DAYS = int(os.getenv("RETENTION_DAILY_DAYS", "0"))
+RETENTION_WEEKLY_DAYS = int(os.getenv("RETENTION_WEEKLY_DAYS", "0"))
+# How often the background engine runs a pass; 0 disables it
+RETENTION_INTERVAL_SECONDS = int(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+# Documents deleted per bulk delete, and at most this many per second (0 = unthrottled)
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+RETENTION_MAX_DELETES_PER_SECOND = int(os.getenv("RETENTION_MAX_DELETES_PER_SECOND", "1000"))
+# Set to "1" to run MongoDB's compact on collections a pass deleted from (blocks them on older servers)
+RETENTION_COMPACT = os.getenv("RETENTION_COMPACT", "0") == "1"
+# A pass that died holding the lock loses it after this long
+RETENTION_LOCK_TIMEOUT_SECONDS = int(os.getenv("RETENTION_LOCK_TIMEOUT_SECONDS", "3600"))
+# Scout logs (logs/scout/*.log.txt) larger than this are rotated into .gz files, of which the newest are kept
+LOG_ROTATE_BYTES = int(os.getenv("LOG_ROTATE_BYTES", str(10 * 1024 * 1024)))
+LOG_ROTATE_KEEP = int(os.getenv("LOG_ROTATE_KEEP", "5"))
+# Scout log, status and result files untouched for this long are deleted; 0 keeps them
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "30"))
+
+DEFAULT_POLICY_ID = "default"
+_LOCK_ID = "lock"
+# Scans that never completed are kept at least this long (they may still be ingesting)
+_UNFINISHED_GRACE = timedelta(days=1)
+# Files of scout's logs directory the log retention may delete
+_LOG_SUFFIXES = (".log.txt", ".gz", ".status.txt", ".result.json")
+
+
+class RetentionPolicy(NamedTuple):
+    """
+    Every scan of the last keep_all_days, the newest scan of each day of
+    the last daily_days and of each week of the last weekly_days; older
+    scans are deleted. All 0 keeps everything.
+    """
+    keep_all_days: int = RETENTION_KEEP_ALL_DAYS
+    daily_days: int = RETENTION_DAILY_DAYS
+    weekly_days: int = RETENTION_WEEKLY_DAYS
+
+    @property
+    def enabled(self) -> bool:
+        return any(days > 0 for days in self)
+
+    @property
+    def horizon(self) -> timedelta:
+        """Age past which nothing of the account is kept (except its newest scan)."""
+        return timedelta(days=max(self))
+
+
+def parse_policy(values: Dict[str, Any]) -> RetentionPolicy:
+    """A policy from a JSON object; missing tiers are 0. Raises ValueError if invalid."""
+    unknown = set(values) - set(RetentionPolicy._fields)
+    if unknown:
+        raise ValueError(f"Unknown policy fields: {', '.join(sorted(unknown))}")
+    days = {}
+    for field in RetentionPolicy._fields:
+        value = values.get(field, 0)
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            raise ValueError(f"{field} must be a non-negative number of days")
+        days[field] = value
+    return RetentionPolicy(**days)
+
+
+def set_policy(account: str, policy: RetentionPolicy) -> None:
+    """Sets the policy of an account (its account_id or name), or the 'default' one."""
+    db[RETENTION_POLICIES_COLLECTION].replace_one(
+        {"_id": account}, {**policy._asdict(), "updated_at": datetime.now(timezone.utc)}, upsert=True
+    )
+
+
+def delete_policy(account: str) -> bool:
+    return db[RETENTION_POLICIES_COLLECTION].delete_one({"_id": account}).deleted_count > 0
+
+
+def list_policies() -> Dict[str, Any]:
+    policies = {doc.pop("_id"): doc for doc in db[RETENTION_POLICIES_COLLECTION].find({}, {"updated_at": False})}
+    return {"environment": RetentionPolicy()._asdict(), "policies": policies}
+
+
+def policy_for(account_id: str, account_names: Iterable[str] = ()) -> RetentionPolicy:
+    """The account's policy, set on its account_id or one of its names, else the default one."""
+    keys = [account_id, *account_names, DEFAULT_POLICY_ID]
+    docs = {doc["_id"]: doc for doc in db[RETENTION_POLICIES_COLLECTION].find({"_id": {"$in": keys}})}
+    for key in keys:
+        if key in docs:
+            return RetentionPolicy(**{field: docs[key].get(field, 0) for field in RetentionPolicy._fields})
+    return RetentionPolicy()
+
+
+def _utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def expired_scans(scans: List[Dict[str, Any]], policy: RetentionPolicy,
+                  now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """
+    The scans of one account (newest first) the policy drops. Keeps the
+    newest completed scan whatever its age, and unfinished scans for a day.
+    """
+    if not policy.enabled:
+        return []
+    now = now or datetime.now(timezone.utc)
+    keep_all, daily, weekly = (timedelta(days=days) for days in policy)
+    newest = next((scan["_id"] for scan in scans if scan.get("status") == "completed"), None)
+    days_seen: Set[Any] = set()
+    weeks_seen: Set[Any] = set()
+    expired = []
+    for scan in scans:
+        scan_time = _utc(scan["scan_time"])
+        age = now - scan_time
+        if scan.get("status") != "completed":
+            if age > max(keep_all, _UNFINISHED_GRACE):
+                expired.append(scan)
+            continue
+        day, week = scan_time.date(), scan_time.isocalendar()[:2]
+        keep = (scan["_id"] == newest or age <= keep_all
+                or (age <= daily and day not in days_seen)
+                or (age <= weekly and week not in weeks_seen))
+        # Newest first, so the first scan of a day/week is its latest
+        days_seen.add(day)
+        weeks_seen.add(week)
+        if not keep:
+            expired.append(scan)
+    return expired
+
+
+# -------------------------------------------------------------------
+# Retention engine
+# -------------------------------------------------------------------
+class RetentionEngine:
+    """
+    Applies the retention policies in the background: drops the scans a
+    policy expires (with their summaries and report directories), compacts
+    'resource_history' down to the versions some kept scan can still see,
+    purges resources flagged removed (RESOURCE_REMOVAL_MODE=mark) and
+    orphaned master chunks past the policy's horizon, and rotates scout's
+    logs. Deletes go in batches of RETENTION_BATCH_SIZE, spaced out to
+    RETENTION_MAX_DELETES_PER_SECOND so foreground queries keep their
+    latency. Each pass records what it deleted and the bytes reclaimed in
+    'retention_runs'; a lock there keeps passes of several processes from
+    overlapping.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        # Falls back to measuring documents client-side on servers without $bsonSize (< 4.4)
+        self._bson_size = True
+
+    # ---------------------------------------------------------------
+    # Throttled bulk deletes
+    # ---------------------------------------------------------------
+    def _select_batch(self, collection: str, query: Dict[str, Any]) -> Tuple[List[Any], int]:
+        if self._bson_size:
+            try:
+                rows = list(db[collection].aggregate([
+                    {"$match": query},
+                    {"$limit": RETENTION_BATCH_SIZE},
+                    {"$project": {"_id": True, "size": {"$bsonSize": "$$ROOT"}}}
+                ]))
+                return [row["_id"] for row in rows], sum(row["size"] for row in rows)
+            except OperationFailure:
+                self._bson_size = False
+        docs = list(db[collection].find(query).limit(RETENTION_BATCH_SIZE))
+        return [doc["_id"] for doc in docs], sum(len(bson.encode(doc)) for doc in docs)
+
+    def _bulk_delete(self, collection: str, query: Dict[str, Any], run: Dict[str, Any]) -> int:
+        """Deletes what matches `query` batch by batch; returns the documents deleted."""
+        if run["dry_run"]:
+            count = db[collection].count_documents(query)
+            if count:
+                run["deleted"].setdefault(collection, {"documents": 0, "bytes": 0})["documents"] += count
+            return count
+        deleted = 0
+        while True:
+            started = time.perf_counter()
+            ids, size = self._select_batch(collection, query)
+            if not ids:
+                break
+            count = db[collection].delete_many({"_id": {"$in": ids}}).deleted_count
+            totals = run["deleted"].setdefault(collection, {"documents": 0, "bytes": 0})
+            totals["documents"] += count
+            totals["bytes"] += size
+            deleted += count
+            if RETENTION_MAX_DELETES_PER_SECOND > 0:
+                time.sleep(max(0.0, len(ids) / RETENTION_MAX_DELETES_PER_SECOND - (time.perf_counter() - started)))
+            if len(ids) < RETENTION_BATCH_SIZE:
+                break
+        return deleted
+
+    # ---------------------------------------------------------------
+    # Per account
+    # ---------------------------------------------------------------
+    def _compact_history(self, account_id: str, kept_times: List[datetime], expired_times: List[datetime],
+                         run: Dict[str, Any]) -> None:
+        """
+        Deletes the closed resource versions that no kept scan can see: those
+        that ended by the oldest kept scan, and those that both started
+        after and ended by the next of two consecutive kept scans, where
+        scans were dropped in between.
+        """
+        gaps = set()
+        for scan_time in expired_times:
+            index = bisect.bisect_left(kept_times, scan_time)
+            if index < len(kept_times):
+                gaps.add((kept_times[index - 1] if index > 0 else None, kept_times[index]))
+        for lower, upper in sorted(gaps, key=lambda gap: gap[1]):
+            query: Dict[str, Any] = {"account_id": account_id, "valid_to": {"$lte": upper}}
+            if lower is not None:
+                query["valid_from"] = {"$gt": lower}
+            self._bulk_delete(RESOURCE_HISTORY_COLLECTION, query, run)
+
+    def apply_account(self, account_id: str, run: Dict[str, Any], now: Optional[datetime] = None) -> None:
+        now = now or datetime.now(timezone.utc)
+        scans = list(db[SCANS_COLLECTION].find(
+            {"account_id": account_id},
+            {"scan_time": True, "status": True, "account_name": True, "report_timestamp": True, "collections": True}
+        ).sort("scan_time", -1))
+        names = sorted({scan["account_name"] for scan in scans if scan.get("account_name")})
+        policy = policy_for(account_id, names)
+        if not policy.enabled:
+            return
+        deleted_before = self._deleted_documents(run)
+        expired = expired_scans(scans, policy, now)
+        expired_ids = {scan["_id"] for scan in expired}
+        kept = [scan for scan in scans if scan["_id"] not in expired_ids]
+
+        if expired:
+            # Report directories no kept scan came from
+            kept_reports = {(s.get("account_name"), s.get("report_timestamp")) for s in kept}
+            for scan in expired:
+                report = (scan.get("account_name"), scan.get("report_timestamp"))
+                if None in report or report in kept_reports:
+                    continue
+                kept_reports.add(report)
+                if run["dry_run"]:
+                    run["reports_pruned"] += 1
+                    continue
+                try:
+                    freed = report_manager.prune_report(*report)
+                except OSError as e:
+                    logger.error(f"Failed to prune report {report[0]}/{report[1]}: {str(e)}")
+                    continue
+                if freed:
+                    run["reports_pruned"] += 1
+                    run["report_bytes"] += freed
+
+            for start in range(0, len(expired), RETENTION_BATCH_SIZE):
+                batch = [scan["_id"] for scan in expired[start:start + RETENTION_BATCH_SIZE]]
+                self._bulk_delete(ACCOUNT_SUMMARIES_COLLECTION, {"scan_id": {"$in": batch}}, run)
+            kept_times = sorted(_utc(s["scan_time"]) for s in kept if s.get("status") == "completed")
+            self._compact_history(account_id, kept_times, [_utc(s["scan_time"]) for s in expired], run)
+            for start in range(0, len(expired), RETENTION_BATCH_SIZE):
+                batch = [scan["_id"] for scan in expired[start:start + RETENTION_BATCH_SIZE]]
+                self._bulk_delete(SCANS_COLLECTION, {"_id": {"$in": batch}}, run)
+            run["scans_deleted"] += len(expired)
+
+        horizon = now - policy.horizon
+        # Resources flagged removed (RESOURCE_REMOVAL_MODE=mark) longer ago than the horizon
+        for collection in sorted({name for scan in scans for name in (scan.get("collections") or {})}):
+            self._bulk_delete(collection, {"account_id": account_id, "removed": True,
+                                           "removed_at": {"$lt": horizon}}, run)
+        # Master chunks of generations an ingest started but never switched to
+        master = db["master"].find_one({"account_id": account_id}, {"generation": True})
+        if master and master.get("generation"):
+            self._bulk_delete("master_chunks", {"account_id": account_id, "generation": {
+                "$ne": master["generation"], "$lt": ObjectId.from_datetime(now - _UNFINISHED_GRACE)}}, run)
+
+        if not run["dry_run"] and self._deleted_documents(run) > deleted_before:
+            # Cached responses (listings, as_of reads, trends) may show what was just deleted
+            bump_generation(account_id)
+
+    @staticmethod
+    def _deleted_documents(run: Dict[str, Any]) -> int:
+        return sum(totals["documents"] for totals in run["deleted"].values())
+
+    # ---------------------------------------------------------------
+    # Scout logs
+    # ---------------------------------------------------------------
+    def rotate_logs(self, run: Dict[str, Any], log_dir: str = SCOUT_LOG_DIR,
+                    now: Optional[datetime] = None) -> None:
+        """
+        Gzips *.log.txt files over LOG_ROTATE_BYTES (scout appends to them
+        forever when scans are named after a user) into <file>.<timestamp>.gz,
+        keeping the newest LOG_ROTATE_KEEP per log, and deletes log, status
+        and result files untouched for LOG_RETENTION_DAYS. Logs of a running
+        scan (it has a PID file) are left alone.
+        """
+        now = now or datetime.now(timezone.utc)
+        logs = run["logs"]
+        if not os.path.isdir(log_dir):
+            return
+        for name in sorted(os.listdir(log_dir)):
+            path = os.path.join(log_dir, name)
+            if not name.endswith(".log.txt") or not os.path.isfile(path):
+                continue
+            log_name = name.rsplit(".", 3)[0]
+            if os.path.exists(scout_pid_file(log_name)) or os.path.getsize(path) <= LOG_ROTATE_BYTES:
+                continue
+            if run["dry_run"]:
+                logs["rotated"] += 1
+                continue
+            target = f"{path}.{now.strftime('%Y%m%d%H%M%S')}.gz"
+            size = os.path.getsize(path)
+            with open(path, "rb") as src, gzip.open(target, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.remove(path)
+            logs["rotated"] += 1
+            logs["bytes"] += size - os.path.getsize(target)
+            rotated = sorted(n for n in os.listdir(log_dir) if n.startswith(name + ".") and n.endswith(".gz"))
+            for old in rotated[:-LOG_ROTATE_KEEP] if LOG_ROTATE_KEEP > 0 else rotated:
+                logs["bytes"] += os.path.getsize(os.path.join(log_dir, old))
+                os.remove(os.path.join(log_dir, old))
+                logs["deleted"] += 1
+
+        if LOG_RETENTION_DAYS <= 0:
+            return
+        cutoff = (now - timedelta(days=LOG_RETENTION_DAYS)).timestamp()
+        for name in sorted(os.listdir(log_dir)):
+            path = os.path.join(log_dir, name)
+            if not name.endswith(_LOG_SUFFIXES) or not os.path.isfile(path) or os.path.getmtime(path) >= cutoff:
+                continue
+            if run["dry_run"]:
+                logs["deleted"] += 1
+                continue
+            logs["bytes"] += os.path.getsize(path)
+            os.remove(path)
+            logs["deleted"] += 1
+
+    # ---------------------------------------------------------------
+    # Passes
+    # ---------------------------------------------------------------
+    def _acquire_lock(self, owner: str) -> bool:
+        now = datetime.now(timezone.utc)
+        try:
+            db[RETENTION_RUNS_COLLECTION].update_one(
+                {"_id": _LOCK_ID, "$or": [{"expires_at": {"$lt": now}}, {"owner": owner}]},
+                {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=RETENTION_LOCK_TIMEOUT_SECONDS)}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            # Another process is running a pass
+            return False
+
+    def run(self, account_id: Optional[str] = None, dry_run: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        One pass over every account (or one) and the scout logs. Returns
+        what it deleted (or, with `dry_run`, would delete) and the bytes
+        reclaimed, or None if another process is running a pass.
+        """
+        owner = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        if not self._acquire_lock(owner):
+            logger.info("Another process is applying retention, skipping")
+            return None
+        started = time.perf_counter()
+        run: Dict[str, Any] = {"started_at": datetime.now(timezone.utc), "dry_run": dry_run, "accounts": 0,
+                               "scans_deleted": 0, "reports_pruned": 0, "report_bytes": 0, "deleted": {},
+                               "logs": {"rotated": 0, "deleted": 0, "bytes": 0}, "compacted": {}}
+        try:
+            accounts = [account_id] if account_id else db[SCANS_COLLECTION].distinct("account_id")
+            for account in accounts:
+                try:
+                    self.apply_account(account, run)
+                    run["accounts"] += 1
+                except Exception as e:
+                    logger.error(f"Failed to apply retention to account {account}: {str(e)}")
+            try:
+                self.rotate_logs(run)
+            except OSError as e:
+                logger.error(f"Failed to rotate scout logs: {str(e)}")
+            if RETENTION_COMPACT and not dry_run:
+                for collection in run["deleted"]:
+                    try:
+                        run["compacted"][collection] = db.command("compact", collection).get("bytesFreed")
+                    except OperationFailure as e:
+                        logger.warning(f"compact of {collection} failed: {str(e)}")
+        finally:
+            db[RETENTION_RUNS_COLLECTION].delete_one({"_id": _LOCK_ID, "owner": owner})
+
+        run["reclaimed_bytes"] = (sum(totals["bytes"] for totals in run["deleted"].values())
+                                  + run["report_bytes"] + run["logs"]["bytes"])
+        run["seconds"] = round(time.perf_counter() - started, 3)
+        if not dry_run:
+            db[RETENTION_RUNS_COLLECTION].insert_one(dict(run))
+        logger.info(f"Retention pass: {run['scans_deleted']} scans, {run['reports_pruned']} reports, "
+                    f"{run['reclaimed_bytes']} bytes reclaimed in {run['seconds']}s")
+        return run
+
+    def stats(self, limit: int = 10) -> Dict[str, Any]:
+        """The last passes and the bytes reclaimed by all of them."""
+        runs = list(db[RETENTION_RUNS_COLLECTION].find({"_id": {"$ne": _LOCK_ID}}, {"_id": False})
+                    .sort("started_at", -1).limit(limit))
+        totals = list(db[RETENTION_RUNS_COLLECTION].aggregate([
+            {"$match": {"_id": {"$ne": _LOCK_ID}}},
+            {"$group": {"_id": None, "passes": {"$sum": 1}, "scans_deleted": {"$sum": "$scans_deleted"},
+                        "reports_pruned": {"$sum": "$reports_pruned"},
+                        "reclaimed_bytes": {"$sum": "$reclaimed_bytes"}}}
+        ]))
+        total = totals[0] if totals else {"passes": 0, "scans_deleted": 0, "reports_pruned": 0, "reclaimed_bytes": 0}
+        total.pop("_id", None)
+        return {"totals": total, "runs": runs}
+
+    def start(self, interval: int = RETENTION_INTERVAL_SECONDS) -> None:
+        """Starts the background thread running a pass every `interval` seconds (once per process)."""
+        with self._lock:
+            if interval <= 0 or self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, args=(interval,), name="retention", daemon=True)
+            self._thread.start()
+
+    def _loop(self, interval: int) -> None:
+        while True:
+            try:
+                self.run()
+            except Exception as e:
+                logger.error(f"Retention pass failed: {str(e)}")
+            time.sleep(interval)
+
+# Create global retention engine instance
+retention_engine = RetentionEngine()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    arg_parser = argparse.ArgumentParser(description="Retention of scans, reports and scout logs.")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="apply the retention policies once")
+    run.add_argument("--account-id", default=None)
+    run.add_argument("--dry-run", action="store_true", help="only count what would be deleted")
+    policy = commands.add_parser("policy", help="set (or with --clear, remove) the policy of an account or 'default'")
+    policy.add_argument("account", help="account_id, account name or 'default'")
+    policy.add_argument("--keep-all-days", type=int, default=0)
+    policy.add_argument("--daily-days", type=int, default=0)
+    policy.add_argument("--weekly-days", type=int, default=0)
+    policy.add_argument("--clear", action="store_true")
+    commands.add_parser("stats", help="show the policies, the last passes and the bytes reclaimed")
+    args = arg_parser.parse_args(argv)
+
+    if args.command == "run":
+        result = retention_engine.run(args.account_id, dry_run=args.dry_run)
+        if result is None:
+            return 1
+    elif args.command == "policy":
+        if args.clear:
+            delete_policy(args.account)
+        else:
+            set_policy(args.account, parse_policy({"keep_all_days": args.keep_all_days,
+                                                   "daily_days": args.daily_days,
+                                                   "weekly_days": args.weekly_days}))
+        result = list_policies()
+    else:
+        result = {**list_policies(), **retention_engine.stats()}
+    print(json.dumps(result, indent=2, default=str))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
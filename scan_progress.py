@@ -0,0 +1,304 @@
+# scan_progress.py
+import os
+import re
+import json
+import queue
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from pymongo import ASCENDING
+from mongo_connect import db
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Events kept in memory per scan, and scans kept in memory per process
+SCAN_PROGRESS_BUFFER_EVENTS = int(os.getenv("SCAN_PROGRESS_BUFFER_EVENTS", "1000"))
+SCAN_PROGRESS_MAX_JOBS = int(os.getenv("SCAN_PROGRESS_MAX_JOBS", "100"))
+# Set to "0" to keep events in memory only (then only the process running a scan can stream it)
+SCAN_PROGRESS_MIRROR = os.getenv("SCAN_PROGRESS_MIRROR", "1") == "1"
+# How long mirrored events are kept
+SCAN_PROGRESS_TTL_DAYS = int(os.getenv("SCAN_PROGRESS_TTL_DAYS", "7"))
+# How often a stream of a scan running in another process polls MongoDB
+SCAN_PROGRESS_POLL_SECONDS = float(os.getenv("SCAN_PROGRESS_POLL_SECONDS", "1"))
+# Idle streams get a keep-alive comment this often
+SCAN_PROGRESS_HEARTBEAT_SECONDS = float(os.getenv("SCAN_PROGRESS_HEARTBEAT_SECONDS", "15"))
+# A stream ends after this long; EventSource clients reconnect with Last-Event-ID
+SCAN_PROGRESS_STREAM_SECONDS = float(os.getenv("SCAN_PROGRESS_STREAM_SECONDS", "300"))
+
+SCAN_PROGRESS_COLLECTION = "scan_progress"
+
+# Event types
+STAGE_STARTED = "stage_started"
+STAGE_FINISHED = "stage_finished"
+SERVICE_STARTED = "service_started"
+SERVICE_FINISHED = "service_finished"
+ERROR = "error"
+SCAN_FINISHED = "scan_finished"
+
+# scout's console lines: '<date> <time> <host> scout[<pid>] <LEVEL> <message>'
+_SCOUT_LINE_RE = re.compile(r"^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d \S+ scout\[\d+\] (?P<level>[A-Z]+) (?P<message>.*)$")
+_ANSI_RE = re.compile(r"\x1b\[[0-9;]*m")
+_SERVICE_RE = re.compile(r"^Fetching resources for the (?P<service>.+) service$")
+_SERVICE_ERROR_RE = re.compile(r"^Could not fetch (?P<service>.+) configuration")
+# Messages that start a stage of a scout run (ScoutSuite.__main__._run)
+STAGE_MESSAGES = {
+    "Launching Scout": "launch",
+    "Authenticating to cloud provider": "authenticate",
+    "Gathering data from APIs": "fetch",
+    "Updating existing data": "update",
+    "Using local data": "load",
+    "Running pre-processing engine": "preprocessing",
+    "Running rule engine": "rules",
+    "Applying display filters": "filters",
+    "Applying exceptions": "exceptions",
+    "Running post-processing engine": "postprocessing",
+    # In-process scans (scout_inprocess.py)
+    "Building the results document": "build",
+    "Storing results in MongoDB": "ingest",
+}
+# Saving the results and the HTML report ("Saving data to ...", "Creating ...")
+_REPORT_PREFIXES = ("Saving data to ", "Creating ")
+# scout prints display names; the few that aren't the service key lowercased without spaces
+_SERVICE_KEYS = {"lambda": "awslambda", "systemsmanager": "ssm", "documentdb": "docdb"}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _json_default(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+def service_key(display_name: str) -> str:
+    key = display_name.lower().replace(" ", "")
+    return _SERVICE_KEYS.get(key, key)
+
+
+def parse_scout_line(line: str) -> Optional[Dict[str, str]]:
+    """Returns {"level", "message"} for a scout log line, None for anything else."""
+    match = _SCOUT_LINE_RE.match(_ANSI_RE.sub("", line).strip())
+    return match.groupdict() if match else None
+
+
+class ProgressBuffer:
+    """
+    Recent progress events of the scans of this process: a ring buffer of
+    SCAN_PROGRESS_BUFFER_EVENTS per scan, for the SCAN_PROGRESS_MAX_JOBS
+    most recent scans. Streams waiting for events are woken up on publish.
+    Events are also mirrored to the 'scan_progress' collection (in batches,
+    from a background thread) so any worker can stream any scan.
+    """
+
+    def __init__(self, max_events: int = SCAN_PROGRESS_BUFFER_EVENTS, max_jobs: int = SCAN_PROGRESS_MAX_JOBS,
+                 mirror: bool = SCAN_PROGRESS_MIRROR):
+        self.max_events = max(1, max_events)
+        self.max_jobs = max(1, max_jobs)
+        self.mirror = mirror
+        self._jobs: "OrderedDict[str, Deque[Dict[str, Any]]]" = OrderedDict()
+        self._cond = threading.Condition()
+        self._mirror_queue: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        self._mirror_thread: Optional[threading.Thread] = None
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        with self._cond:
+            events = self._jobs.get(event["job_id"])
+            if events is None:
+                events = self._jobs[event["job_id"]] = deque(maxlen=self.max_events)
+                while len(self._jobs) > self.max_jobs:
+                    self._jobs.popitem(last=False)
+            events.append(event)
+            self._cond.notify_all()
+        if self.mirror:
+            self._start_mirror()
+            self._mirror_queue.put(event)
+
+    def recent(self, job_id: str, after: int = 0) -> Optional[List[Dict[str, Any]]]:
+        """
+        Events of a scan with seq > after from memory, or None if this
+        process doesn't have all of them (scan ran elsewhere, or the
+        oldest ones were already dropped from the ring).
+        """
+        with self._cond:
+            events = self._jobs.get(job_id)
+            if not events or events[0]["seq"] > after + 1:
+                return None
+            return [event for event in events if event["seq"] > after]
+
+    def events(self, job_id: str, after: int = 0) -> List[Dict[str, Any]]:
+        """Events of a scan with seq > after, from memory or else from MongoDB."""
+        events = self.recent(job_id, after)
+        if events is not None:
+            return events
+        return list(db[SCAN_PROGRESS_COLLECTION].find(
+            {"job_id": job_id, "seq": {"$gt": after}}, {"_id": False, "expires_at": False}
+        ).sort("seq", ASCENDING))
+
+    def stream(self, job_id: str, after: int = 0) -> Iterator[str]:
+        """
+        Server-sent events of a scan from seq `after` on, until the scan
+        finishes or SCAN_PROGRESS_STREAM_SECONDS pass. Each event's `id` is
+        its seq, so a reconnecting EventSource resumes where it left off.
+        """
+        deadline = time.monotonic() + SCAN_PROGRESS_STREAM_SECONDS
+        last_sent = time.monotonic()
+        yield f"retry: {int(SCAN_PROGRESS_POLL_SECONDS * 2000)}\n\n"
+        while time.monotonic() < deadline:
+            for event in self.events(job_id, after):
+                after = event["seq"]
+                last_sent = time.monotonic()
+                yield f"id: {event['seq']}\nevent: {event['type']}\ndata: {json.dumps(event, default=_json_default)}\n\n"
+                if event["type"] == SCAN_FINISHED:
+                    return
+            if time.monotonic() - last_sent >= SCAN_PROGRESS_HEARTBEAT_SECONDS:
+                last_sent = time.monotonic()
+                yield ": keep-alive\n\n"
+            with self._cond:
+                events = self._jobs.get(job_id)
+                if events and events[-1]["seq"] > after:
+                    # Published since we looked
+                    continue
+                # Running here: woken up by the next event; elsewhere: poll MongoDB
+                self._cond.wait(SCAN_PROGRESS_HEARTBEAT_SECONDS if events is not None else SCAN_PROGRESS_POLL_SECONDS)
+
+    # -- MongoDB mirror --------------------------------------------------
+    def _start_mirror(self) -> None:
+        if self._mirror_thread is not None:
+            return
+        with self._cond:
+            if self._mirror_thread is None:
+                self._mirror_thread = threading.Thread(target=self._mirror_loop, name="scan-progress-mirror",
+                                                       daemon=True)
+                self._mirror_thread.start()
+
+    def _mirror_loop(self) -> None:
+        while True:
+            batch = [self._mirror_queue.get()]
+            # Whatever else piled up goes in the same write
+            while len(batch) < 500:
+                try:
+                    batch.append(self._mirror_queue.get_nowait())
+                except queue.Empty:
+                    break
+            expires_at = _now() + timedelta(days=SCAN_PROGRESS_TTL_DAYS)
+            try:
+                db[SCAN_PROGRESS_COLLECTION].insert_many([{**event, "expires_at": expires_at} for event in batch],
+                                                         ordered=False)
+            except Exception as e:
+                logger.warning(f"Failed to mirror {len(batch)} scan progress events: {str(e)}")
+
+
+class ProgressTracker:
+    """
+    Turns the output of one scout run into progress events, published to
+    a ProgressBuffer: stage_started/stage_finished for the stages scout
+    announces, service_started/service_finished per service fetched,
+    error for each error line, and scan_finished with the per-stage and
+    per-service timings when the run ends.
+
+    scout only logs when it starts fetching a service, so services are
+    finished (with `inferred_end`) when the fetch stage ends.
+    Safe to feed from the stdout and stderr readers at once.
+    """
+
+    def __init__(self, job_id: str, buffer: Optional[ProgressBuffer] = None):
+        self.job_id = job_id
+        self.buffer = buffer or scan_progress
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._stage: Optional[Dict[str, Any]] = None
+        self.stages: List[Dict[str, Any]] = []
+        self.services: Dict[str, Dict[str, Any]] = {}
+        self.errors = 0
+        self.finished = False
+
+    def _emit(self, event_type: str, **fields) -> None:
+        self._seq += 1
+        event = {"job_id": self.job_id, "seq": self._seq, "type": event_type, "time": _now()}
+        event.update(fields)
+        self.buffer.publish(event)
+
+    def _start_stage(self, stage: str, now: datetime) -> None:
+        self._end_stage(now)
+        self._stage = {"stage": stage, "started_at": now, "finished_at": None, "errors": 0}
+        self.stages.append(self._stage)
+        self._emit(STAGE_STARTED, stage=stage)
+
+    def _end_stage(self, now: datetime) -> None:
+        if self._stage is None:
+            return
+        stage, self._stage = self._stage, None
+        if stage["stage"] == "fetch":
+            for name, service in self.services.items():
+                if service["finished_at"] is None:
+                    service["finished_at"] = now
+                    self._emit(SERVICE_FINISHED, stage="fetch", service=name, inferred_end=True,
+                               seconds=(now - service["started_at"]).total_seconds(), errors=service["errors"])
+        stage["finished_at"] = now
+        self._emit(STAGE_FINISHED, stage=stage["stage"], seconds=(now - stage["started_at"]).total_seconds(),
+                   errors=stage["errors"])
+
+    def feed(self, line: str) -> None:
+        parsed = parse_scout_line(line)
+        if parsed is None:
+            return
+        message = parsed["message"].strip()
+        now = _now()
+        with self._lock:
+            if self.finished:
+                return
+            if message in STAGE_MESSAGES:
+                self._start_stage(STAGE_MESSAGES[message], now)
+            elif message.startswith(_REPORT_PREFIXES) and (self._stage is None or self._stage["stage"] != "report"):
+                self._start_stage("report", now)
+
+            service_match = _SERVICE_RE.match(message)
+            if service_match:
+                if self._stage is None or self._stage["stage"] != "fetch":
+                    # Region shards (scout_shards.py) fetch without announcing the stage
+                    self._start_stage("fetch", now)
+                name = service_key(service_match.group("service"))
+                self.services[name] = {"started_at": now, "finished_at": None, "errors": 0}
+                self._emit(SERVICE_STARTED, stage="fetch", service=name)
+
+            if parsed["level"] in ("ERROR", "CRITICAL"):
+                self.errors += 1
+                service = None
+                error_match = _SERVICE_ERROR_RE.match(message)
+                if error_match and service_key(error_match.group("service")) in self.services:
+                    service = service_key(error_match.group("service"))
+                    self.services[service]["errors"] += 1
+                if self._stage is not None:
+                    self._stage["errors"] += 1
+                self._emit(ERROR, stage=self._stage["stage"] if self._stage else None, service=service,
+                           message=message[:500])
+
+    def summary(self) -> Dict[str, Any]:
+        def seconds(span):
+            return (span["finished_at"] - span["started_at"]).total_seconds() if span["finished_at"] else None
+
+        return {
+            "stages": [{"stage": s["stage"], "started_at": s["started_at"], "finished_at": s["finished_at"],
+                        "seconds": seconds(s), "errors": s["errors"]} for s in self.stages],
+            "services": {name: {**s, "seconds": seconds(s)} for name, s in self.services.items()},
+            "errors": self.errors
+        }
+
+    def finish(self, status: str, exit_code: Optional[int] = None) -> None:
+        """Closes the open stage and publishes scan_finished; later lines are ignored."""
+        with self._lock:
+            if self.finished:
+                return
+            self._end_stage(_now())
+            self.finished = True
+            self._emit(SCAN_FINISHED, status=status, exit_code=exit_code, **self.summary())
+
+
+# Create global progress buffer instance
+scan_progress = ProgressBuffer()
@@ -0,0 +1,175 @@
+# scout_inprocess.py
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from report_manager import REPORT_FILE
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set to "1" to also write the results file (new2.js) of in-process scans, so the report is archived
+SCOUT_INPROCESS_ARCHIVE = os.getenv("SCOUT_INPROCESS_ARCHIVE", "0") == "1"
+
+# Provider attributes ScoutSuite leaves out of the results file (ScoutJsonEncoder)
+_EXCLUDED_ATTRIBUTES = ("profile", "credentials", "metadata_path", "services_config")
+
+# Logged through scout's console, so they show up as progress stages (scan_progress.STAGE_MESSAGES)
+BUILD_MESSAGE = "Building the results document"
+INGEST_MESSAGE = "Storing results in MongoDB"
+
+
+# -------------------------------------------------------------------
+# Results document
+# -------------------------------------------------------------------
+def _json_key(key: Any) -> str:
+    if isinstance(key, str):
+        return key
+    if isinstance(key, bool):
+        return "true" if key else "false"
+    return "null" if key is None else str(key)
+
+
+def to_document(value: Any) -> Any:
+    """
+    What json.loads() returns for the results file ScoutSuite would write
+    for `value` (a cloud provider or any part of it), built directly from
+    the objects: provider and service objects become dicts of their
+    attributes minus the ones ScoutJsonEncoder strips, datetimes and other
+    non-JSON values become strings, keys become strings. Unlike the
+    encoder, it doesn't delete attributes from the objects.
+    """
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, dict):
+        return {_json_key(k): to_document(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_document(v) for v in value]
+    if type(value) == datetime:
+        return str(value)
+    try:
+        attributes = vars(value)
+    except TypeError:
+        return str(value)
+    return {k: to_document(v) for k, v in attributes.items() if k not in _EXCLUDED_ATTRIBUTES}
+
+
+def write_results_file(document: Dict[str, Any], report_dir: str) -> str:
+    """Writes the document as the report's new2.js, in the format of scout's results file."""
+    results_path = os.path.join(report_dir, REPORT_FILE)
+    os.makedirs(os.path.dirname(results_path), exist_ok=True)
+    with open(results_path, "w") as f:
+        f.write("scoutsuite_results =\n")
+        json.dump(document, f, separators=(",", ": "), sort_keys=True)
+        f.write("\n")
+    return results_path
+
+
+# -------------------------------------------------------------------
+# In-process scan
+# -------------------------------------------------------------------
+def run_scan(profile: str, report_dir: str, ruleset: str, regions: Optional[List[str]] = None,
+             max_workers: int = 10) -> tuple:
+    """
+    Runs a whole scout scan (fetch, rule engine, filters, post-processing)
+    in this process with ScoutSuite.__main__.run, minus its last step:
+    the cloud provider is kept instead of being saved to the results file
+    and the HTML report. Returns (scout's exit code, provider or None).
+    """
+    import ScoutSuite.__main__ as scout_main
+
+    captured = {}
+
+    class _CapturingReport(scout_main.ScoutReport):
+        def save(self, config, exceptions, force_write=False, debug=False):
+            captured["provider"] = config
+            return ""
+
+    # run() only returns an exit code; its report is where the provider ends up
+    scout_main.ScoutReport = _CapturingReport
+    return_code = scout_main.run(provider="aws", profile=profile, report_dir=report_dir, ruleset=ruleset,
+                                 regions=regions or [], max_workers=max_workers, force_write=True,
+                                 no_browser=True, programmatic_execution=True)
+    return return_code, captured.get("provider")
+
+
+def scan_and_ingest(profile: str, report_dir: str, ruleset: str, account_name: str, report_timestamp: str,
+                    regions: Optional[List[str]] = None, batch_size: Optional[int] = None,
+                    archive: bool = SCOUT_INPROCESS_ARCHIVE, max_workers: int = 10) -> tuple:
+    """
+    Scans the account in this process and feeds the provider's results
+    straight to ingest_report, without the JSON encode, file write, read
+    and decode of the `scout aws` + parse_scoutsuite_file path. The results
+    file is only written when `archive` is set. Returns (exit code, result):
+    the result has ingest_report's fields (or "error" if ingestion failed),
+    "report_path" when archived, and the seconds of each stage in "timings"
+    (scout_seconds, build_seconds, archive_seconds, ingest_seconds).
+    """
+    from ScoutSuite.core.console import print_info
+    from ingest import ingest_report
+
+    timings: Dict[str, float] = {}
+    started = time.perf_counter()
+    return_code, provider = run_scan(profile, report_dir, ruleset, regions, max_workers)
+    timings["scout_seconds"] = round(time.perf_counter() - started, 3)
+    if return_code != 0 or provider is None:
+        return return_code or 1, {"timings": timings}
+
+    stage_started = time.perf_counter()
+    print_info(BUILD_MESSAGE)
+    document = to_document(provider)
+    del provider
+    timings["build_seconds"] = round(time.perf_counter() - stage_started, 3)
+
+    result: Dict[str, Any] = {}
+    if archive:
+        stage_started = time.perf_counter()
+        print_info(f"Saving data to {os.path.join(report_dir, REPORT_FILE)}")
+        result["report_path"] = write_results_file(document, report_dir)
+        timings["archive_seconds"] = round(time.perf_counter() - stage_started, 3)
+
+    stage_started = time.perf_counter()
+    print_info(INGEST_MESSAGE)
+    try:
+        result.update(ingest_report(document, batch_size=batch_size, account_name=account_name,
+                                    report_timestamp=report_timestamp))
+    except Exception as e:
+        logger.error(f"Failed to ingest in-process scan of {account_name}: {str(e)}")
+        result["error"] = str(e)
+    timings["ingest_seconds"] = round(time.perf_counter() - stage_started, 3)
+    result["timings"] = timings
+    return 0, result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    arg_parser = argparse.ArgumentParser(description="Scan an AWS account and ingest it without a results file.")
+    arg_parser.add_argument("--profile", required=True)
+    arg_parser.add_argument("--report-dir", required=True)
+    arg_parser.add_argument("--ruleset", default="default.json")
+    arg_parser.add_argument("--account-name", required=True)
+    arg_parser.add_argument("--report-timestamp", required=True)
+    arg_parser.add_argument("--regions", nargs="+", default=None)
+    arg_parser.add_argument("--batch-size", type=int, default=None)
+    arg_parser.add_argument("--archive", action="store_true", default=SCOUT_INPROCESS_ARCHIVE,
+                            help="also write the results file")
+    arg_parser.add_argument("--max-workers", type=int, default=10)
+    arg_parser.add_argument("--result-file", required=True, help="where the ingest result and timings go (JSON)")
+    args = arg_parser.parse_args(argv)
+
+    return_code, result = scan_and_ingest(args.profile, args.report_dir, args.ruleset, args.account_name,
+                                          args.report_timestamp, args.regions, args.batch_size, args.archive,
+                                          args.max_workers)
+    with open(args.result_file, "w") as f:
+        json.dump(result, f, default=str)
+    logger.info(f"In-process scan timings: {json.dumps(result['timings'])}")
+    return return_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
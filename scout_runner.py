@@ -1,9 +1,15 @@
 import subprocess
 import os
+import sys
+import json
 import logging
+import threading
+import time
 from datetime import datetime
-from contextlib import redirect_stdout, redirect_stderr
 from report_manager import report_manager
+from scan_progress import ProgressTracker
+from scout_shards import SCOUT_REGION_SHARDS
+from scout_inprocess import SCOUT_INPROCESS_ARCHIVE
 from typing import Optional
 
 # Configure logging
@@ -34,7 +40,135 @@ def clear_aws_cached_credentials():
         if os.path.isfile(file_path):
             os.remove(file_path)
 
-def run_scout_suite(account_name, profile_name="default", region=None, timestamp=None, username=None):
+def scout_pid_file(log_name):
+    """Path of the file holding the PID of the scout process of a scan (see run_scout_suite's log_name)."""
+    return os.path.join(SCOUT_LOG_DIR, f"{log_name}.scout_pid")
+
+def _pump_output(stream, log_file, progress):
+    """Copies a scout output pipe to its log file line by line, feeding each line to the progress tracker."""
+    for raw_line in iter(stream.readline, b""):
+        line = raw_line.decode("utf-8", errors="replace")
+        log_file.write(line)
+        log_file.flush()
+        try:
+            progress.feed(line)
+        except Exception as e:
+            logger.warning(f"Failed to track scan progress: {str(e)}")
+    stream.close()
+
+class ScoutScanError(Exception):
+    """Raised when the scout process exits with a non-zero return code."""
+
+    def __init__(self, message, return_code):
+        super().__init__(message)
+        self.return_code = return_code
+
+def _stage_seconds(progress):
+    """Seconds spent in each stage of a finished scan, from its progress tracker."""
+    stages = {}
+    for stage in progress.summary()["stages"]:
+        if stage["seconds"] is not None:
+            stages[stage["stage"]] = round(stages.get(stage["stage"], 0) + stage["seconds"], 3)
+    return stages
+
+def _run_scan_process(cmd, account_name, profile_name, log_name, on_start=None, timings=None):
+    """
+    Runs a scan command (scout or one of its wrappers) to completion with its
+    output in the scan's logs and progress events, and its state in the
+    status and PID files. Raises ScoutScanError if it exits non-zero.
+    """
+    stdout_log_path = os.path.join(SCOUT_LOG_DIR, f"{log_name}.out.log.txt")
+    stderr_log_path = os.path.join(SCOUT_LOG_DIR, f"{log_name}.err.log.txt")
+    status_log_path = os.path.join(SCOUT_LOG_DIR, f"{log_name}.status.txt")
+    pid_file_path = scout_pid_file(log_name)
+
+    progress = ProgressTracker(log_name)
+    started = time.perf_counter()
+    try:
+        # Create log directory if it doesn't exist
+        os.makedirs(SCOUT_LOG_DIR, exist_ok=True)
+
+        # Open stdout/stderr logs in append mode
+        with open(stdout_log_path, "a+") as scout_stdout, open(stderr_log_path, "a+") as scout_stderr:
+            # Note which scan the following scout output belongs to. This writes to the
+            # log file directly: redirect_stdout would swap sys.stdout for the whole
+            # process, which breaks when several scans run in threads.
+            scout_stdout.write(f"Starting Scout scan for account '{account_name}' using profile '{profile_name}'\n")
+            scout_stdout.write(f"Running command: {' '.join(cmd)}\n")
+            scout_stdout.flush()
+            logger.info(f"Starting Scout scan for account '{account_name}' using profile '{profile_name}'")
+            logger.info(f"Running command: {' '.join(cmd)}")
+
+            # Write initial status and PID
+            with open(status_log_path, "w+") as status_file:
+                status_file.write(f"running {account_name} {profile_name}")
+
+            # Own process group, so stopping a scan (see orchestrator.terminate_scout)
+            # also stops anything scout started
+            scout_process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                start_new_session=True
+            )
+            with open(pid_file_path, "w") as pid_file:
+                pid_file.write(str(scout_process.pid))
+            if on_start:
+                on_start(scout_process.pid)
+
+            # Scout's output still goes to the logs, and becomes progress events on the way
+            # (GET /scout/progress/<job_id>)
+            pumps = [
+                threading.Thread(target=_pump_output, args=(scout_process.stdout, scout_stdout, progress), daemon=True),
+                threading.Thread(target=_pump_output, args=(scout_process.stderr, scout_stderr, progress), daemon=True)
+            ]
+            for pump in pumps:
+                pump.start()
+
+            # Wait for the Scout process to finish
+            try:
+                scout_process.wait()
+                for pump in pumps:
+                    pump.join()
+            finally:
+                # A stale PID file could point at an unrelated process later
+                if scout_process.poll() is not None and os.path.exists(pid_file_path):
+                    os.remove(pid_file_path)
+            return_code = scout_process.poll()
+
+            if return_code == 0:
+                # Success
+                with open(status_log_path, "w") as status_file:
+                    status_file.write("completed")
+                progress.finish("completed", return_code)
+                logger.info("Scout scan completed successfully")
+            elif return_code < 0:
+                # Negative return code -> forcibly stopped
+                with open(status_log_path, "w") as status_file:
+                    status_file.write("stopped")
+                progress.finish("stopped", return_code)
+                logger.warning(f"Scout scan was stopped (return code {return_code})")
+                raise ScoutScanError("Scout scan was stopped", return_code)
+            else:
+                # Error
+                with open(status_log_path, "w") as status_file:
+                    status_file.write("error")
+                progress.finish("error", return_code)
+                logs = _get_last_lines(stderr_log_path, 20)
+                logger.error(f"Scout scan failed with return code {return_code}")
+                logger.error(f"Last 20 lines of error log:\n{logs}")
+                raise ScoutScanError(f"Scout scan failed: {logs}", return_code)
+    except Exception:
+        # e.g. scout couldn't be started; a no-op once the run was reported
+        progress.finish("error")
+        raise
+    finally:
+        if timings is not None:
+            timings["scan_seconds"] = round(time.perf_counter() - started, 3)
+            timings["stages"] = _stage_seconds(progress)
+
+def run_scout_suite(account_name, profile_name="default", region=None, timestamp=None, username=None,
+                    job_id=None, on_start=None, shards=SCOUT_REGION_SHARDS, timings=None):
     """
     Run Scout Suite scan and return path to results file
     
@@ -44,15 +178,17 @@ def run_scout_suite(account_name, profile_name="default", region=None, timestamp
         region: AWS region to scan
         timestamp: Optional timestamp for report directory
         username: Username of whoever initiates this scan
+        job_id: Optional scan job ID; log/status/PID files are named after it
+                instead of the username so concurrent scans don't collide
+        on_start: Optional callback called with the scout process PID
+        shards: Fetch the regions in this many parallel processes (scout_shards.py)
+                instead of one scout process; 0 or 1 doesn't shard
+        timings: Optional dict that gets the scan's wall-clock seconds ("scan_seconds")
+                 and the seconds of each scout stage ("stages")
     """
     # Get report directory path
     report_dir = report_manager.get_report_path(account_name, timestamp)
-
-    # Prepare paths for logs/status
-    stdout_log_path = os.path.join(SCOUT_LOG_DIR, f"{username or 'scout'}.out.log.txt")
-    stderr_log_path = os.path.join(SCOUT_LOG_DIR, f"{username or 'scout'}.err.log.txt")
-    status_log_path = os.path.join(SCOUT_LOG_DIR, f"{username or 'scout'}.status.txt")
-    pid_file_path = os.path.join(SCOUT_LOG_DIR, f"{username or 'scout'}.scout_pid")
+    log_name = job_id or username or 'scout'
 
     # Build Scout Suite command
     cmd = [
@@ -68,46 +204,25 @@ def run_scout_suite(account_name, profile_name="default", region=None, timestamp
     if region:
         cmd.extend(["--region", region])
 
-    try:
-        # Create log directory if it doesn't exist
-        os.makedirs(SCOUT_LOG_DIR, exist_ok=True)
+    if shards and shards > 1:
+        # Same report directory and results file, produced by region shards
+        cmd = [
+            sys.executable,
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "scout_shards.py"),
+            "scan",
+            "--profile", account_name,
+            "--report-dir", report_dir,
+            "--ruleset", profile_name,
+            "--shards", str(shards)
+        ]
+        if region:
+            cmd.extend(["--regions", region])
+        previous_report = report_manager.get_latest_report(account_name)
+        if previous_report:
+            cmd.extend(["--weights-from", previous_report])
 
-        # Open stdout/stderr logs in append mode
-        with open(stdout_log_path, "a+") as scout_stdout, open(stderr_log_path, "a+") as scout_stderr:
-            # Redirect this function's print statements to the log files
-            with redirect_stdout(scout_stdout), redirect_stderr(scout_stderr):
-                logger.info(f"Starting Scout scan for account '{account_name}' using profile '{profile_name}'")
-                logger.info(f"Running command: {' '.join(cmd)}")
-
-                # Write initial status and PID
-                with open(status_log_path, "w+") as status_file:
-                    status_file.write(f"running {account_name} {profile_name}")
-
-                scout_process = subprocess.Popen(
-                    cmd,
-                    stdout=scout_stdout,
-                    stderr=scout_stderr
-                )
-                with open(pid_file_path, "w") as pid_file:
-                    pid_file.write(str(scout_process.pid))
-
-                # Wait for the Scout process to finish
-                scout_process.communicate()
-                return_code = scout_process.poll()
-
-                if return_code == 0:
-                    # Success
-                    with open(status_log_path, "w") as status_file:
-                        status_file.write("completed")
-                    logger.info("Scout scan completed successfully")
-                else:
-                    # Error
-                    with open(status_log_path, "w") as status_file:
-                        status_file.write("error")
-                    logs = _get_last_lines(stderr_log_path, 20)
-                    logger.error(f"Scout scan failed with return code {return_code}")
-                    logger.error(f"Last 20 lines of error log:\n{logs}")
-                    raise Exception(f"Scout scan failed: {logs}")
+    try:
+        _run_scan_process(cmd, account_name, profile_name, log_name, on_start, timings)
 
         # Scout Suite typically creates a 'scoutsuite-results' directory
         results_file = os.path.join(report_dir, "scoutsuite-results", "new2.js")
@@ -115,6 +230,8 @@ def run_scout_suite(account_name, profile_name="default", region=None, timestamp
         if not os.path.exists(results_file):
             raise FileNotFoundError(f"Scout Suite results file not found at {results_file}")
 
+        report_manager.register_report(account_name, os.path.basename(report_dir), results_file)
+
         return results_file
 
     except Exception as e:
@@ -122,4 +239,66 @@ def run_scout_suite(account_name, profile_name="default", region=None, timestamp
         raise
     finally:
         # Clear cached AWS credentials
-        clear_aws_cached_credentials() 
\ No newline at end of file
+        clear_aws_cached_credentials() 
+
+def run_scout_in_process(account_name, profile_name="default", region=None, timestamp=None, username=None,
+                         job_id=None, on_start=None, batch_size=None, archive=SCOUT_INPROCESS_ARCHIVE, timings=None):
+    """
+    Run a Scout Suite scan through ScoutSuite's Python API in a worker
+    process (scout_inprocess.py) that ingests the results itself, and
+    return ingest_report's result. No results file is written unless
+    `archive` is set; the archived report is catalogued like a scout one.
+
+    Arguments are those of run_scout_suite, plus batch_size (bulk write
+    batch size) and archive. `timings` also gets the seconds the worker
+    spent in scout, building the results document, archiving and ingesting. Raises ScoutScanError if the scan
+    fails and RuntimeError if only the ingestion does.
+    """
+    report_dir = report_manager.get_report_path(account_name, timestamp)
+    report_timestamp = os.path.basename(report_dir)
+    log_name = job_id or username or 'scout'
+    result_path = os.path.join(SCOUT_LOG_DIR, f"{log_name}.result.json")
+
+    cmd = [
+        sys.executable,
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "scout_inprocess.py"),
+        "--profile", account_name,
+        "--report-dir", report_dir,
+        "--ruleset", profile_name,
+        "--account-name", account_name,
+        "--report-timestamp", report_timestamp,
+        "--result-file", result_path
+    ]
+    if region:
+        cmd.extend(["--regions", region])
+    if batch_size:
+        cmd.extend(["--batch-size", str(batch_size)])
+    if archive:
+        cmd.append("--archive")
+
+    try:
+        _run_scan_process(cmd, account_name, profile_name, log_name, on_start, timings)
+
+        with open(result_path) as f:
+            result = json.load(f)
+        os.remove(result_path)
+        if timings is not None:
+            timings.update(result.get("timings", {}))
+
+        if result.get("report_path"):
+            report_manager.register_report(account_name, report_timestamp, result["report_path"])
+            if "error" in result:
+                report_manager.mark_failed(account_name, report_timestamp, result["error"])
+            else:
+                report_manager.mark_ingested(account_name, report_timestamp, result)
+        if "error" in result:
+            raise RuntimeError(f"Ingestion of the in-process scan failed: {result['error']}")
+
+        return result
+
+    except Exception as e:
+        logger.error(f"Error running Scout Suite in process: {str(e)}")
+        raise
+    finally:
+        # Clear cached AWS credentials
+        clear_aws_cached_credentials()
\ No newline at end of file
@@ -0,0 +1,305 @@
+# scout_shards.py
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional
+
+from parser import ScoutSuiteStreamParser
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Number of region shards (parallel fetch processes) per scan; 0 runs a single scout process
+SCOUT_REGION_SHARDS = int(os.getenv("SCOUT_REGION_SHARDS", "0"))
+# Services fetched once for the whole account, in a shard of their own, instead of per region shard
+SCOUT_GLOBAL_SERVICES = ["iam", "s3", "route53", "cloudfront"]
+
+SHARDS_DIR = "shards"
+SHARDS_SUMMARY_FILE = "shards.json"
+
+
+# -------------------------------------------------------------------
+# Planning
+# -------------------------------------------------------------------
+def available_regions(profile: str) -> List[str]:
+    """Every region of the profile's partition, as scout would scan without --regions."""
+    import boto3
+
+    session = boto3.session.Session(profile_name=profile)
+    partition = session.get_partition_for_region(session.region_name or "us-east-1")
+    return session.get_available_regions("ec2", partition)
+
+
+def region_weights(report_path: str) -> Dict[str, int]:
+    """
+    Estimates how long each region takes to fetch from a previous report
+    of the account: one unit per service present in the region (its list
+    calls) plus one per resource found there. Streams the report, one
+    service section at a time.
+    """
+    weights: Dict[str, int] = {}
+    for key, section in ScoutSuiteStreamParser(report_path).iter_sections():
+        if not key.startswith("services.") or not isinstance(section, dict):
+            continue
+        if key[len("services."):] in SCOUT_GLOBAL_SERVICES:
+            continue
+        for region, region_data in (section.get("regions") or {}).items():
+            resources = sum(v for k, v in region_data.items() if k.endswith("_count") and isinstance(v, int))
+            weights[region] = weights.get(region, 0) + 1 + resources
+    return weights
+
+
+def plan_shards(regions: Iterable[str], shards: int, weights: Optional[Dict[str, int]] = None) -> List[List[str]]:
+    """
+    Splits regions into at most `shards` groups of similar total weight
+    (largest first, each to the lightest group), so one heavy region
+    doesn't end up sharing a process with other heavy ones. Regions
+    without a weight count as the average one.
+    """
+    regions = list(dict.fromkeys(regions))
+    weights = weights or {}
+    known = [weights[r] for r in regions if r in weights]
+    default = (sum(known) / len(known)) if known else 1
+    groups: List[List[str]] = [[] for _ in range(max(1, min(shards, len(regions))))]
+    loads = [0.0] * len(groups)
+    for region in sorted(regions, key=lambda r: weights.get(r, default), reverse=True):
+        lightest = loads.index(min(loads))
+        groups[lightest].append(region)
+        loads[lightest] += weights.get(region, default)
+    return [group for group in groups if group]
+
+
+# -------------------------------------------------------------------
+# Fetching one shard (runs in its own process)
+# -------------------------------------------------------------------
+def fetch_shard(profile: str, output_path: str, regions: Optional[List[str]] = None,
+                services: Optional[List[str]] = None, skipped_services: Optional[List[str]] = None,
+                max_workers: int = 10) -> int:
+    """
+    Fetches the given services/regions with ScoutSuite's provider, like the
+    first stage of `scout aws`, and writes the raw (not yet processed)
+    provider config as JSON. Returns scout's exit code conventions.
+    """
+    from asyncio_throttle import Throttler
+    from ScoutSuite.core.console import set_logger_configuration, print_exception
+    from ScoutSuite.output.result_encoder import ScoutResultEncoder
+    from ScoutSuite.providers import get_provider
+    from ScoutSuite.providers.base.authentication_strategy_factory import get_authentication_strategy
+
+    set_logger_configuration(False, False, None)
+    try:
+        credentials = get_authentication_strategy("aws").authenticate(profile=profile)
+        if not credentials:
+            return 101
+    except Exception as e:
+        print_exception(f"Authentication failure: {e}")
+        return 101
+    cloud_provider = get_provider(provider="aws", profile=profile, services=services or [],
+                                  skipped_services=skipped_services or [], credentials=credentials)
+
+    # Same loop setup as ScoutSuite.__main__.run
+    loop = asyncio.new_event_loop()
+    loop.throttler = Throttler(rate_limit=999999, period=1)
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=max_workers))
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(cloud_provider.fetch(regions=regions or []))
+    except Exception as e:
+        print_exception(f"Unhandled exception thrown while gathering data: {e}")
+        return 104
+    finally:
+        loop.close()
+
+    with open(output_path + ".tmp", "w") as f:
+        json.dump(ScoutResultEncoder.to_dict(cloud_provider), f)
+    os.replace(output_path + ".tmp", output_path)
+    return 0
+
+
+# -------------------------------------------------------------------
+# Merging
+# -------------------------------------------------------------------
+def _set_region_counts(service_config: Dict[str, Any]) -> None:
+    # Service-level counts are the sums of the per-region ones (see ScoutSuite's Regions._set_counts)
+    regions = service_config["regions"]
+    service_config["regions_count"] = len(regions)
+    for key in list(service_config):
+        if key.endswith("_count") and key != "regions_count":
+            service_config[key] = sum(region.get(key, 0) for region in regions.values())
+
+
+def _set_cloudtrail_global_events(cloudtrail: Dict[str, Any]) -> None:
+    # CloudTrail.finalize looks at the trails of all regions at once
+    global_events_logging = [
+        trail_id
+        for region, region_data in cloudtrail["regions"].items()
+        for trail_id, trail in region_data.get("trails", {}).items()
+        if trail.get("HomeRegion", region) == region and trail.get("IncludeGlobalServiceEvents") and trail.get("IsLogging")
+    ]
+    cloudtrail["IncludeGlobalServiceEvents"] = len(global_events_logging) > 0
+    cloudtrail["DuplicatedGlobalServiceEvents"] = len(global_events_logging) > 1
+
+
+def merge_shards(shards: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Merges raw provider configs fetched for disjoint regions (and the
+    global-services shard) into the config a single unsharded fetch would
+    have produced: each shard contributes the services it fetched, regional
+    services get the union of the shards' regions, and counts or flags
+    computed across regions are recomputed. The first shard is updated in
+    place and returned.
+    """
+    merged = shards[0]
+    for shard in shards[1:]:
+        for service in shard["service_list"]:
+            config = shard["services"].get(service)
+            current = merged["services"].get(service)
+            if service in merged["service_list"] and isinstance(current, dict) and "regions" in current \
+                    and isinstance(config, dict) and "regions" in config:
+                current["regions"].update(config["regions"])
+            else:
+                merged["services"][service] = config
+            if service not in merged["service_list"]:
+                merged["service_list"].append(service)
+        for key in ("sg_map", "subnet_map"):
+            merged.setdefault(key, {}).update(shard.get(key) or {})
+
+    for service in merged["service_list"]:
+        config = merged["services"].get(service)
+        if isinstance(config, dict) and "regions" in config:
+            _set_region_counts(config)
+    if isinstance(merged["services"].get("cloudtrail"), dict) and "regions" in merged["services"]["cloudtrail"]:
+        _set_cloudtrail_global_events(merged["services"]["cloudtrail"])
+    return merged
+
+
+# -------------------------------------------------------------------
+# Sharded scan
+# -------------------------------------------------------------------
+def _fetch_command(profile: str, output_path: str, regions: Optional[List[str]], max_workers: int,
+                   services: Optional[List[str]] = None, skipped_services: Optional[List[str]] = None) -> List[str]:
+    cmd = [sys.executable, os.path.abspath(__file__), "fetch", "--profile", profile, "--output", output_path,
+           "--max-workers", str(max_workers)]
+    if regions:
+        cmd += ["--regions", *regions]
+    if services:
+        cmd += ["--services", *services]
+    if skipped_services:
+        cmd += ["--skip", *skipped_services]
+    return cmd
+
+
+def scan(profile: str, report_dir: str, ruleset: str, regions: Optional[List[str]] = None,
+         shards: int = SCOUT_REGION_SHARDS, weights_from: Optional[str] = None, max_workers: int = 10) -> int:
+    """
+    Runs `scout aws` for one account as parallel fetch processes, one per
+    group of regions plus one for the global services (fetched once, not
+    per shard), merges their configs into the report's results file, then
+    runs `scout aws --local` on it so pre-processing, the rule engine and
+    the report run once on the whole account. Returns the exit code of the
+    first failing stage, or scout's. Stage timings go to shards.json in
+    the report directory.
+    """
+    started = time.perf_counter()
+    scan_regions = regions or available_regions(profile)
+    weights = region_weights(weights_from) if weights_from else None
+    groups = plan_shards(scan_regions, max(1, shards), weights)
+    shards_dir = os.path.join(report_dir, SHARDS_DIR)
+    os.makedirs(shards_dir, exist_ok=True)
+
+    # The global shard scans the requested regions too: S3 only lists buckets in those
+    commands = [("global", _fetch_command(profile, os.path.join(shards_dir, "global.json"), regions, max_workers,
+                                          services=SCOUT_GLOBAL_SERVICES))]
+    for n, group in enumerate(groups):
+        commands.append((f"regions-{n}", _fetch_command(profile, os.path.join(shards_dir, f"regions-{n}.json"),
+                                                        group, max_workers, skipped_services=SCOUT_GLOBAL_SERVICES)))
+    logger.info(f"Fetching {len(scan_regions)} regions in {len(groups)} shards plus global services: {groups}")
+
+    processes = {name: (subprocess.Popen(cmd), time.perf_counter()) for name, cmd in commands}
+    timings: Dict[str, Any] = {"shards": {}}
+    failed = 0
+    for name, (process, shard_started) in processes.items():
+        return_code = process.wait()
+        timings["shards"][name] = round(time.perf_counter() - shard_started, 3)
+        if return_code != 0 and not failed:
+            logger.error(f"Fetching shard {name} failed with return code {return_code}")
+            failed = return_code if return_code > 0 else 1
+            for other, _ in processes.values():
+                if other.poll() is None:
+                    other.terminate()
+    if failed:
+        return failed
+    timings["fetch_seconds"] = round(time.perf_counter() - started, 3)
+
+    merge_started = time.perf_counter()
+    shard_configs = []
+    for name, _ in commands:
+        with open(os.path.join(shards_dir, f"{name}.json")) as f:
+            shard_configs.append(json.load(f))
+    merged = merge_shards(shard_configs)
+    del shard_configs
+
+    from ScoutSuite.output.utils import get_filename
+    # Named as `scout aws --profile <profile>` names it, so --local picks it up
+    results_path, first_line = get_filename("RESULTS", f"aws-{profile}".replace("/", "_").replace("\\", "_"),
+                                            report_dir)
+    os.makedirs(os.path.dirname(results_path), exist_ok=True)
+    with open(results_path, "w") as f:
+        f.write(first_line + "\n")
+        json.dump(merged, f)
+    del merged
+    for name, _ in commands:
+        os.remove(os.path.join(shards_dir, f"{name}.json"))
+    os.rmdir(shards_dir)
+    timings["merge_seconds"] = round(time.perf_counter() - merge_started, 3)
+
+    analysis_started = time.perf_counter()
+    cmd = ["scout", "aws", "--profile", profile, "--local", "--force", "--no-browser",
+           "--report-dir", report_dir, "--ruleset", ruleset]
+    if regions:
+        cmd += ["--regions", *regions]
+    return_code = subprocess.call(cmd)
+    timings["analysis_seconds"] = round(time.perf_counter() - analysis_started, 3)
+    timings["total_seconds"] = round(time.perf_counter() - started, 3)
+
+    with open(os.path.join(report_dir, SHARDS_SUMMARY_FILE), "w") as f:
+        json.dump({"regions": groups, "weights": weights, "timings": timings}, f, indent=2)
+    logger.info(f"Sharded scan timings: {json.dumps(timings)}")
+    return return_code
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    arg_parser = argparse.ArgumentParser(description="Scan an AWS account as parallel region shards.")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    scan_parser = commands.add_parser("scan", help="fetch region shards in parallel, merge, analyze once")
+    scan_parser.add_argument("--profile", required=True)
+    scan_parser.add_argument("--report-dir", required=True)
+    scan_parser.add_argument("--ruleset", default="default.json")
+    scan_parser.add_argument("--regions", nargs="+", default=None, help="defaults to all regions")
+    scan_parser.add_argument("--shards", type=int, default=SCOUT_REGION_SHARDS or 4)
+    scan_parser.add_argument("--weights-from", default=None, help="previous report to balance the shards with")
+    scan_parser.add_argument("--max-workers", type=int, default=10)
+    fetch_parser = commands.add_parser("fetch", help="fetch one shard's raw config (used by scan)")
+    fetch_parser.add_argument("--profile", required=True)
+    fetch_parser.add_argument("--output", required=True)
+    fetch_parser.add_argument("--regions", nargs="+", default=None)
+    fetch_parser.add_argument("--services", nargs="+", default=None)
+    fetch_parser.add_argument("--skip", nargs="+", default=None)
+    fetch_parser.add_argument("--max-workers", type=int, default=10)
+    args = arg_parser.parse_args(argv)
+
+    if args.command == "fetch":
+        return fetch_shard(args.profile, args.output, args.regions, args.services, args.skip, args.max_workers)
+    return scan(args.profile, args.report_dir, args.ruleset, args.regions, args.shards, args.weights_from,
+                args.max_workers)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
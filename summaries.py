@@ -0,0 +1,160 @@
+# summaries.py
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from mongo_connect import db
+from parser import iter_resources
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ACCOUNT_SUMMARIES_COLLECTION = "account_summaries"
+
+# Resources looked at for the derived counts
+_DERIVED_PATHS = [
+    "services.s3.buckets",
+    "services.iam.users",
+    "services.ec2.regions.id.vpcs.id.instances",
+]
+
+
+def _is_running(instance: Dict[str, Any]) -> bool:
+    state = instance.get("state") or instance.get("State")
+    if isinstance(state, dict):
+        state = state.get("Name")
+    return state == "running"
+
+
+def _is_public(bucket: Dict[str, Any]) -> bool:
+    """Same rule as the S3 page: public unless both ACLs and policies are blocked."""
+    if bucket.get("public_access"):
+        return True
+    block = bucket.get("public_access_block_configuration") or {}
+    return not (block.get("BlockPublicAcls") and block.get("BlockPublicPolicy"))
+
+
+def _has_mfa(user: Dict[str, Any]) -> bool:
+    return bool(user.get("mfa_devices") or user.get("MFADevices"))
+
+
+def _derived_counts(data: Dict[str, Any]) -> Dict[str, int]:
+    counts = {"running_ec2_instances": 0, "public_s3_buckets": 0, "mfa_iam_users": 0}
+    for event in iter_resources(data, _DERIVED_PATHS):
+        resource = event.resource
+        if not isinstance(resource, dict):
+            continue
+        container = event.resource_path[-2]
+        if event.service == "ec2" and container == "instances" and _is_running(resource):
+            counts["running_ec2_instances"] += 1
+        elif event.service == "s3" and container == "buckets" and _is_public(resource):
+            counts["public_s3_buckets"] += 1
+        elif event.service == "iam" and container == "users" and _has_mfa(resource):
+            counts["mfa_iam_users"] += 1
+    return counts
+
+
+def _findings_counts(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Rules with flagged items, by level and by service, plus the flagged item total."""
+    by_level: Dict[str, int] = {}
+    by_service: Dict[str, Dict[str, int]] = {}
+    flagged_items = 0
+    for service, service_data in (data.get("services") or {}).items():
+        if not isinstance(service_data, dict):
+            continue
+        for finding in (service_data.get("findings") or {}).values():
+            flagged = finding.get("flagged_items") or 0
+            if not flagged:
+                continue
+            level = finding.get("level") or "unknown"
+            by_level[level] = by_level.get(level, 0) + 1
+            levels = by_service.setdefault(service, {})
+            levels[level] = levels.get(level, 0) + 1
+            flagged_items += flagged
+    return {
+        "total": sum(by_level.values()),
+        "flagged_items": flagged_items,
+        "by_level": by_level,
+        "by_service": by_service
+    }
+
+
+class SummaryCounter:
+    """
+    Findings and derived counts of a report, accumulated one service
+    section at a time (the report may be streaming in).
+    """
+
+    def __init__(self):
+        self.findings: Dict[str, Any] = {"total": 0, "flagged_items": 0, "by_level": {}, "by_service": {}}
+        self.derived: Dict[str, int] = {"running_ec2_instances": 0, "public_s3_buckets": 0, "mfa_iam_users": 0}
+
+    def add_service(self, service: str, service_data: Any) -> None:
+        partial = {"services": {service: service_data}}
+        for key, value in _derived_counts(partial).items():
+            self.derived[key] += value
+        findings = _findings_counts(partial)
+        self.findings["total"] += findings["total"]
+        self.findings["flagged_items"] += findings["flagged_items"]
+        for level, count in findings["by_level"].items():
+            self.findings["by_level"][level] = self.findings["by_level"].get(level, 0) + count
+        self.findings["by_service"].update(findings["by_service"])
+
+
+def store_account_summary(data: Dict[str, Any], account_id: str, scan_id: ObjectId, scan_time: datetime,
+                          collections: Dict[str, Dict[str, int]], account_name: Optional[str] = None,
+                          report_timestamp: Optional[str] = None,
+                          counter: Optional[SummaryCounter] = None) -> Dict[str, Any]:
+    """
+    Writes the 'account_summaries' document of one ingested scan:
+    resource counts per collection (from the ingest counts), findings
+    counts and derived counts, so dashboards read one small document.
+    The latter two come from `counter` when the report was streamed
+    (`data` is then unused), else from `data`.
+    """
+    if counter is None:
+        counter = SummaryCounter()
+        for service, service_data in (data.get("services") or {}).items():
+            counter.add_service(service, service_data)
+    summary = {
+        "account_id": account_id,
+        "scan_id": scan_id,
+        "account_name": account_name,
+        "report_timestamp": report_timestamp,
+        "scan_time": scan_time,
+        "resource_counts": {
+            collection: counts.get("added", 0) + counts.get("changed", 0) + counts.get("unchanged", 0)
+            for collection, counts in collections.items()
+        },
+        "findings": counter.findings,
+        "derived": counter.derived,
+        "created_at": datetime.now(timezone.utc)
+    }
+    db[ACCOUNT_SUMMARIES_COLLECTION].replace_one({"scan_id": scan_id}, summary, upsert=True)
+    return summary
+
+
+def latest_summaries() -> List[Dict[str, Any]]:
+    """The most recent summary of every account, newest first."""
+    return list(db[ACCOUNT_SUMMARIES_COLLECTION].aggregate([
+        {"$sort": {"account_id": 1, "scan_time": -1}},
+        {"$group": {"_id": "$account_id", "summary": {"$first": "$$ROOT"}}},
+        {"$replaceRoot": {"newRoot": "$summary"}},
+        {"$sort": {"scan_time": -1}},
+        {"$project": {"_id": False}}
+    ]))
+
+
+def recent_summaries(limit: int = 5) -> List[Dict[str, Any]]:
+    """The summaries of the last `limit` scans, across accounts."""
+    return list(db[ACCOUNT_SUMMARIES_COLLECTION].find({}, {"_id": False}).sort("scan_time", -1).limit(limit))
+
+
+def find_summary(account_id: str, scan_id: Optional[ObjectId] = None) -> Optional[Dict[str, Any]]:
+    """The summary of one scan, or the latest one of the account."""
+    if scan_id is not None:
+        return db[ACCOUNT_SUMMARIES_COLLECTION].find_one({"scan_id": scan_id}, {"_id": False})
+    return db[ACCOUNT_SUMMARIES_COLLECTION].find_one(
+        {"account_id": account_id}, {"_id": False}, sort=[("scan_time", -1)])
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import mongomock
+import pytest
+from pymongo.errors import OperationFailure
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from mongo_connect import db_connection  # noqa: E402
+
+
+@pytest.fixture
+def mongo_db(monkeypatch):
+    """An in-memory database behind mongo_connect.db, fresh for each test."""
+    client = mongomock.MongoClient()
+    create_collection = mongomock.database.Database.create_collection
+
+    def create_plain_collection(self, name, **options):
+        # Like a server without time-series collections; callers fall back to plain ones
+        if options:
+            raise OperationFailure(f"Unsupported collection options: {sorted(options)}")
+        return create_collection(self, name)
+
+    monkeypatch.setattr(mongomock.database.Database, "create_collection", create_plain_collection)
+    monkeypatch.setattr(db_connection, "_client", client)
+    monkeypatch.setattr(db_connection, "_db", client["test"])
+    return client["test"]
@@ -0,0 +1,132 @@
+import io
+import json
+
+import pytest
+
+from bulk_writer import ChangeDetectingWriter, content_hash
+from ingest import ingest_report_stream
+
+
+def test_content_hash_ignores_key_order():
+    assert content_hash({"a": 1, "b": [1, 2]}) == content_hash({"b": [1, 2], "a": 1})
+    assert content_hash({"a": 1}) != content_hash({"a": 2})
+
+
+def _write(db, docs, **kwargs):
+    with ChangeDetectingWriter(db, "acct", max_workers=1, **kwargs) as writer:
+        for id, doc in docs.items():
+            writer.upsert("things", {"account_id": "acct", "id": id}, {"account_id": "acct", "id": id, **doc})
+    return writer.stats.get("things", {})
+
+
+def test_counts_added_changed_removed_unchanged(mongo_db):
+    assert _write(mongo_db, {"a": {"v": 1}, "b": {"v": 1}, "c": {"v": 1}}) == \
+        {"added": 3, "changed": 0, "removed": 0, "unchanged": 0}
+
+    assert _write(mongo_db, {"a": {"v": 1}, "b": {"v": 2}, "d": {"v": 1}}) == \
+        {"added": 1, "changed": 1, "removed": 1, "unchanged": 1}
+    assert sorted(doc["id"] for doc in mongo_db["things"].find()) == ["a", "b", "d"]
+    assert mongo_db["things"].find_one({"id": "b"})["v"] == 2
+
+
+def test_unchanged_resources_are_not_rewritten(mongo_db):
+    _write(mongo_db, {"a": {"v": 1}})
+    mongo_db["things"].update_one({"id": "a"}, {"$set": {"touched": True}})
+
+    _write(mongo_db, {"a": {"v": 1}})
+
+    assert mongo_db["things"].find_one({"id": "a"})["touched"] is True
+
+
+def test_mark_mode_flags_and_revives(mongo_db):
+    _write(mongo_db, {"a": {"v": 1}, "b": {"v": 1}}, removal_mode="mark")
+
+    assert _write(mongo_db, {"a": {"v": 1}}, removal_mode="mark")["removed"] == 1
+    assert mongo_db["things"].find_one({"id": "b"})["removed"] is True
+
+    assert _write(mongo_db, {"a": {"v": 1}, "b": {"v": 1}}, removal_mode="mark")["added"] == 1
+    assert "removed" not in mongo_db["things"].find_one({"id": "b"})
+
+
+def test_collections_without_resources_are_emptied(mongo_db):
+    _write(mongo_db, {"a": {"v": 1}})
+
+    with ChangeDetectingWriter(mongo_db, "acct", max_workers=1, collections=["things"]) as writer:
+        pass
+
+    assert writer.stats["things"]["removed"] == 1
+    assert mongo_db["things"].count_documents({}) == 0
+
+
+def _report(instances, users, run_parameters=None):
+    regions = {}
+    for region, instance_id in instances:
+        vpcs = regions.setdefault(region, {"vpcs": {"vpc-1": {"instances": {}}}})["vpcs"]
+        vpcs["vpc-1"]["instances"][instance_id] = {"name": instance_id}
+    last_run = {"time": "2024-02-15 12:34:56+0000"}
+    if run_parameters is not None:
+        last_run["run_parameters"] = {"services": [], "skipped_services": [], "regions": [],
+                                      "excluded_regions": [], **run_parameters}
+    return "scoutsuite_results = " + json.dumps({
+        "account_id": "111122223333",
+        "last_run": last_run,
+        "services": {"ec2": {"regions": regions}, "iam": {"users": {user: {"name": user} for user in users}}}
+    })
+
+
+def _ingest(report):
+    return ingest_report_stream(io.StringIO(report))
+
+
+def _instances(db):
+    return sorted((doc["region"], doc["instance_id"]) for doc in db["ec2_instances"].find())
+
+
+FULL = [("us-east-1", "i-1"), ("us-east-1", "i-2"), ("eu-west-1", "i-3")]
+
+
+@pytest.mark.parametrize("run_parameters", [{"regions": ["us-east-1"]}, {"excluded_regions": ["eu-west-1"]}])
+def test_region_limited_scan_only_removes_from_its_regions(mongo_db, run_parameters):
+    _ingest(_report(FULL, ["alice"]))
+
+    result = _ingest(_report([("us-east-1", "i-1")], ["alice"], run_parameters))
+
+    assert _instances(mongo_db) == [("eu-west-1", "i-3"), ("us-east-1", "i-1")]
+    assert result["collections"]["ec2_instances"]["removed"] == 1
+    assert mongo_db["iam_users"].count_documents({}) == 1
+
+
+def test_service_limited_scan_leaves_other_services(mongo_db):
+    _ingest(_report(FULL, ["alice", "bob"]))
+
+    _ingest(_report([("us-east-1", "i-1")], [], {"services": ["ec2"]}))
+
+    assert _instances(mongo_db) == [("us-east-1", "i-1")]
+    assert mongo_db["iam_users"].count_documents({}) == 2
+
+
+def test_skipped_service_is_left_alone(mongo_db):
+    _ingest(_report(FULL, ["alice"]))
+
+    _ingest(_report(FULL, [], {"skipped_services": ["iam"]}))
+
+    assert mongo_db["iam_users"].count_documents({}) == 1
+
+
+def test_full_scan_removes_everywhere(mongo_db):
+    _ingest(_report(FULL, ["alice"]))
+
+    _ingest(_report([("us-east-1", "i-1")], [], {}))
+
+    assert _instances(mongo_db) == [("us-east-1", "i-1")]
+    assert mongo_db["iam_users"].count_documents({}) == 0
+
+
+def test_partial_scan_closes_only_covered_history(mongo_db):
+    _ingest(_report(FULL, ["alice"]))
+
+    _ingest(_report([], ["alice"], {"regions": ["us-east-1"]}))
+
+    open_versions = sorted(doc["doc"]["instance_id"] for doc in mongo_db["resource_history"].find(
+        {"collection": "ec2_instances", "valid_to": None}))
+    assert open_versions == ["i-3"]
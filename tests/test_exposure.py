@@ -0,0 +1,127 @@
+import ipaddress
+import random
+
+import pytest
+
+from exposure import (EXPOSURE_COLLECTION, build_exposure_filter, cidr_fields, containing_blocks,
+                      containing_cidr_keys, find_exposure_page, parse_ports, port_blocks, store_exposure)
+from queries import QueryError
+
+
+def test_port_blocks_match_exactly_the_ports_in_range():
+    rng = random.Random(0)
+    for _ in range(2000):
+        port_from = rng.randint(0, 65535)
+        port_to = rng.randint(port_from, 65535)
+        port = rng.choice([port_from, port_to, rng.randint(0, 65535)])
+        hits = set(port_blocks(port_from, port_to)) & set(containing_blocks(port))
+        assert len(hits) == (1 if port_from <= port <= port_to else 0), (port_from, port_to, port)
+
+
+def test_port_blocks_are_few():
+    assert len(port_blocks(0, 65535)) == 1
+    assert len(port_blocks(1, 65535)) == 16
+    assert len(port_blocks(22, 22)) == 1
+    assert len(containing_blocks(22)) == 17
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("22", (22, 22)), ("1024-65535", (1024, 65535)), ("ALL", (0, 65535)), ("-1", (0, 65535)),
+    ("0-70000", (0, 65535)), ("Echo Request", None)])
+def test_parse_ports(value, expected):
+    assert parse_ports(value) == expected
+
+
+def test_cidr_fields():
+    fields = cidr_fields("10.1.2.3/16")
+    assert fields["cidr"] == "10.1.0.0/16"
+    assert (fields["cidr_start"], fields["cidr_end"]) == ("0a010000", "0a01ffff")
+    assert fields["public_source"] is False
+    assert cidr_fields("0.0.0.0/0")["public_source"] is True
+    assert cidr_fields("::/0")["cidr_version"] == 6
+    assert cidr_fields("not-a-cidr") == {"cidr": "not-a-cidr"}
+
+
+def test_containing_cidr_keys():
+    keys = containing_cidr_keys(ipaddress.ip_network("10.1.2.3"))
+    assert len(keys) == 33
+    assert cidr_fields("10.1.0.0/16")["cidr_key"] in keys
+    assert cidr_fields("0.0.0.0/0")["cidr_key"] in keys
+    assert cidr_fields("10.2.0.0/16")["cidr_key"] not in keys
+
+
+def _report():
+    web_sg = {
+        "name": "web",
+        "rules": {"ingress": {"protocols": {"TCP": {"ports": {
+            "22": {"cidrs": [{"CIDR": "0.0.0.0/0"}, {"CIDR": "10.1.0.0/16"}]},
+            "8000-9000": {"security_groups": [{"GroupId": "sg-db", "UserId": "123"}]}}}}}},
+        "used_by": {"ec2": {"resource_type": {"instances": {"running": [{"id": "i-1", "name": "web"}]}}}}}
+    db_sg = {"name": "db", "rules": {"ingress": {"protocols": {
+        "ALL": {"ports": {"ALL": {"cidrs": [{"CIDR": "10.0.0.0/8"}]}}},
+        "ICMP": {"ports": {"Echo Request": {"cidrs": [{"CIDR": "0.0.0.0/0"}]}}}}}}}
+    return {
+        "services": {"ec2": {
+            "regions": {"us-east-1": {"vpcs": {"vpc-1": {"security_groups": {"sg-web": web_sg, "sg-db": db_sg}}}}},
+            "external_attack_surface": {"1.2.3.4": {"InstanceName": "web", "protocols": {
+                "TCP": {"ports": {"443": {"cidrs": [{"CIDR": "0.0.0.0/0"}]}}}}}}}},
+        "sg_map": {"sg-db": {"region": "us-east-1", "vpc_id": "vpc-1"}}}
+
+
+def _find(**args):
+    items, _ = find_exposure_page(build_exposure_filter({"account_id": "acct", **args}))
+    return sorted((item["resource_id"], item["protocol"], item["ports"], item.get("cidr")) for item in items)
+
+
+def test_store_exposure_fans_out_to_resources_and_sources(mongo_db):
+    assert store_exposure(_report(), "acct")["added"] == 6
+
+    by_sg = {doc["key"]: doc for doc in mongo_db[EXPOSURE_COLLECTION].find({"source_type": "security_group"})}
+    (row,) = by_sg.values()
+    assert (row["resource_id"], row["source_region"], row["source_vpc"]) == ("i-1", "us-east-1", "vpc-1")
+    # A group nothing uses is indexed as itself
+    assert mongo_db[EXPOSURE_COLLECTION].count_documents({"resource_id": "sg-db"}) == 2
+
+
+def test_port_and_cidr_lookups(mongo_db):
+    store_exposure(_report(), "acct")
+
+    assert _find(port="22", public="1") == [("i-1", "TCP", "22", "0.0.0.0/0")]
+    assert _find(port="22", cidr="10.1.2.3") == [("i-1", "TCP", "22", "0.0.0.0/0"),
+                                                  ("i-1", "TCP", "22", "10.1.0.0/16"),
+                                                  ("sg-db", "ALL", "ALL", "10.0.0.0/8")]
+    assert _find(port="8500", protocol="tcp") == [("i-1", "TCP", "8000-9000", None),
+                                                  ("sg-db", "ALL", "ALL", "10.0.0.0/8")]
+    assert _find(cidr="10.0.0.0/8", match="within") == [("i-1", "TCP", "22", "10.1.0.0/16"),
+                                                        ("sg-db", "ALL", "ALL", "10.0.0.0/8")]
+    assert _find(port="443", public="1") == [("1.2.3.4", "TCP", "443", "0.0.0.0/0")]
+
+
+def test_removed_rules_are_deleted_on_the_next_store(mongo_db):
+    store_exposure(_report(), "acct")
+    report = _report()
+    del report["services"]["ec2"]["external_attack_surface"]
+
+    stats = store_exposure(report, "acct")
+
+    assert (stats["removed"], stats["unchanged"]) == (1, 5)
+    assert _find(port="443", public="1") == []
+
+
+def test_pages_follow_the_cursor(mongo_db):
+    store_exposure(_report(), "acct")
+    seen, after = [], None
+    while True:
+        items, after = find_exposure_page(build_exposure_filter({"account_id": "acct"}), after=after, limit=2)
+        seen += [item["key"] for item in items]
+        if after is None:
+            break
+    assert seen == sorted(doc["key"] for doc in mongo_db[EXPOSURE_COLLECTION].find())
+
+
+@pytest.mark.parametrize("args", [
+    {}, {"port": "x"}, {"port": "70000"}, {"cidr": "zz"}, {"cidr": "1.1.1.1", "match": "foo"},
+    {"port": "22", "bogus": "1"}])
+def test_invalid_filters(args):
+    with pytest.raises(QueryError):
+        build_exposure_filter(args)
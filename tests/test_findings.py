@@ -0,0 +1,121 @@
+import io
+import json
+
+import pytest
+
+from findings import build_findings_filter, find_findings_page, findings_summary, rule_resource_pattern
+from ingest import ingest_report_stream
+from parser import compile_resource_paths
+from queries import QueryError
+
+ACCOUNT = "111122223333"
+INSTANCES = "ec2.regions.id.vpcs.id.instances"
+
+
+def _report(time, findings):
+    instances = {f"i-{n}": {"name": f"i-{n}"} for n in range(4)}
+    return "scoutsuite_results = " + json.dumps({
+        "account_id": ACCOUNT,
+        "last_run": {"time": time},
+        "services": {
+            "ec2": {"regions": {"us-east-1": {"vpcs": {"vpc-1": {"instances": instances}}}}, "findings": findings},
+            "iam": {"users": {"alice": {}}, "findings": {
+                "iam-user-no-mfa": {"level": "danger", "path": "iam.users.id", "items": ["iam.users.alice"]}}}
+        }
+    })
+
+
+def _finding(level, ids, attribute="id"):
+    return {"level": level, "path": f"{INSTANCES}.id.{attribute}",
+            "items": [f"ec2.regions.us-east-1.vpcs.vpc-1.instances.{id}.{attribute}" for id in ids]}
+
+
+def _ingest(time, findings, timestamp=None):
+    return ingest_report_stream(io.StringIO(_report(time, findings)), account_name="acct", report_timestamp=timestamp)
+
+
+@pytest.fixture
+def scanned(mongo_db):
+    _ingest("2024-02-01 00:00:00+0000", {"ec2-no-imdsv2": _finding("warning", ["i-0", "i-1", "i-2"], "metadata"),
+                                          "ec2-public-ip": _finding("danger", ["i-3"])})
+
+
+def test_rule_resource_pattern_picks_the_longest_match():
+    patterns = compile_resource_paths([f"services.{INSTANCES}", "services.ec2.regions.id.vpcs"])
+
+    assert rule_resource_pattern(tuple(f"{INSTANCES}.id.metadata".split(".")), patterns) == \
+        tuple(INSTANCES.split("."))
+    assert rule_resource_pattern(("ec2", "regions", "id", "vpcs", "id"), patterns) == \
+        ("ec2", "regions", "id", "vpcs")
+    assert rule_resource_pattern(("s3", "buckets", "id"), patterns) is None
+
+
+def test_items_are_indexed_with_their_resource(mongo_db, scanned):
+    doc = mongo_db["findings"].find_one({"rule": "ec2-no-imdsv2", "resource_id": "i-1"})
+
+    assert doc["collection"] == "ec2_instances"
+    assert doc["region"] == "us-east-1"
+    assert doc["resource_path"] == "ec2.regions.us-east-1.vpcs.vpc-1.instances.i-1"
+    assert mongo_db["findings"].find_one({"rule": "iam-user-no-mfa"})["collection"] == "iam_users"
+
+
+def test_summary_counts_by_level_service_and_rule(scanned):
+    summary = findings_summary({"account_id": ACCOUNT})
+
+    assert summary["flagged_items"] == 5
+    assert summary["rules"] == 3
+    assert summary["by_level"] == {"warning": 3, "danger": 2}
+    assert summary["by_service"] == {"ec2": {"warning": 3, "danger": 1}, "iam": {"danger": 1}}
+    assert [(rule["rule"], rule["count"]) for rule in summary["by_rule"]] == \
+        [("ec2-no-imdsv2", 3), ("ec2-public-ip", 1), ("iam-user-no-mfa", 1)]
+
+
+def test_rescan_updates_and_removes_findings(mongo_db, scanned):
+    result = _ingest("2024-03-01 00:00:00+0000", {"ec2-no-imdsv2": _finding("warning", ["i-0"], "metadata")})
+
+    assert result["finding_items"] == {"added": 0, "changed": 0, "removed": 3, "unchanged": 2}
+    assert findings_summary({"account_id": ACCOUNT})["by_level"] == {"warning": 1, "danger": 1}
+
+
+def test_pages_in_index_order(scanned):
+    seen, after = [], None
+    while True:
+        items, after = find_findings_page({"account_id": ACCOUNT}, after=after, limit=2)
+        seen += [(item["level"], item["rule"], item["resource_id"]) for item in items]
+        if after is None:
+            break
+    assert seen == sorted(seen)
+    assert len(seen) == 5
+
+
+def test_filtered_pages(scanned):
+    items, after = find_findings_page(build_findings_filter(ACCOUNT, {"level": "warning"}), limit=2)
+    items_2, after_2 = find_findings_page(build_findings_filter(ACCOUNT, {"level": "warning"}), after=after, limit=2)
+
+    assert [item["resource_id"] for item in items + items_2] == ["i-0", "i-1", "i-2"]
+    assert after_2 is None
+
+
+def test_build_findings_filter():
+    assert build_findings_filter(None, {"resource_id": "i-1"}) == {"resource_id": "i-1"}
+    with pytest.raises(QueryError):
+        build_findings_filter(None, {"level": "danger"})
+    with pytest.raises(QueryError):
+        build_findings_filter(ACCOUNT, {"item": "x"})
+    with pytest.raises(QueryError):
+        find_findings_page({"account_id": ACCOUNT}, after="not-a-cursor")
+
+
+def test_report_page_only_shows_findings_of_the_latest_scan(mongo_db):
+    from app import app
+
+    _ingest("2024-02-01 00:00:00+0000", {"ec2-old-rule": _finding("warning", ["i-0"])}, "20240201_000000")
+    _ingest("2024-03-01 00:00:00+0000", {"ec2-new-rule": _finding("warning", ["i-0"])}, "20240301_000000")
+    client = app.test_client()
+
+    latest = client.get("/reports/acct/20240301_000000").get_data(as_text=True)
+    older = client.get("/reports/acct/20240201_000000").get_data(as_text=True)
+
+    assert "Current findings by rule" in latest and "ec2-new-rule" in latest
+    assert "ec2-new-rule" not in older and "ec2-old-rule" not in older
+    assert "only kept for the account's latest scan" in older
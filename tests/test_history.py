@@ -0,0 +1,106 @@
+import io
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+import ingest
+from history import SCANS_COLLECTION, find_resources_as_of, parse_timestamp
+from ingest import ingest_report_stream
+from queries import find_resource_page
+
+T1 = "2024-02-01 00:00:00+0000"
+T2 = "2024-03-01 00:00:00+0000"
+
+
+def _ingest(time, instances):
+    report = {
+        "account_id": "111122223333",
+        "last_run": {"time": time},
+        "services": {"ec2": {"regions": {"us-east-1": {"vpcs": {"vpc-1": {"instances": instances}}}}}}
+    }
+    return ingest_report_stream(io.StringIO("scoutsuite_results = " + json.dumps(report)))
+
+
+def _as_of(value, **kwargs):
+    return [(doc["instance_id"], doc.get("state")) for doc in find_resources_as_of(
+        "ec2_instances", {"account_id": "111122223333"}, parse_timestamp(value), sort_field="instance_id", **kwargs)]
+
+
+@pytest.mark.parametrize("value", ["20240325_120000", "2024-03-25T12:00:00Z", "2024-03-25 14:00:00+0200",
+                                   "2024-03-25T12:00:00"])
+def test_parse_timestamp(value):
+    assert parse_timestamp(value) == datetime(2024, 3, 25, 12, tzinfo=timezone.utc)
+
+
+def test_parse_timestamp_rejects_garbage():
+    with pytest.raises(ValueError):
+        parse_timestamp("yesterday")
+
+
+@pytest.fixture
+def two_scans(mongo_db):
+    _ingest(T1, {"i-1": {"state": "running"}, "i-2": {"state": "running"}})
+    _ingest(T2, {"i-1": {"state": "stopped"}, "i-3": {"state": "running"}})
+
+
+def test_as_of_answers_from_validity_intervals(two_scans):
+    assert _as_of("2024-01-01T00:00:00Z") == []
+    assert _as_of(T1) == [("i-1", "running"), ("i-2", "running")]
+    assert _as_of("2024-02-15T00:00:00Z") == [("i-1", "running"), ("i-2", "running")]
+    assert _as_of(T2) == [("i-1", "stopped"), ("i-3", "running")]
+
+
+def test_versions_close_when_changed_or_removed(mongo_db, two_scans):
+    versions = {(doc["key"][-1], doc["doc"]["state"]): doc for doc in mongo_db["resource_history"].find()}
+    scan_1, scan_2 = [scan["_id"] for scan in mongo_db[SCANS_COLLECTION].find().sort("scan_time", 1)]
+
+    assert versions[("i-1", "running")]["valid_to"] == datetime(2024, 3, 1)
+    assert versions[("i-1", "running")]["last_seen_scan"] == scan_1
+    assert versions[("i-2", "running")]["valid_to"] == datetime(2024, 3, 1)
+    assert versions[("i-1", "stopped")]["valid_to"] is None
+    assert versions[("i-1", "stopped")]["first_seen_scan"] == scan_2
+    # Unchanged resources don't get a new version
+    assert len(versions) == 4
+
+
+def test_unchanged_rescan_writes_no_versions(mongo_db, two_scans):
+    before = mongo_db["resource_history"].count_documents({})
+
+    _ingest("2024-04-01 00:00:00+0000", {"i-1": {"state": "stopped"}, "i-3": {"state": "running"}})
+
+    assert mongo_db["resource_history"].count_documents({}) == before
+
+
+def test_as_of_filters_and_pages_on_resource_id(two_scans):
+    assert _as_of(T1, after="i-1") == [("i-2", "running")]
+    assert _as_of(T2, after="i-1") == [("i-3", "running")]
+    assert [doc["instance_id"] for doc in find_resources_as_of(
+        "ec2_instances", {"account_id": "111122223333", "instance_id": "i-2"}, parse_timestamp(T1),
+        sort_field="instance_id", after="i-1")] == ["i-2"]
+    assert list(find_resources_as_of("ec2_instances", {"account_id": "111122223333", "instance_id": "i-1"},
+                                     parse_timestamp(T1), sort_field="instance_id", after="i-1")) == []
+
+
+def test_as_of_pages_walk_the_whole_listing(two_scans):
+    seen, after = [], None
+    while True:
+        page = find_resource_page("ec2_instances", {"account_id": "111122223333"}, after=after, limit=1,
+                                  as_of=parse_timestamp(T1))
+        seen += [doc["instance_id"] for doc in page.items]
+        if page.next_after is None:
+            break
+        after = page.next_after
+    assert seen == ["i-1", "i-2"]
+
+
+def test_failed_ingest_keeps_its_versions(mongo_db, two_scans, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("summary store down")
+
+    monkeypatch.setattr(ingest, "store_account_summary", fail)
+    with pytest.raises(RuntimeError):
+        _ingest("2024-04-01 00:00:00+0000", {"i-1": {"state": "terminated"}})
+
+    assert mongo_db[SCANS_COLLECTION].find_one({"status": "error"})["error"] == "summary store down"
+    assert mongo_db["resource_history"].count_documents({"doc.state": "terminated"}) == 1
@@ -0,0 +1,122 @@
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import jobs
+from jobs import COMPLETED, ERROR, QUEUED, RUNNING, ScanJobQueue
+
+REPORT = {
+    "account_id": "111122223333",
+    "last_run": {"time": "2024-02-15 12:34:56+0000"},
+    "services": {"s3": {"buckets": {"b1": {"name": "b1"}}}}
+}
+
+
+@pytest.fixture
+def fake_scan(monkeypatch, tmp_path):
+    """Replaces `scout aws` with one writing a small results file."""
+    def run_scout_suite(timestamp=None, **kwargs):
+        path = tmp_path / timestamp / "new2.js"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("scoutsuite_results = " + json.dumps(REPORT))
+        return str(path)
+
+    monkeypatch.setattr(jobs, "SCAN_MODE", "subprocess")
+    monkeypatch.setattr(jobs, "run_scout_suite", run_scout_suite)
+
+
+def _job(**fields):
+    job = {"_id": "job-1", "status": QUEUED, "priority": 10, "account_name": "acct", "profile_name": "default",
+           "region": None, "username": None, "batch_size": None, "created_at": datetime.now(timezone.utc),
+           "started_at": None, "finished_at": None, "exit_code": None, "error": None}
+    job.update(fields)
+    return job
+
+
+def _run_until_done(mongo_db, job_id, timeout=15):
+    queue = ScanJobQueue(max_workers=1)
+    queue.start()
+    try:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = mongo_db["scan_jobs"].find_one({"_id": job_id})
+            if job["status"] not in (QUEUED, RUNNING):
+                return job
+            time.sleep(0.05)
+        pytest.fail(f"Job {job_id} still {job['status']} after {timeout}s")
+    finally:
+        queue.stop()
+        for thread in queue._threads:
+            thread.join(5)
+
+
+def test_job_queued_before_start_runs(mongo_db, fake_scan):
+    mongo_db["scan_jobs"].insert_one(_job())
+
+    job = _run_until_done(mongo_db, "job-1")
+
+    assert job["status"] == COMPLETED
+    assert job["account_id"] == REPORT["account_id"]
+    assert job["attempts"] == 1
+    assert mongo_db["scan_leases"].count_documents({}) == 0
+    assert mongo_db["s3_buckets"].count_documents({"account_id": REPORT["account_id"]}) == 1
+
+
+def test_job_of_dead_worker_is_requeued_and_run(mongo_db, fake_scan):
+    stale = datetime.now(timezone.utc) - timedelta(seconds=jobs.SCAN_LEASE_SECONDS + 60)
+    mongo_db["scan_jobs"].insert_one(_job(status=RUNNING, started_at=stale, heartbeat_at=stale, attempts=1,
+                                          lease="old", lease_slot="acct:0"))
+    mongo_db["scan_leases"].insert_one({"_id": "acct:0", "job_id": "job-1", "token": "old", "expires_at": stale})
+
+    job = _run_until_done(mongo_db, "job-1")
+
+    assert job["status"] == COMPLETED
+    assert job["attempts"] == 2
+
+
+def test_job_of_dead_worker_fails_after_max_attempts(mongo_db, monkeypatch):
+    monkeypatch.setattr(jobs, "SCAN_MAX_ATTEMPTS", 2)
+    stale = datetime.now(timezone.utc) - timedelta(seconds=jobs.SCAN_LEASE_SECONDS + 60)
+    mongo_db["scan_jobs"].insert_one(_job(status=RUNNING, started_at=stale, heartbeat_at=stale, attempts=2,
+                                          lease="old", lease_slot="acct:0"))
+    mongo_db["scan_leases"].insert_one({"_id": "acct:0", "job_id": "job-1", "token": "old", "expires_at": stale})
+
+    ScanJobQueue()._recover_stale()
+
+    job = mongo_db["scan_jobs"].find_one({"_id": "job-1"})
+    assert job["status"] == ERROR
+    assert "lease" not in job
+    assert mongo_db["scan_leases"].count_documents({}) == 0
+
+
+def test_live_job_is_left_running(mongo_db):
+    now = datetime.now(timezone.utc)
+    mongo_db["scan_jobs"].insert_one(_job(status=RUNNING, started_at=now, heartbeat_at=now, attempts=1,
+                                          lease="live", lease_slot="acct:0"))
+
+    ScanJobQueue()._recover_stale()
+
+    assert mongo_db["scan_jobs"].find_one({"_id": "job-1"})["status"] == RUNNING
+
+
+def test_account_slots_limit_concurrent_scans(mongo_db):
+    queue = ScanJobQueue(max_per_account=2)
+    expires_at = datetime.now(timezone.utc) + timedelta(minutes=5)
+
+    first = queue._acquire_slot("acct", {"token": "a", "expires_at": expires_at})
+    second = queue._acquire_slot("acct", {"token": "b", "expires_at": expires_at})
+
+    assert {first, second} == {"acct:0", "acct:1"}
+    assert queue._acquire_slot("acct", {"token": "c", "expires_at": expires_at}) is None
+    assert queue._acquire_slot("other", {"token": "d", "expires_at": expires_at}) == "other:0"
+
+
+def test_lapsed_slot_is_taken_over(mongo_db):
+    queue = ScanJobQueue(max_per_account=1)
+    lapsed = datetime.now(timezone.utc) - timedelta(seconds=1)
+    mongo_db["scan_leases"].insert_one({"_id": "acct:0", "token": "old", "expires_at": lapsed})
+
+    assert queue._acquire_slot("acct", {"token": "new", "expires_at": lapsed + timedelta(minutes=5)}) == "acct:0"
+    assert mongo_db["scan_leases"].find_one({"_id": "acct:0"})["token"] == "new"
@@ -0,0 +1,36 @@
+import io
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from parser import ScoutSuiteStreamParser, parse_scoutsuite_file  # noqa: E402
+
+DOCS = [
+    'scoutsuite_results = {"account_id": "1", "sg_map": {"a": 1},\n}',
+    'scoutsuite_results = {"account_id": "1", "last_run": {"a": {"b": 1},}, "x": [1, {"c": 2}]}',
+    'scoutsuite_results = {"account_id": "1", "services": {"s3": {"buckets": {"b": {"name": "b"},\n}},\n}};',
+]
+
+
+def _sections(doc, chunk_size):
+    stream = ScoutSuiteStreamParser("<test>", fp=io.StringIO(doc), chunk_size=chunk_size)
+    data = {}
+    for key, value in stream.iter_sections():
+        if key.startswith("services."):
+            data.setdefault("services", {})[key.split(".", 1)[1]] = value
+        else:
+            data[key] = value
+    return data
+
+
+@pytest.mark.parametrize("doc", DOCS)
+def test_stream_trailing_commas_at_every_chunk_boundary(doc, tmp_path):
+    path = tmp_path / "new2.js"
+    path.write_text(doc)
+    expected = parse_scoutsuite_file(str(path))
+    for chunk_size in range(1, len(doc) + 1):
+        assert _sections(doc, chunk_size) == expected, chunk_size
@@ -0,0 +1,81 @@
+import pytest
+
+import queries
+from queries import (QueryError, build_resource_filter, find_resource_page, iter_resource_docs, parse_fields,
+                     parse_limit)
+
+ACCOUNT = "111122223333"
+
+
+@pytest.fixture
+def instances(mongo_db):
+    mongo_db["ec2_instances"].insert_many([
+        {"account_id": ACCOUNT, "region": region, "vpc_id": "vpc-1", "instance_id": f"i-{n}", "state": "running",
+         "content_hash": "x"}
+        for n, region in enumerate(["us-east-1", "eu-west-1"] * 5)
+    ] + [{"account_id": "other", "region": "us-east-1", "vpc_id": "vpc-1", "instance_id": "i-0"}])
+
+
+def _walk(filter, limit, **kwargs):
+    pages, after = [], None
+    while True:
+        page = find_resource_page("ec2_instances", filter, after=after, limit=limit, **kwargs)
+        pages.append([doc["instance_id"] for doc in page.items])
+        if page.next_after is None:
+            return pages
+        after = page.next_after
+
+
+def test_parse_limit():
+    assert parse_limit(None) == queries.RESOURCE_PAGE_SIZE
+    assert parse_limit("5") == 5
+    assert parse_limit(str(queries.RESOURCE_MAX_PAGE_SIZE + 1)) == queries.RESOURCE_MAX_PAGE_SIZE
+    for value in ("0", "-1", "ten"):
+        with pytest.raises(QueryError):
+            parse_limit(value)
+
+
+def test_parse_fields():
+    assert parse_fields(None) is None
+    assert parse_fields("instance_id, state,tags.Name") == ["instance_id", "state", "tags.Name"]
+    with pytest.raises(QueryError):
+        parse_fields("state,$where")
+
+
+def test_build_resource_filter_only_accepts_indexed_fields():
+    assert build_resource_filter("ec2_instances", ACCOUNT, {"region": "us-east-1", "limit": "5", "after": "i-1"}) \
+        == {"account_id": ACCOUNT, "region": "us-east-1"}
+    with pytest.raises(QueryError):
+        build_resource_filter("ec2_instances", ACCOUNT, {"state": "running"})
+
+
+def test_pages_cover_the_listing_in_order(instances):
+    assert _walk({"account_id": ACCOUNT}, 4) == [["i-0", "i-1", "i-2", "i-3"], ["i-4", "i-5", "i-6", "i-7"],
+                                                 ["i-8", "i-9"]]
+
+
+def test_pages_with_filter(instances):
+    assert _walk({"account_id": ACCOUNT, "region": "eu-west-1"}, 2) == [["i-1", "i-3"], ["i-5", "i-7"], ["i-9"]]
+
+
+def test_resource_id_filter_with_after(instances):
+    filter = {"account_id": ACCOUNT, "instance_id": "i-5"}
+
+    assert [doc["instance_id"] for doc in find_resource_page("ec2_instances", filter, after="i-0").items] == ["i-5"]
+    assert find_resource_page("ec2_instances", filter, after="i-5").items == []
+    assert filter == {"account_id": ACCOUNT, "instance_id": "i-5"}
+
+
+def test_projection_keeps_the_sort_key(instances):
+    page = find_resource_page("ec2_instances", {"account_id": ACCOUNT}, limit=1, fields=["state"])
+
+    assert page.items == [{"instance_id": "i-0", "state": "running"}]
+    assert page.next_after == "i-0"
+
+
+def test_removed_resources_are_hidden_in_mark_mode(mongo_db, instances, monkeypatch):
+    monkeypatch.setattr(queries, "RESOURCE_REMOVAL_MODE", "mark")
+    mongo_db["ec2_instances"].update_one({"instance_id": "i-0", "account_id": ACCOUNT}, {"$set": {"removed": True}})
+
+    assert find_resource_page("ec2_instances", {"account_id": ACCOUNT}, limit=1).items[0]["instance_id"] == "i-1"
+    assert "i-0" not in [doc["instance_id"] for doc in iter_resource_docs("ec2_instances", {"account_id": ACCOUNT})]
@@ -0,0 +1,114 @@
+import gzip
+import json
+
+import pytest
+from flask import Flask
+
+import response_cache
+from response_cache import ReportCache
+
+REPORT = {"account_id": "111122223333", "services": {"ec2": {"regions": {}}, "iam": {"users": {"alice": {}}}}}
+
+
+@pytest.fixture
+def report(tmp_path):
+    path = tmp_path / "new2.js"
+    path.write_text("scoutsuite_results = " + json.dumps(REPORT))
+    return str(path)
+
+
+@pytest.fixture
+def parses(monkeypatch):
+    calls = []
+    parse = response_cache.parse_scoutsuite_file
+
+    def counting_parse(path):
+        calls.append(path)
+        return parse(path)
+
+    monkeypatch.setattr(response_cache, "parse_scoutsuite_file", counting_parse)
+    return calls
+
+
+@pytest.fixture
+def app():
+    return Flask(__name__)
+
+
+def _get(app, cache, path, service=None, headers=None):
+    with app.test_request_context(headers=headers or {}):
+        response = cache.respond(path, service)
+        if response is None:
+            return None
+        response.direct_passthrough = False
+        return response.status_code, response.headers, response.get_data()
+
+
+def test_report_is_parsed_once(app, report, parses):
+    cache = ReportCache(compress=False)
+
+    status, _, body = _get(app, cache, report)
+    assert status == 200 and json.loads(body) == REPORT
+    assert json.loads(_get(app, cache, report, "iam")[2]) == \
+        {"account_id": REPORT["account_id"], "service": "iam", "data": REPORT["services"]["iam"]}
+    assert len(parses) == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_unknown_service_is_none(app, report):
+    assert _get(app, ReportCache(), report, "s3") is None
+
+
+def test_evicted_service_is_rebuilt_from_the_full_body(app, report, parses):
+    cache = ReportCache()
+    _get(app, cache, report)
+    for key in [key for key in cache.local._entries if key.endswith("|ec2")]:
+        del cache.local._entries[key]
+
+    status, _, body = _get(app, cache, report, "ec2")
+
+    assert status == 200
+    assert json.loads(body)["data"] == REPORT["services"]["ec2"]
+    assert len(parses) == 1
+
+
+def test_evicted_report_is_reloaded(app, report, parses):
+    cache = ReportCache(max_entries=1)
+    _get(app, cache, report)
+
+    assert json.loads(_get(app, cache, report, "ec2")[2])["service"] == "ec2"
+    assert len(parses) == 2
+
+
+def test_gzip_is_sent_to_clients_that_accept_it(app, report):
+    cache = ReportCache(compress=True)
+
+    _, headers, body = _get(app, cache, report, headers={"Accept-Encoding": "gzip"})
+    assert headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(body)) == REPORT
+    assert headers["ETag"].endswith('-gzip"')
+
+    _, plain_headers, plain = _get(app, cache, report)
+    assert "Content-Encoding" not in plain_headers
+    assert json.loads(plain) == REPORT
+    assert plain_headers["ETag"] != headers["ETag"]
+
+
+def test_if_none_match_gets_304(app, report):
+    cache = ReportCache()
+    _, headers, _ = _get(app, cache, report)
+
+    status, _, body = _get(app, cache, report, headers={"If-None-Match": headers["ETag"]})
+
+    assert status == 304 and body == b""
+
+
+def test_rewritten_report_is_parsed_again(app, report, parses):
+    cache = ReportCache()
+    _get(app, cache, report)
+    with open(report, "a") as f:
+        f.write("\n")
+
+    _get(app, cache, report)
+
+    assert len(parses) == 2
@@ -0,0 +1,110 @@
+import pytest
+from flask import Flask, Response, jsonify, stream_with_context
+
+import response_cache
+from response_cache import ResponseCache
+
+
+@pytest.fixture
+def cache(mongo_db, monkeypatch):
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_ENABLED", True)
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_GENERATION_TTL_SECONDS", 60)
+    return ResponseCache(backend="memory")
+
+
+@pytest.fixture
+def client(cache):
+    app = Flask(__name__)
+    calls = {"list": 0, "stream": 0}
+
+    @app.route("/things")
+    @cache.cached
+    def things():
+        calls["list"] += 1
+        return jsonify({"calls": calls["list"]})
+
+    @app.route("/stream")
+    @cache.cached
+    def stream():
+        calls["stream"] += 1
+        if response_cache.wants_ndjson():
+            return Response(stream_with_context(iter(['{"n": 1}\n'])), mimetype="application/x-ndjson")
+        return Response(stream_with_context(iter(["[", '{"n": 1}', "]"])), mimetype="application/json")
+
+    test_client = app.test_client()
+    test_client.calls = calls
+    return test_client
+
+
+def test_hits_until_the_generation_is_bumped(client, cache):
+    assert client.get("/things?account_id=a").get_json() == {"calls": 1}
+    assert client.get("/things?account_id=a").get_json() == {"calls": 1}
+    assert client.get("/things?account_id=b").get_json() == {"calls": 2}
+
+    cache.bump_generation("a")
+
+    assert client.get("/things?account_id=a").get_json() == {"calls": 3}
+    assert client.get("/things?account_id=b").get_json() == {"calls": 2}
+    assert cache.stats()["hits"] == 2
+
+
+def test_query_parameters_are_part_of_the_key(client):
+    client.get("/things?account_id=a&region=x")
+    assert client.get("/things?region=x&account_id=a").get_json() == {"calls": 1}
+    assert client.get("/things?account_id=a&region=y").get_json() == {"calls": 2}
+
+
+def test_requests_without_account_are_not_cached(client):
+    client.get("/things")
+    assert client.get("/things").get_json() == {"calls": 2}
+
+
+def test_if_none_match_gets_304(client):
+    first = client.get("/things?account_id=a")
+    assert first.headers["Vary"] == "Accept"
+
+    revalidated = client.get("/things?account_id=a", headers={"If-None-Match": first.headers["ETag"]})
+
+    assert revalidated.status_code == 304
+    assert revalidated.headers["ETag"] == first.headers["ETag"]
+
+
+def test_etag_changes_with_the_generation(client, cache):
+    etag = client.get("/things?account_id=a").headers["ETag"]
+    cache.bump_generation("a")
+
+    response = client.get("/things?account_id=a", headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_streamed_miss_carries_etag_and_is_cached(client):
+    miss = client.get("/stream?account_id=a")
+    assert miss.get_data() == b'[{"n": 1}]'
+    assert miss.headers["ETag"] and miss.headers["Vary"] == "Accept"
+
+    hit = client.get("/stream?account_id=a")
+    assert hit.get_data() == miss.get_data()
+    assert hit.headers["ETag"] == miss.headers["ETag"]
+    assert client.calls["stream"] == 1
+    assert client.get("/stream?account_id=a", headers={"If-None-Match": miss.headers["ETag"]}).status_code == 304
+
+
+def test_accept_header_picks_its_own_entry(client):
+    json_body = client.get("/stream?account_id=a").get_data()
+    ndjson = client.get("/stream?account_id=a", headers={"Accept": "application/x-ndjson"})
+
+    assert ndjson.get_data() == b'{"n": 1}\n'
+    assert ndjson.headers["ETag"] != client.get("/stream?account_id=a").headers["ETag"]
+    assert client.get("/stream?account_id=a").get_data() == json_body
+
+
+def test_generation_is_reread_after_its_ttl(client, cache, mongo_db, monkeypatch):
+    client.get("/things?account_id=a")
+    # Bumped by another process
+    mongo_db["cache_generations"].update_one({"_id": "a"}, {"$inc": {"generation": 1}}, upsert=True)
+    assert client.get("/things?account_id=a").get_json() == {"calls": 1}
+
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_GENERATION_TTL_SECONDS", 0)
+    assert client.get("/things?account_id=a").get_json() == {"calls": 2}
@@ -0,0 +1,125 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import retention
+from retention import RetentionEngine, RetentionPolicy, expired_scans, parse_policy, set_policy
+
+NOW = datetime(2024, 3, 31, 12, tzinfo=timezone.utc)
+
+
+def _scans(*ages, status="completed"):
+    """Scans `ages` (timedeltas) old, newest first as apply_account lists them."""
+    return [{"_id": f"scan-{n}", "scan_time": NOW - age, "status": status}
+            for n, age in enumerate(sorted(ages))]
+
+
+def _ids(scans):
+    return [scan["_id"] for scan in scans]
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    monkeypatch.setattr(retention, "RETENTION_MAX_DELETES_PER_SECOND", 0)
+    return RetentionEngine()
+
+
+def _run(dry_run=False):
+    return {"dry_run": dry_run, "deleted": {}, "scans_deleted": 0, "reports_pruned": 0, "report_bytes": 0}
+
+
+def test_parse_policy():
+    assert parse_policy({"daily_days": 7}) == RetentionPolicy(0, 7, 0)
+    for values in ({"daily_days": -1}, {"daily_days": "7"}, {"daily_days": True}, {"monthly_days": 1}):
+        with pytest.raises(ValueError):
+            parse_policy(values)
+
+
+def test_disabled_policy_expires_nothing():
+    assert expired_scans(_scans(timedelta(days=400)), RetentionPolicy(0, 0, 0), NOW) == []
+
+
+def test_keep_all_then_daily_then_weekly():
+    hours = [timedelta(hours=h) for h in (1, 5,        # inside keep_all: both kept
+                                          30, 34,      # day 2: only the newest kept
+                                          24 * 10, 24 * 10 + 1,  # past daily, same week: newest kept
+                                          24 * 40)]    # past every tier
+    scans = _scans(*hours)
+
+    expired = expired_scans(scans, RetentionPolicy(keep_all_days=1, daily_days=7, weekly_days=30), NOW)
+
+    assert _ids(expired) == ["scan-3", "scan-5", "scan-6"]
+
+
+def test_newest_completed_scan_is_always_kept():
+    scans = _scans(timedelta(days=100), timedelta(days=200))
+
+    assert _ids(expired_scans(scans, RetentionPolicy(keep_all_days=1), NOW)) == ["scan-1"]
+
+
+def test_unfinished_scans_get_a_grace_day():
+    scans = _scans(timedelta(hours=2)) + [
+        {"_id": "ingesting", "scan_time": NOW - timedelta(hours=3), "status": "ingesting"},
+        {"_id": "stuck", "scan_time": NOW - timedelta(days=2), "status": "error"}]
+
+    assert _ids(expired_scans(scans, RetentionPolicy(keep_all_days=0, daily_days=1), NOW)) == ["stuck"]
+
+
+def _version(key, valid_from, valid_to):
+    return {"account_id": "acct", "collection": "things", "key": [key], "valid_from": valid_from,
+            "valid_to": valid_to}
+
+
+def test_compact_history_keeps_versions_kept_scans_see(mongo_db, engine):
+    t = [NOW - timedelta(days=d) for d in (40, 30, 20, 10)]  # scans, oldest first
+    mongo_db["resource_history"].insert_many([
+        _version("before-kept", t[0], t[1]),          # ended by the oldest kept scan (t1)
+        _version("between-dropped", t[2], t[3]),      # only the dropped scan t2 saw it
+        _version("seen-by-t1", t[1], t[3]),           # the kept scan t1 still sees it
+        _version("open", t[3], None),
+    ])
+
+    engine._compact_history("acct", kept_times=[t[1], t[3]], expired_times=[t[0], t[2]], run=_run())
+
+    assert sorted(doc["key"][0] for doc in mongo_db["resource_history"].find()) == ["open", "seen-by-t1"]
+
+
+def _ingested_scans(db, *ages):
+    for n, age in enumerate(ages):
+        db["scans"].insert_one({"_id": f"scan-{n}", "account_id": "acct", "scan_time": NOW - age,
+                                "status": "completed"})
+        db["account_summaries"].insert_one({"scan_id": f"scan-{n}", "account_id": "acct"})
+
+
+def test_apply_account_deletes_expired_scans_and_bumps_the_generation(mongo_db, engine):
+    _ingested_scans(mongo_db, timedelta(hours=1), timedelta(days=10))
+    set_policy("acct", RetentionPolicy(keep_all_days=1))
+    run = _run()
+
+    engine.apply_account("acct", run, now=NOW)
+
+    assert run["scans_deleted"] == 1
+    assert [scan["_id"] for scan in mongo_db["scans"].find()] == ["scan-0"]
+    assert mongo_db["account_summaries"].count_documents({}) == 1
+    assert mongo_db["cache_generations"].find_one({"_id": "acct"})["generation"] == 1
+
+
+def test_dry_run_deletes_nothing_and_keeps_the_generation(mongo_db, engine):
+    _ingested_scans(mongo_db, timedelta(hours=1), timedelta(days=10))
+    set_policy("acct", RetentionPolicy(keep_all_days=1))
+    run = _run(dry_run=True)
+
+    engine.apply_account("acct", run, now=NOW)
+
+    assert run["scans_deleted"] == 1
+    assert mongo_db["scans"].count_documents({}) == 2
+    assert mongo_db["cache_generations"].find_one({"_id": "acct"}) is None
+
+
+def test_nothing_expired_keeps_the_generation(mongo_db, engine):
+    _ingested_scans(mongo_db, timedelta(hours=1))
+    set_policy("acct", RetentionPolicy(keep_all_days=1))
+
+    engine.apply_account("acct", _run(), now=NOW)
+
+    assert mongo_db["cache_generations"].find_one({"_id": "acct"}) is None
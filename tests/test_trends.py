@@ -0,0 +1,140 @@
+import threading
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+import trends
+from migrations import run_migrations
+from queries import QueryError
+from trends import (FINDINGS_TRENDS_COLLECTION, TREND_SCANS_COLLECTION, TrendCounter, _delta, bucket_start,
+                    find_trends, record_scan_trends)
+
+DAY = datetime(2024, 3, 6, 15, 30, tzinfo=timezone.utc)  # a Wednesday
+
+
+@pytest.fixture
+def migrated(mongo_db):
+    run_migrations()
+    return mongo_db
+
+
+def _counter(**rules):
+    counter = TrendCounter()
+    counter.add_last_run({"summary": {"ec2": {"flagged_items": sum(rules.values()), "checked_items": 10}}})
+    counter.add_service("ec2", {"findings": {rule: {"level": "danger", "flagged_items": count, "checked_items": 10}
+                                             for rule, count in rules.items()}})
+    return counter
+
+
+def _bucket(db, scope, period="day", account_id=None):
+    return db[FINDINGS_TRENDS_COLLECTION].find_one({"scope": scope, "period": period, "account_id": account_id})
+
+
+def test_bucket_start():
+    assert bucket_start(DAY, "day") == datetime(2024, 3, 6, tzinfo=timezone.utc)
+    assert bucket_start(DAY, "week") == datetime(2024, 3, 4, tzinfo=timezone.utc)
+
+
+def test_delta():
+    new = {"flagged_items": 5, "by_level": {"danger": 5}, "by_rule": {"a": {"flagged_items": 5, "level": "danger"}}}
+    old = {"flagged_items": 3, "by_level": {"danger": 2, "warning": 1}, "by_rule": {"a": {"flagged_items": 3}}}
+
+    assert _delta(new, old) == {"flagged_items": 2, "by_level.danger": 3, "by_level.warning": -1,
+                                "by_rule.a.flagged_items": 2}
+    assert _delta(new, new) == {}
+
+
+def test_counter_point():
+    point = _counter(a=2, b=3).point()
+
+    assert point["flagged_items"] == 5
+    assert point["by_level"] == {"danger": 5}
+    assert point["by_service"]["ec2"]["checked_items"] == 10
+
+
+def test_scan_is_recorded_once(migrated):
+    assert record_scan_trends("acct-1", DAY, _counter(a=2)) is True
+    assert record_scan_trends("acct-1", DAY, _counter(a=2)) is False
+
+    assert _bucket(migrated, "org")["flagged_items"] == 2
+    assert _bucket(migrated, "org")["scans"] == 1
+    assert migrated[trends.FINDINGS_TIMESERIES_COLLECTION].count_documents({"meta.rule": "a"}) == 1
+
+
+def test_concurrent_recordings_of_one_scan_count_once(migrated, monkeypatch):
+    update_buckets = trends._update_buckets
+
+    def slow_update_buckets(*args):
+        time.sleep(0.05)
+        update_buckets(*args)
+
+    monkeypatch.setattr(trends, "_update_buckets", slow_update_buckets)
+    barrier = threading.Barrier(8)
+    results = []
+
+    def record():
+        barrier.wait()
+        results.append(record_scan_trends("acct-1", DAY, _counter(a=2)))
+
+    threads = [threading.Thread(target=record) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(True) == 1
+    assert _bucket(migrated, "org")["flagged_items"] == 2
+    assert _bucket(migrated, "org", "week")["scans"] == 1
+
+
+def test_failed_recording_can_be_retried(migrated, monkeypatch):
+    update_buckets = trends._update_buckets
+
+    def fail(*args):
+        raise RuntimeError("down")
+
+    monkeypatch.setattr(trends, "_update_buckets", fail)
+    with pytest.raises(RuntimeError):
+        record_scan_trends("acct-1", DAY, _counter(a=2))
+    assert migrated[TREND_SCANS_COLLECTION].count_documents({}) == 0
+
+    monkeypatch.setattr(trends, "_update_buckets", update_buckets)
+    assert record_scan_trends("acct-1", DAY, _counter(a=2)) is True
+
+
+def test_latest_scan_of_a_period_wins(migrated):
+    record_scan_trends("acct-1", DAY, _counter(a=2))
+    record_scan_trends("acct-1", DAY.replace(hour=18), _counter(a=5))
+    # An earlier scan backfilled afterwards doesn't replace the later one
+    record_scan_trends("acct-1", DAY.replace(hour=9), _counter(a=1))
+
+    account = _bucket(migrated, "account", account_id="acct-1")
+    assert account["flagged_items"] == 5 and account["scans"] == 3
+    assert _bucket(migrated, "org")["flagged_items"] == 5
+
+
+def test_org_buckets_sum_the_accounts(migrated):
+    record_scan_trends("acct-1", DAY, _counter(a=2))
+    record_scan_trends("acct-2", DAY, _counter(a=1, b=4))
+
+    org = _bucket(migrated, "org")
+    assert org["flagged_items"] == 7
+    assert org["accounts"] == 2
+    assert org["by_rule"]["a"]["flagged_items"] == 3
+
+
+def test_find_trends(migrated):
+    record_scan_trends("acct-1", DAY, _counter(a=2, b=1))
+    record_scan_trends("acct-1", DAY.replace(day=8), _counter(a=4))
+    since, until = datetime(2024, 3, 1, tzinfo=timezone.utc), datetime(2024, 3, 31, tzinfo=timezone.utc)
+
+    points = find_trends("acct-1", "day", since, until)["points"]
+    assert [point["flagged_items"] for point in points] == [3, 4]
+    assert [point["flagged_items"] for point in find_trends(None, "week", since, until)["points"]] == [4]
+    assert [point["by_rule"] for point in find_trends("acct-1", "day", since, until, rule="b")["points"]] == \
+        [{"b": 1}, {}]
+    with pytest.raises(QueryError):
+        find_trends("acct-1", "month", since, until)
+    with pytest.raises(QueryError):
+        find_trends("acct-1", "day", until, since)
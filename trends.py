@@ -0,0 +1,372 @@
+# trends.py
+import os
+import sys
+import json
+import logging
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, ExecutionTimeout
+from mongo_connect import db
+from history import report_scan_time
+from parser import ScoutSuiteStreamParser, resolve_report_path
+from queries import MONGO_QUERY_TIMEOUT_MS, QueryError, QueryTimeout
+from report_manager import REPORT_FILE, SCOUT_REPORT_DIR
+from response_cache import bump_generation
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Raw points: one per rule and per service of every scan (a MongoDB time-series collection, migrations.py)
+FINDINGS_TIMESERIES_COLLECTION = "findings_timeseries"
+# Daily and weekly rollups, per account and org-wide
+FINDINGS_TRENDS_COLLECTION = "findings_trends"
+# Scans already recorded, so re-ingesting or backfilling a report doesn't count it twice
+TREND_SCANS_COLLECTION = "findings_trend_scans"
+
+# Raw points expire after this many days (the rollups are kept); 0 keeps them. Applied by the migration.
+TRENDS_RAW_RETENTION_DAYS = int(os.getenv("TRENDS_RAW_RETENTION_DAYS", "90"))
+# Longest range a /trends query may cover
+TRENDS_MAX_RANGE_DAYS = int(os.getenv("TRENDS_MAX_RANGE_DAYS", "366"))
+# Reports the backfill parses at once (one process each)
+TRENDS_BACKFILL_WORKERS = int(os.getenv("TRENDS_BACKFILL_WORKERS", str(os.cpu_count() or 2)))
+
+PERIODS = ("day", "week")
+ACCOUNT_SCOPE = "account"
+ORG_SCOPE = "org"
+
+# Per-service counts taken from last_run.summary
+_SERVICE_FIELDS = ("checked_items", "flagged_items", "resources_count", "rules_count")
+
+
+def bucket_start(when: datetime, period: str) -> datetime:
+    """Start of the UTC day, or of the week (Monday), `when` falls in."""
+    when = when.astimezone(timezone.utc)
+    day = datetime(when.year, when.month, when.day, tzinfo=timezone.utc)
+    return day if period == "day" else day - timedelta(days=day.weekday())
+
+
+class TrendCounter:
+    """
+    What one scan contributes to the trends: flagged items per rule (with
+    its service and level) from the findings, and per-service counts from
+    last_run.summary. Filled one service section at a time, so it works on
+    streamed reports too.
+    """
+
+    def __init__(self):
+        self.by_rule: Dict[str, Dict[str, Any]] = {}
+        self.by_service: Dict[str, Dict[str, int]] = {}
+
+    def add_last_run(self, last_run: Any) -> None:
+        summary = last_run.get("summary") if isinstance(last_run, dict) else None
+        for service, counts in (summary or {}).items():
+            if isinstance(counts, dict):
+                self.by_service[service] = {field: counts.get(field) or 0 for field in _SERVICE_FIELDS}
+
+    def add_service(self, service: str, service_data: Any) -> None:
+        if not isinstance(service_data, dict):
+            return
+        for rule, finding in (service_data.get("findings") or {}).items():
+            if not isinstance(finding, dict) or not finding.get("flagged_items"):
+                continue
+            self.by_rule[rule] = {
+                "service": service,
+                "level": finding.get("level") or "unknown",
+                "flagged_items": finding["flagged_items"],
+                "checked_items": finding.get("checked_items") or 0
+            }
+
+    def point(self) -> Dict[str, Any]:
+        """The scan's counts as stored in a rollup bucket."""
+        by_level: Dict[str, int] = {}
+        for counts in self.by_rule.values():
+            by_level[counts["level"]] = by_level.get(counts["level"], 0) + counts["flagged_items"]
+        return {
+            "flagged_items": sum(by_level.values()),
+            "by_level": by_level,
+            "by_service": self.by_service,
+            "by_rule": self.by_rule
+        }
+
+
+def report_trends(data: Dict[str, Any]) -> TrendCounter:
+    counter = TrendCounter()
+    counter.add_last_run(data.get("last_run"))
+    for service, service_data in (data.get("services") or {}).items():
+        counter.add_service(service, service_data)
+    return counter
+
+
+# -------------------------------------------------------------------
+# Recording
+# -------------------------------------------------------------------
+def _numbers(doc: Dict[str, Any], prefix: str = "") -> Iterator[Tuple[str, int]]:
+    for key, value in doc.items():
+        if isinstance(value, dict):
+            yield from _numbers(value, f"{prefix}{key}.")
+        elif isinstance(value, int) and not isinstance(value, bool):
+            yield f"{prefix}{key}", value
+
+
+def _delta(new: Dict[str, Any], old: Dict[str, Any]) -> Dict[str, int]:
+    """Per dotted field, how much the counts of `new` differ from `old`."""
+    delta = dict(_numbers(new))
+    for field, value in _numbers(old):
+        delta[field] = delta.get(field, 0) - value
+    return {field: value for field, value in delta.items() if value}
+
+
+def _update_buckets(account_id: str, period: str, scan_time: datetime, point: Dict[str, Any]) -> None:
+    """
+    Puts the scan in the account's bucket of the period, where the latest
+    scan of the period wins (counts are a state, not events), then applies
+    the difference to the org-wide bucket, which thus holds the sum over
+    the accounts scanned in the period. The swap is one atomic
+    find_one_and_update, so the previous counts subtracted are exact.
+    """
+    start = bucket_start(scan_time, period)
+    key = {"scope": ACCOUNT_SCOPE, "account_id": account_id, "period": period, "start": start}
+    update = {"$set": {**point, "as_of": scan_time}, "$inc": {"scans": 1}}
+    projection = {"_id": False, "flagged_items": True, "by_level": True, "by_service": True, "by_rule": True}
+    collection = db[FINDINGS_TRENDS_COLLECTION]
+    try:
+        previous = collection.find_one_and_update({**key, "as_of": {"$lte": scan_time}}, update, projection,
+                                                  upsert=True, return_document=ReturnDocument.BEFORE)
+    except DuplicateKeyError:
+        # The bucket holds a later scan (backfills come in any order), or was just created
+        previous = collection.find_one_and_update({**key, "as_of": {"$lte": scan_time}}, update, projection,
+                                                  return_document=ReturnDocument.BEFORE)
+        if previous is None:
+            collection.update_one(key, {"$inc": {"scans": 1}})
+            collection.update_one({"scope": ORG_SCOPE, "account_id": None, "period": period, "start": start},
+                                  {"$inc": {"scans": 1}})
+            return
+
+    org_update: Dict[str, Any] = {"$inc": {**_delta(point, previous or {}), "scans": 1,
+                                           "accounts": 0 if previous else 1}}
+    labels = {f"by_rule.{rule}.{field}": counts[field]
+              for rule, counts in point["by_rule"].items() for field in ("service", "level")}
+    if labels:
+        org_update["$set"] = labels
+    org_key = {"scope": ORG_SCOPE, "account_id": None, "period": period, "start": start}
+    try:
+        collection.update_one(org_key, org_update, upsert=True)
+    except DuplicateKeyError:
+        # Another account's scan created it first
+        collection.update_one(org_key, org_update)
+
+
+def record_scan_trends(account_id: str, scan_time: datetime, counter: TrendCounter,
+                       account_name: Optional[str] = None) -> bool:
+    """
+    Records one scan: its raw points in 'findings_timeseries' and its counts
+    in the daily and weekly rollups of 'findings_trends'. The scan is first
+    claimed in 'findings_trend_scans' (unique on account and scan time), so
+    of two ingests or backfills of the same report running at once only one
+    touches the buckets; a scan already recorded is skipped. Returns whether
+    it was recorded.
+    """
+    point = counter.point()
+    scan_key = {"account_id": account_id, "scan_time": scan_time}
+    try:
+        db[TREND_SCANS_COLLECTION].insert_one({**scan_key, "account_name": account_name,
+                                               "flagged_items": point["flagged_items"],
+                                               "recorded_at": datetime.now(timezone.utc)})
+    except DuplicateKeyError:
+        return False
+
+    try:
+        for period in PERIODS:
+            _update_buckets(account_id, period, scan_time, point)
+
+        raw = [{"time": scan_time, "meta": {"account_id": account_id, "service": counts["service"], "rule": rule,
+                                            "level": counts["level"]},
+                "flagged_items": counts["flagged_items"], "checked_items": counts["checked_items"]}
+               for rule, counts in counter.by_rule.items()]
+        raw.extend({"time": scan_time, "meta": {"account_id": account_id, "service": service}, **counts}
+                   for service, counts in counter.by_service.items())
+        if raw:
+            db[FINDINGS_TIMESERIES_COLLECTION].insert_many(raw, ordered=False)
+    except Exception:
+        # Let a later ingest of the report record it
+        db[TREND_SCANS_COLLECTION].delete_one(scan_key)
+        raise
+    return True
+
+
+# -------------------------------------------------------------------
+# Queries
+# -------------------------------------------------------------------
+def _filtered_rules(by_rule: Dict[str, Dict[str, Any]], rule: Optional[str], service: Optional[str],
+                    level: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    return {name: counts for name, counts in by_rule.items() if counts.get("flagged_items")
+            and (rule is None or name == rule) and (service is None or counts.get("service") == service)
+            and (level is None or counts.get("level") == level)}
+
+
+def find_trends(account_id: Optional[str], period: str, since: datetime, until: datetime,
+                rule: Optional[str] = None, service: Optional[str] = None, level: Optional[str] = None,
+                by_rule: bool = False) -> Dict[str, Any]:
+    """
+    Flagged item counts per day or week in [since, until], of one account,
+    or org-wide when `account_id` is None, read from the rollup buckets:
+    a year of daily org-wide points is 366 documents whatever the number
+    of accounts. `rule`/`service`/`level` restrict the counts to matching
+    rules; `by_rule` adds the count of each rule to every point. Periods
+    without a scan have no point.
+    """
+    if period not in PERIODS:
+        raise QueryError(f"Invalid period '{period}'; one of: {', '.join(PERIODS)}")
+    if since > until:
+        raise QueryError("from must not be after to")
+    if until - since > timedelta(days=TRENDS_MAX_RANGE_DAYS):
+        raise QueryError(f"Range is longer than {TRENDS_MAX_RANGE_DAYS} days")
+
+    filtered = rule is not None or service is not None or level is not None
+    projection: Dict[str, Any] = {"_id": False, "scope": False, "period": False}
+    if rule is not None and service is None and level is None:
+        # Only that rule's counts leave the server
+        projection = {"_id": False, "start": True, "as_of": True, "scans": True, "accounts": True,
+                      f"by_rule.{rule}": True}
+    elif not filtered and not by_rule:
+        projection["by_rule"] = False
+
+    query = {"scope": ORG_SCOPE if account_id is None else ACCOUNT_SCOPE, "account_id": account_id,
+             "period": period, "start": {"$gte": bucket_start(since, period), "$lte": until}}
+    try:
+        buckets = list(db[FINDINGS_TRENDS_COLLECTION].find(query, projection).sort("start", 1)
+                       .max_time_ms(MONGO_QUERY_TIMEOUT_MS))
+    except ExecutionTimeout as e:
+        raise QueryTimeout(str(e))
+
+    points = []
+    for bucket in buckets:
+        point = {"start": bucket["start"].replace(tzinfo=timezone.utc).isoformat(), "scans": bucket.get("scans", 0)}
+        if account_id is None:
+            point["accounts"] = bucket.get("accounts", 0)
+        else:
+            point["as_of"] = bucket["as_of"].replace(tzinfo=timezone.utc).isoformat()
+        rules = bucket.get("by_rule") or {}
+        if filtered:
+            rules = _filtered_rules(rules, rule, service, level)
+            by_level: Dict[str, int] = {}
+            for counts in rules.values():
+                by_level[counts.get("level")] = by_level.get(counts.get("level"), 0) + counts.get("flagged_items", 0)
+            point["flagged_items"] = sum(by_level.values())
+            point["by_level"] = by_level
+        else:
+            point["flagged_items"] = bucket.get("flagged_items", 0)
+            point["by_level"] = bucket.get("by_level") or {}
+        if service is not None:
+            point["service"] = (bucket.get("by_service") or {}).get(service, {})
+        if filtered or by_rule:
+            point["by_rule"] = {name: counts.get("flagged_items", 0) for name, counts in rules.items()
+                                if counts.get("flagged_items")}
+        points.append(point)
+    return {"scope": ORG_SCOPE if account_id is None else ACCOUNT_SCOPE, "account_id": account_id,
+            "period": period, "from": since.isoformat(), "to": until.isoformat(), "points": points}
+
+
+# -------------------------------------------------------------------
+# Backfill from the report archive
+# -------------------------------------------------------------------
+def archived_reports(report_dir: str = SCOUT_REPORT_DIR,
+                     accounts: Optional[List[str]] = None) -> List[Tuple[str, str, str]]:
+    """(account_name, timestamp, path) of every report under reports/scout, compressed or not."""
+    reports = []
+    for account in sorted(accounts or os.listdir(report_dir)):
+        account_dir = os.path.join(report_dir, account)
+        if not os.path.isdir(account_dir):
+            continue
+        for timestamp in sorted(os.listdir(account_dir)):
+            try:
+                reports.append((account, timestamp,
+                                resolve_report_path(os.path.join(account_dir, timestamp, REPORT_FILE))))
+            except FileNotFoundError:
+                continue
+    return reports
+
+
+def backfill_report(account_name: str, path: str) -> Dict[str, Any]:
+    """
+    Records the trends of one archived report. Only the header and the
+    findings are looked at, section by section, and nothing else of the
+    account is touched (unlike re-ingesting an old report).
+    """
+    stream = ScoutSuiteStreamParser(path)
+    counter = TrendCounter()
+    for key, value in stream.iter_sections():
+        if key == "last_run":
+            counter.add_last_run(value)
+        elif key.startswith("services."):
+            counter.add_service(key.split(".", 1)[1], value)
+    if not stream.account_id:
+        raise KeyError(f"No 'account_id' found in {path}")
+    scan_time = report_scan_time(stream.header)
+    recorded = record_scan_trends(stream.account_id, scan_time, counter, account_name=account_name)
+    if recorded:
+        # Cached /trends responses of this account are stale now
+        bump_generation(stream.account_id)
+    return {"account_id": stream.account_id, "scan_time": scan_time, "recorded": recorded}
+
+
+def backfill(report_dir: str = SCOUT_REPORT_DIR, accounts: Optional[List[str]] = None,
+             workers: int = TRENDS_BACKFILL_WORKERS) -> Dict[str, Any]:
+    """
+    Records the trends of every archived report, `workers` reports at a
+    time in separate processes (parsing is CPU-bound). Reports already
+    recorded are skipped, so it can be re-run; the rollups don't depend
+    on the order reports come in.
+    """
+    started = time.perf_counter()
+    reports = archived_reports(report_dir, accounts)
+    counts = {"reports": len(reports), "recorded": 0, "skipped": 0, "failed": 0}
+
+    def _done(path: str, result: Optional[Dict[str, Any]], error: Optional[Exception]) -> None:
+        if error is not None:
+            logger.error(f"Failed to backfill trends from {path}: {str(error)}")
+            counts["failed"] += 1
+        else:
+            counts["recorded" if result["recorded"] else "skipped"] += 1
+
+    if workers <= 1:
+        for account, _, path in reports:
+            try:
+                _done(path, backfill_report(account, path), None)
+            except Exception as e:
+                _done(path, None, e)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(backfill_report, account, path): path for account, _, path in reports}
+            for future in as_completed(futures):
+                try:
+                    _done(futures[future], future.result(), None)
+                except Exception as e:
+                    _done(futures[future], None, e)
+    counts["seconds"] = round(time.perf_counter() - started, 3)
+    logger.info(f"Trends backfill: {counts}")
+    return counts
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    arg_parser = argparse.ArgumentParser(description="Findings trends.")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    fill = commands.add_parser("backfill", help="record the trends of the reports archived under reports/scout")
+    fill.add_argument("--report-dir", default=SCOUT_REPORT_DIR)
+    fill.add_argument("--account", action="append", dest="accounts", help="only this account (repeatable)")
+    fill.add_argument("--workers", type=int, default=TRENDS_BACKFILL_WORKERS)
+    args = arg_parser.parse_args(argv)
+
+    counts = backfill(args.report_dir, args.accounts, args.workers)
+    print(json.dumps(counts, indent=2))
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())